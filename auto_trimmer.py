@@ -1,15 +1,125 @@
-import cv2
 import numpy as np
 import os
 import argparse
 
-def auto_trim(file_path, output_dir, padding=10):
+import instrumentation
+from image_io import IMAGE_EXTS, decode_image, save_png, parse_png
+from parallel import run_tasks
+
+ALPHA_THRESHOLD = 0   # alpha values above this count as content (raise to ignore faint noise)
+
+def alpha_bbox(alpha, alpha_threshold=ALPHA_THRESHOLD):
+    """
+    Returns the (x, y, w, h) bounding box of the pixels with alpha > alpha_threshold,
+    or None if there are none. Uses row / column maxima, so no per-pixel point
+    list or full-size mask is allocated.
+    """
+    rows = np.flatnonzero(alpha.max(axis=1) > alpha_threshold)
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(alpha.max(axis=0) > alpha_threshold)
+    return int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)
+
+def pad_box(rect, padding, width, height):
+    """
+    Turns an (x, y, w, h) rect into a crop box (x_start, y_start, x_end, y_end)
+    grown by padding and clipped to width x height.
+    """
+    x, y, w, h = rect
+    return max(0, x - padding), max(0, y - padding), min(width, x + w + padding), min(height, y + h + padding)
+
+def trim_bbox(img, padding=10, alpha_threshold=ALPHA_THRESHOLD):
+    """
+    Returns the padded crop box (x_start, y_start, x_end, y_end) of the
+    non-transparent content of a BGRA image, or None if it is fully transparent.
+    """
+    with instrumentation.span("trim"):
+        return _trim_bbox(img, padding, alpha_threshold)
+
+def _trim_bbox(img, padding, alpha_threshold=ALPHA_THRESHOLD):
+    rect = alpha_bbox(img[:, :, 3], alpha_threshold)
+    if rect is None:
+        return None
+    height, width = img.shape[:2]
+    return pad_box(rect, padding, width, height)
+
+def trim_bboxes(imgs, padding=10, alpha_threshold=ALPHA_THRESHOLD):
+    """
+    Batch trim_bbox: imgs is an (N, H, W, 4) stack or a list of BGRA images.
+    A stack (or a list of same-size images) is reduced in one pass per axis.
+    Returns a list of crop boxes (None for fully transparent images); crop with
+    img[y_start:y_end, x_start:x_end] to get zero-copy views.
+    """
+    with instrumentation.span("trim"):
+        if isinstance(imgs, np.ndarray) and imgs.ndim == 4:
+            stacks = [imgs]
+        elif len(imgs) and len({img.shape for img in imgs}) == 1:
+            stacks = [np.stack(imgs)]
+        else:
+            return [_trim_bbox(img, padding, alpha_threshold) for img in imgs]
+
+        boxes = []
+        for stack in stacks:
+            alpha = stack[..., 3]
+            row_hits = alpha.max(axis=2) > alpha_threshold   # (N, H)
+            col_hits = alpha.max(axis=1) > alpha_threshold   # (N, W)
+            height, width = alpha.shape[1:]
+            for rows, cols in zip(row_hits, col_hits):
+                rows = np.flatnonzero(rows)
+                if not len(rows):
+                    boxes.append(None)
+                    continue
+                cols = np.flatnonzero(cols)
+                rect = (int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1))
+                boxes.append(pad_box(rect, padding, width, height))
+        return boxes
+
+def trim_alpha(img, padding=10, alpha_threshold=ALPHA_THRESHOLD):
+    """
+    Crops a decoded BGRA image to its non-transparent content with padding.
+    Returns None if the image is fully transparent.
+    """
+    box = trim_bbox(img, padding, alpha_threshold)
+    if box is None:
+        return None
+
+    # Crop
+    x_start, y_start, x_end, y_end = box
+    return img[y_start:y_end, x_start:x_end]
+
+def trim_stage(items, padding=10, on_skip=None, alpha_threshold=ALPHA_THRESHOLD):
+    """
+    Streaming trim stage: for each (name, img, metadata) item yields
+    (f"{name}_trimmed", cropped view, metadata) with "bbox" added.
+    alpha_threshold: alpha values up to this are treated as transparent.
+    Images without alpha or fully transparent are dropped; on_skip(name, reason) is called for them.
+    """
+    for name, img, meta in items:
+        if img.ndim != 3 or img.shape[2] != 4:
+            if on_skip:
+                on_skip(name, "No alpha channel found.")
+            continue
+
+        with instrumentation.span("trim", image=name):
+            box = _trim_bbox(img, padding, alpha_threshold)
+        if box is None:
+            if on_skip:
+                on_skip(name, "Image is fully transparent.")
+            continue
+
+        x_start, y_start, x_end, y_end = box
+        yield f"{name}_trimmed", img[y_start:y_end, x_start:x_end], dict(meta, bbox=box)
+
+@instrumentation.traced("file")
+def auto_trim(file_path, output_dir, padding=10, png=None, alpha_threshold=ALPHA_THRESHOLD):
     """
     Automatically crops the image to the non-transparent content with padding.
+    png: PNG encoder settings (image_io.png_params)
+    alpha_threshold: alpha values up to this are treated as transparent
     """
     try:
         # Read image with alpha channel
-        img = cv2.imdecode(np.fromfile(file_path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        img = decode_image(file_path)
         if img is None:
             print(f"Error: Could not read {file_path}")
             return
@@ -22,48 +132,27 @@ def auto_trim(file_path, output_dir, padding=10):
         print(f"Skipping {file_path}: No alpha channel found.")
         return
 
-    # Extract alpha channel
-    alpha = img[:, :, 3]
+    cropped = trim_alpha(img, padding, alpha_threshold)
 
-    # Find all non-zero points (non-transparent)
-    points = cv2.findNonZero(alpha)
-
-    if points is None:
+    if cropped is None:
         print(f"Skipping {file_path}: Image is fully transparent.")
         return
 
-    # Get bounding rect
-    x, y, w, h = cv2.boundingRect(points)
-
-    # Add padding
-    height, width = img.shape[:2]
-    
-    x_start = max(0, x - padding)
-    y_start = max(0, y - padding)
-    x_end = min(width, x + w + padding)
-    y_end = min(height, y + h + padding)
-
-    # Crop
-    cropped = img[y_start:y_end, x_start:x_end]
-
     # Save
     filename = os.path.splitext(os.path.basename(file_path))[0]
     output_filename = f"{filename}_trimmed.png"
     output_path = os.path.join(output_dir, output_filename)
 
-    is_success, im_buf = cv2.imencode(".png", cropped)
-    if is_success:
-        im_buf.tofile(output_path)
-        print(f"Saved: {output_path} (Size: {x_end-x_start}x{y_end-y_start})")
+    if save_png(cropped, output_path, png):
+        print(f"Saved: {output_path} (Size: {cropped.shape[1]}x{cropped.shape[0]})")
     else:
         print(f"Failed to save {output_path}")
 
-def process_auto_trimmer(input_dir, output_dir, padding=10):
+def process_auto_trimmer(input_dir, output_dir, padding=10, workers=1, png=None, alpha_threshold=ALPHA_THRESHOLD):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    exts = ('.png', '.jpg', '.jpeg')
-    files = [f for f in os.listdir(input_dir) if f.lower().endswith(exts)]
+    files = [f for f in os.listdir(input_dir) if f.lower().endswith(IMAGE_EXTS)]
     
     if not files:
         print(f"No images found in '{input_dir}'.")
@@ -71,9 +160,8 @@ def process_auto_trimmer(input_dir, output_dir, padding=10):
 
     print(f"Processing {len(files)} images with padding {padding}...")
     
-    for f in files:
-        file_path = os.path.join(input_dir, f)
-        auto_trim(file_path, output_dir, padding)
+    tasks = [(os.path.join(input_dir, f), output_dir, padding, png, alpha_threshold) for f in files]
+    run_tasks(auto_trim, tasks, workers)
         
     print("Done!")
 
@@ -82,6 +170,10 @@ def main():
     parser.add_argument("--input", default="input_trim", help="Input directory")
     parser.add_argument("--output", default="output_trim", help="Output directory")
     parser.add_argument("--padding", type=int, default=10, help="Padding around the content in pixels")
+    parser.add_argument("--alpha_threshold", type=int, default=ALPHA_THRESHOLD, help="Alpha values up to this count as transparent (0-254)")
+    parser.add_argument("--png", default="default", help="PNG encoder: default, fast (intermediates), max (smallest) or LEVEL[,STRATEGY[,FILTER]]")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel workers (0 = all CPU cores)")
+    parser.add_argument("--profile", default=None, help="Write a timing/memory report (JSON) to this path")
     
     args = parser.parse_args()
 
@@ -89,7 +181,19 @@ def main():
         print(f"Error: '{args.input}' directory not found.")
         return
 
-    process_auto_trimmer(args.input, args.output, args.padding)
+    try:
+        png = parse_png(args.png)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+
+    if args.profile:
+        instrumentation.enable()
+
+    process_auto_trimmer(args.input, args.output, args.padding, args.workers, png, args.alpha_threshold)
+
+    if args.profile:
+        instrumentation.finish(args.profile)
 
 if __name__ == "__main__":
     main()
@@ -4,6 +4,10 @@ import os
 import argparse
 from collections import Counter
 
+import instrumentation
+from image_io import IMAGE_EXTS, decode_image, to_bgra, save_png, parse_png, EncodePool
+from parallel import run_tasks
+
 def detect_bg_color_cv(img):
     """
     Detects background color from top-left and top-right corners using OpenCV.
@@ -25,22 +29,323 @@ def detect_bg_color_cv(img):
     most_common = Counter(corners_tuple).most_common(1)[0][0]
     return np.array(most_common, dtype=np.uint8)
 
-def process_remover(input_dir, output_dir, mode="flood", tolerance=30, color="255,255,255", erosion=0):
+def parse_color(color):
+    """
+    Parses an "R,G,B" string into a BGR numpy array.
+    Returns None if the string is invalid.
+    """
+    try:
+        rgb = list(map(int, color.split(',')))
+        return np.array(rgb[::-1], dtype=np.uint8) # RGB to BGR
+    except:
+        return None
+
+def flood_mask(mask):
+    """
+    Keeps only the regions of a 0/255 key mask that are 4-connected to the
+    top corners (左上・右上のみ。スタンプ本体が左下・右下に見切れる場合を考慮).
+    Seeded floodFill only visits the background region itself, instead of
+    labelling every component of the image.
+    """
+    h, w = mask.shape[:2]
+    # floodFill needs a (h+2, w+2) mask; MASK_ONLY leaves the key mask untouched
+    filled = np.zeros((h + 2, w + 2), np.uint8)
+    flags = 4 | cv2.FLOODFILL_MASK_ONLY | (255 << 8)
+    for x in (0, w - 1):
+        if mask[0, x] and not filled[1, x + 1]:
+            cv2.floodFill(mask, filled, (x, 0), 0, 0, 0, flags)
+    return filled[1:-1, 1:-1].copy()
+
+def _flood_mask_components(mask):
+    """
+    Previous flood implementation (connected components over the whole image).
+    Kept as the reference for benchmark.py; output is identical to flood_mask.
+    """
+    h, w = mask.shape[:2]
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=4)
+
+    # Check top corners only
+    corner_labels = set()
+    corner_labels.add(labels[0, 0])     # 左上
+    corner_labels.add(labels[0, w-1])   # 右上
+
+    # Create new mask only for these labels
+    final_mask = np.zeros_like(mask)
+    for label in corner_labels:
+        if label == 0: continue # connectedComponents treats 0 (non-key pixels) as background
+        final_mask[labels == label] = 255
+    return final_mask
+
+def key_bounds(bg_color, tolerance):
+    """
+    Returns the (lower, upper) inRange bounds for a BGRA image: BGR +/- tolerance,
+    any alpha. Matching all 4 channels of the contiguous image is much faster
+    than inRange on the non-contiguous img[:, :, :3] view, with the same result.
+    """
+    bg_color_int = np.asarray(bg_color[:3]).astype(np.int16)
+    lower = np.clip(bg_color_int - tolerance, 0, 255).astype(np.uint8)
+    upper = np.clip(bg_color_int + tolerance, 0, 255).astype(np.uint8)
+    return np.append(lower, 0).astype(np.uint8), np.append(upper, 255).astype(np.uint8)
+
+def remove_background(img, mode="flood", tolerance=30, target_bgr=None, erosion=0):
+    """
+    Removes the background of a decoded BGRA image in memory.
+    target_bgr: BGR color used in 'color' mode.
+    Returns the BGRA result.
+    """
+    with instrumentation.span("bg"):
+        return _remove_background(img, mode, tolerance, target_bgr, erosion)
+
+def _remove_background(img, mode, tolerance, target_bgr, erosion):
+    # Determine background color
+    if mode == "color":
+        bg_color = target_bgr
+    else:
+        bg_color = detect_bg_color_cv(img)
+
+    # Create Mask
+    # 1. Color Key / Auto Color (Global)
+    lower, upper = key_bounds(bg_color, tolerance)
+    with instrumentation.span("bg.inrange"):
+        mask = cv2.inRange(img, lower, upper)
+
+    return _apply_key_mask(img, mask, mode, erosion)
+
+def _apply_key_mask(img, mask, mode, erosion):
+    """
+    Flood / erosion / alpha steps shared by every way of computing the key mask.
+    """
+    # 2. Flood Fill (Connected components from corners)
+    if mode == "flood":
+        with instrumentation.span("bg.flood"):
+            mask = flood_mask(mask)
+
+    # Erosion (Fringe Removal)
+    # Dilate the BACKGROUND mask = Erode the FOREGROUND
+    if erosion > 0:
+        with instrumentation.span("bg.dilate"):
+            kernel = np.ones((3, 3), np.uint8)
+            mask = cv2.dilate(mask, kernel, iterations=erosion)
+
+    with instrumentation.span("bg.alpha"):
+        # Apply Alpha
+        alpha = cv2.bitwise_not(mask)
+        
+        # Combine
+        b, g, r, a = cv2.split(img)
+        final_alpha = cv2.bitwise_and(a, alpha)
+        return cv2.merge([b, g, r, final_alpha])
+
+def key_distance(img, bg_color):
+    """
+    Per-pixel distance of a BGRA image to bg_color: max(|B-b|, |G-g|, |R-r|) as uint8.
+    inRange(img, bg - tolerance, bg + tolerance) is exactly key_distance(...) <= tolerance,
+    so one map gives the key mask for any tolerance (see tolerance_mask).
+    """
+    with instrumentation.span("bg.distance"):
+        b, g, r = (int(c) for c in bg_color[:3])
+        diff = cv2.absdiff(img, (b, g, r, 0))
+        db, dg, dr, _ = cv2.split(diff)
+        return cv2.max(cv2.max(db, dg), dr)
+
+def tolerance_mask(distance, tolerance):
+    """
+    Key mask (255 = background color) for one tolerance, from a key_distance map.
+    """
+    return cv2.inRange(distance, 0, int(tolerance))
+
+def remove_background_multi(img, tolerances, mode="flood", target_bgr=None, erosion=0, distance=None):
+    """
+    Removes the background for several tolerances from one distance map.
+    distance: precomputed key_distance(img, bg) (e.g. memoized by preview.PreviewRenderer); computed when None.
+    Returns {tolerance: BGRA result}, each identical to remove_background(img, mode, tolerance, ...).
+    """
+    if distance is None:
+        bg_color = target_bgr if mode == "color" else detect_bg_color_cv(img)
+        distance = key_distance(img, bg_color)
+    results = {}
+    for tolerance in tolerances:
+        with instrumentation.span("bg"):
+            results[tolerance] = _apply_key_mask(img, tolerance_mask(distance, tolerance), mode, erosion)
+    return results
+
+def contact_sheet(results, tile=240, checker=16):
+    """
+    Side-by-side preview of {tolerance: BGRA result}: each result is scaled into a
+    tile x tile cell over a checkerboard (transparent areas show the pattern) and
+    labelled with its tolerance. Returns a BGR image.
+    """
+    cells = []
+    for tolerance, img in results.items():
+        h, w = img.shape[:2]
+        scale = min(tile / w, tile / h)
+        new_w, new_h = max(1, int(w * scale)), max(1, int(h * scale))
+        small = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+
+        # Checkerboard background
+        yy, xx = np.indices((tile, tile))
+        cell = np.where(((yy // checker + xx // checker) % 2 == 0)[..., None], 200, 255).astype(np.uint8)
+        cell = np.repeat(cell, 3, axis=2)
+
+        x0 = (tile - new_w) // 2
+        y0 = (tile - new_h) // 2
+        alpha = small[:, :, 3:4].astype(np.float32) / 255
+        region = cell[y0:y0 + new_h, x0:x0 + new_w].astype(np.float32)
+        cell[y0:y0 + new_h, x0:x0 + new_w] = (small[:, :, :3] * alpha + region * (1 - alpha)).astype(np.uint8)
+
+        cv2.putText(cell, f"tol {tolerance}", (6, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0, 0, 0), 3, cv2.LINE_AA)
+        cv2.putText(cell, f"tol {tolerance}", (6, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.55, (255, 255, 255), 1, cv2.LINE_AA)
+        cells.append(cell)
+
+    # 1px dark separators between tiles
+    sep = np.full((tile, 1, 3), 64, np.uint8)
+    row = [cells[0]]
+    for cell in cells[1:]:
+        row += [sep, cell]
+    return np.hstack(row)
+
+def remove_bg_stage(items, mode="flood", tolerance=30, color="255,255,255", erosion=0):
+    """
+    Streaming BG removal stage: for each (name, img, metadata) item yields
+    (f"{name}_processed", BGRA result, metadata) with "key_color" (BGR) added.
+    Raises ValueError for an invalid color in 'color' mode.
+    """
+    target_bgr = None
+    if mode == "color":
+        target_bgr = parse_color(color)
+        if target_bgr is None:
+            raise ValueError(f"Invalid color format: {color!r}. Use R,G,B")
+
+    for name, img, meta in items:
+        with instrumentation.span("bg", image=name):
+            img = to_bgra(img)
+            key_color = target_bgr if mode == "color" else detect_bg_color_cv(img)
+            result = _remove_background(img, mode, tolerance, target_bgr, erosion)
+        yield f"{name}_processed", result, dict(meta, key_color=tuple(int(c) for c in key_color))
+
+@instrumentation.traced("file")
+def remove_file(file_path, output_dir, mode="flood", tolerance=30, target_bgr=None, erosion=0, png=None):
+    """
+    Removes the background of one image file and saves it as <name>_processed.png.
+    png: PNG encoder settings (image_io.png_params)
+    """
+    f = os.path.basename(file_path)
+    try:
+        # Read image
+        img = decode_image(file_path)
+        if img is None: return
+
+        # Ensure 4 channels (BGRA)
+        img = to_bgra(img)
+        
+        final_img = remove_background(img, mode, tolerance, target_bgr, erosion)
+        
+        output_filename = os.path.splitext(f)[0] + "_processed.png"
+        output_path = os.path.join(output_dir, output_filename)
+        
+        if save_png(final_img, output_path, png):
+            print(f"Saved: {output_path}")
+        
+    except Exception as e:
+        print(f"Failed to process {f}: {e}")
+        import traceback
+        traceback.print_exc()
+
+@instrumentation.traced("file")
+def remove_file_multi(file_path, output_dir, tolerances, mode="flood", target_bgr=None, erosion=0,
+                      contact=False, png=None):
+    """
+    Removes the background of one image for every tolerance in tolerances from a single
+    distance map. Results go to <output_dir>/tol_<N>/<name>_processed.png; contact
+    writes <output_dir>/<name>_contact.png with all tolerances side by side.
+    """
+    f = os.path.basename(file_path)
+    name = os.path.splitext(f)[0]
+    try:
+        img = decode_image(file_path)
+        if img is None: return
+        img = to_bgra(img)
+
+        bg_color = target_bgr if mode == "color" else detect_bg_color_cv(img)
+        distance = key_distance(img, bg_color)
+        results = remove_background_multi(img, tolerances, mode, target_bgr, erosion, distance)
+
+        # The contact sheet is rendered while the per-tolerance results are encoded
+        with EncodePool() as pool:
+            output_paths = [os.path.join(output_dir, f"tol_{tolerance}", name + "_processed.png") for tolerance in results]
+            for final_img, output_path in zip(results.values(), output_paths):
+                pool.save(final_img, output_path, png)
+            if contact:
+                contact_path = os.path.join(output_dir, name + "_contact.png")
+                pool.save(contact_sheet(results), contact_path, png)
+            saved = pool.drain()
+
+        for output_path, is_success in zip(output_paths, saved):
+            if is_success:
+                print(f"Saved: {output_path}")
+        if contact and saved[-1]:
+            print(f"Contact sheet: {contact_path}")
+
+    except Exception as e:
+        print(f"Failed to process {f}: {e}")
+        import traceback
+        traceback.print_exc()
+
+def parse_tolerances(value):
+    """
+    "10,20,30" -> [10, 20, 30]
+    """
+    return [int(v) for v in value.split(',') if v.strip()]
+
+def process_remover_multi(input_dir, output_dir, tolerances, mode="flood", color="255,255,255", erosion=0,
+                          workers=1, contact=True, png=None):
+    """
+    Tolerance exploration: one output folder per tolerance (tol_<N>) plus optional contact sheets.
+    The distance map is computed once per image.
+    """
+    target_bgr = None
+    if mode == "color":
+        target_bgr = parse_color(color)
+        if target_bgr is None:
+            print("Error: Invalid color format. Use R,G,B")
+            return
+
+    for tolerance in tolerances:
+        tol_dir = os.path.join(output_dir, f"tol_{tolerance}")
+        if not os.path.exists(tol_dir):
+            os.makedirs(tol_dir)
+
+    files = [f for f in os.listdir(input_dir) if f.lower().endswith(IMAGE_EXTS)]
+
+    if not files:
+        print(f"No images found in '{input_dir}'.")
+        return
+
+    print(f"Processing {len(files)} images. Mode: {mode}, Tolerances: {tolerances}, Erosion: {erosion}")
+
+    tasks = [(os.path.join(input_dir, f), output_dir, tolerances, mode, target_bgr, erosion, contact, png)
+             for f in files]
+    run_tasks(remove_file_multi, tasks, workers)
+
+    print("Done!")
+
+def process_remover(input_dir, output_dir, mode="flood", tolerance=30, color="255,255,255", erosion=0, workers=1,
+                    png=None):
+    """
+    png: PNG encoder settings (image_io.png_params)
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         
     # Parse manual target color
     target_bgr = None
     if mode == "color":
-        try:
-            rgb = list(map(int, color.split(',')))
-            target_bgr = np.array(rgb[::-1], dtype=np.uint8) # RGB to BGR
-        except:
+        target_bgr = parse_color(color)
+        if target_bgr is None:
             print("Error: Invalid color format. Use R,G,B")
             return
 
-    exts = ('.png', '.jpg', '.jpeg')
-    files = [f for f in os.listdir(input_dir) if f.lower().endswith(exts)]
+    files = [f for f in os.listdir(input_dir) if f.lower().endswith(IMAGE_EXTS)]
     
     if not files:
         print(f"No images found in '{input_dir}'.")
@@ -48,92 +353,8 @@ def process_remover(input_dir, output_dir, mode="flood", tolerance=30, color="25
         
     print(f"Processing {len(files)} images. Mode: {mode}, Tolerance: {tolerance}, Erosion: {erosion}")
     
-    for f in files:
-        file_path = os.path.join(input_dir, f)
-        try:
-            # Read image
-            img = cv2.imdecode(np.fromfile(file_path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
-            if img is None: continue
-
-            # Ensure 4 channels (BGRA)
-            if img.shape[2] == 3:
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
-            
-            # Determine background color
-            if mode == "color":
-                bg_color = target_bgr
-            else:
-                bg_color = detect_bg_color_cv(img)
-
-            # Create Mask
-            # 1. Color Key / Auto Color (Global)
-            bg_color_int = bg_color.astype(np.int16)
-            lower = np.clip(bg_color_int - tolerance, 0, 255).astype(np.uint8)
-            upper = np.clip(bg_color_int + tolerance, 0, 255).astype(np.uint8)
-            
-            img_bgr = img[:, :, :3]
-            mask = cv2.inRange(img_bgr, lower, upper)
-            
-            # 2. Flood Fill (Connected components from corners)
-            if mode == "flood":
-                # Create a mask for floodFill (h+2, w+2)
-                h, w = img.shape[:2]
-                flood_mask = np.zeros((h+2, w+2), np.uint8)
-                
-                # Flood fill from corners on the MASK itself? 
-                # No, floodFill works on the image. 
-                # Strategy: Flood fill the original image's background to a specific key color, 
-                # or create a mask where flood filled areas are marked.
-                
-                # Better approach for "Flood" mode in OpenCV:
-                # Use the mask we generated (which has ALL pixels of that color).
-                # Then find connected components connected to the corners.
-                
-                # Find connected components on the mask
-                num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=4)
-                
-                # Check top corners only (左上・右上のみ。スタンプ本体が左下・右下に見切れる場合を考慮)
-                corner_labels = set()
-                corner_labels.add(labels[0, 0])     # 左上
-                corner_labels.add(labels[0, w-1])   # 右上
-                
-                # Create new mask only for these labels
-                final_mask = np.zeros_like(mask)
-                for label in corner_labels:
-                    if label == 0: continue # Label 0 is usually background (black in mask), but here mask is 255 for BG color.
-                    # Wait, inRange returns 255 for match. So background is white (255).
-                    # connectedComponents treats 0 as background.
-                    # So we want components that are 255.
-                    final_mask[labels == label] = 255
-                
-                mask = final_mask
-
-            # Erosion (Fringe Removal)
-            # Dilate the BACKGROUND mask = Erode the FOREGROUND
-            if erosion > 0:
-                kernel = np.ones((3, 3), np.uint8)
-                mask = cv2.dilate(mask, kernel, iterations=erosion)
-
-            # Apply Alpha
-            alpha = cv2.bitwise_not(mask)
-            
-            # Combine
-            b, g, r, a = cv2.split(img)
-            final_alpha = cv2.bitwise_and(a, alpha)
-            final_img = cv2.merge([b, g, r, final_alpha])
-            
-            output_filename = os.path.splitext(f)[0] + "_processed.png"
-            output_path = os.path.join(output_dir, output_filename)
-            
-            is_success, im_buf = cv2.imencode(".png", final_img)
-            if is_success:
-                im_buf.tofile(output_path)
-                print(f"Saved: {output_path}")
-            
-        except Exception as e:
-            print(f"Failed to process {f}: {e}")
-            import traceback
-            traceback.print_exc()
+    tasks = [(os.path.join(input_dir, f), output_dir, mode, tolerance, target_bgr, erosion, png) for f in files]
+    run_tasks(remove_file, tasks, workers)
             
     print("Done!")
 
@@ -146,14 +367,42 @@ def main():
     parser.add_argument("--color", type=str, default="255,255,255", help="Target RGB for 'color' mode")
     parser.add_argument("--input", default="input_remover", help="Input directory")
     parser.add_argument("--output", default="output_remover", help="Output directory")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel workers (0 = all CPU cores)")
+    parser.add_argument("--tolerances", type=str, default=None,
+                        help="Try several tolerances at once, e.g. 10,20,30,40 (outputs to tol_<N>/ subfolders)")
+    parser.add_argument("--no_contact", action="store_true", help="With --tolerances: skip the <name>_contact.png previews")
+    parser.add_argument("--png", default="default", help="PNG encoder: default, fast (intermediates), max (smallest) or LEVEL[,STRATEGY[,FILTER]]")
+    parser.add_argument("--profile", default=None, help="Write a timing/memory report (JSON) to this path")
     
     args = parser.parse_args()
     
     if not os.path.exists(args.input):
         print(f"Error: Input directory '{args.input}' not found.")
         return
+
+    try:
+        png = parse_png(args.png)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
         
-    process_remover(args.input, args.output, args.mode, args.tolerance, args.color, args.erosion)
+    if args.profile:
+        instrumentation.enable()
+
+    if args.tolerances:
+        try:
+            tolerances = parse_tolerances(args.tolerances)
+        except ValueError:
+            print("Error: Invalid tolerances. Use e.g. 10,20,30")
+            return
+        process_remover_multi(args.input, args.output, tolerances, args.mode, args.color, args.erosion, args.workers,
+                              contact=not args.no_contact, png=png)
+    else:
+        process_remover(args.input, args.output, args.mode, args.tolerance, args.color, args.erosion, args.workers,
+                        png=png)
+
+    if args.profile:
+        instrumentation.finish(args.profile)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import cv2
+import numpy as np
+
+from synthetic_sheets import BG_COLORS, write_sheets
+from image_io import decode_image, list_images, to_bgra
+from stamp_splitter_v2 import process_image_cv, detect_grid, grid_rects
+from background_remover import process_remover, remove_bg_stage, detect_bg_color_cv, flood_mask, _flood_mask_components
+from auto_trimmer import auto_trim
+from line_stamp_formatter import resize_and_pad
+from pipeline import run_fused_pipeline
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# (layout, cell size, background) combinations; colours rotate so every one is covered
+DEFAULT_MATRIX = [("4x2", 300, "magenta"), ("3x3", 300, "green"), ("4x4", 300, "white"),
+                  ("4x2", 500, "green"), ("3x3", 500, "white"), ("4x4", 500, "magenta")]
+FULL_MATRIX = DEFAULT_MATRIX + [("4x2", 1000, "white"), ("3x3", 1000, "magenta"), ("4x4", 1000, "green")]
+
+def time_call(fn, repeat):
+    """
+    Runs fn() repeat times and returns {"min_ms", "median_ms"} (stdout suppressed).
+    """
+    times = []
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - start) * 1000)
+    return {"min_ms": round(min(times), 3), "median_ms": round(statistics.median(times), 3)}
+
+def fresh_dir(path):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    return path
+
+def rgb_string(bg):
+    b, g, r = BG_COLORS[bg]
+    return f"{r},{g},{b}"
+
+def run_benchmarks(matrix, repeat, work_dir):
+    """
+    Times each stage and the full pipeline for every sheet in matrix.
+    Returns {case name: timing}.
+    """
+    results = {}
+    for layout, cell_size, bg in matrix:
+        key = f"{layout}/{cell_size}/{bg}"
+        sheet_dir = fresh_dir(os.path.join(work_dir, key.replace("/", "_"), "sheet"))
+        sheet_path = write_sheets(sheet_dir, [layout], [cell_size], [bg])[0]
+
+        # Split
+        split_dir = os.path.join(work_dir, key.replace("/", "_"), "split")
+        results[f"split/{key}"] = time_call(
+            lambda: process_image_cv(sheet_path, fresh_dir(split_dir), grid=layout, remove_bg=False), repeat)
+
+        # Grid detection from gutters (must find the same cells as the fixed grid)
+        sheet = to_bgra(decode_image(sheet_path))
+        cuts = detect_grid(sheet)
+        if cuts is None or grid_rects(sheet.shape[1], sheet.shape[0], "detect", 0, cuts)[2] != \
+                grid_rects(sheet.shape[1], sheet.shape[0], layout)[2]:
+            raise AssertionError(f"grid detection differs on {key}")
+        results[f"detect_grid/{key}"] = time_call(lambda: detect_grid(sheet), repeat)
+
+        # Background removal (all three modes) on the split cells
+        for mode in ("flood", "auto_color", "color"):
+            bg_dir = os.path.join(work_dir, key.replace("/", "_"), f"bg_{mode}")
+            results[f"remove_{mode}/{key}"] = time_call(
+                lambda: process_remover(split_dir, fresh_dir(bg_dir), mode=mode, tolerance=30,
+                                        color=rgb_string(bg), erosion=1), repeat)
+
+        # Flood engine alone: seeded floodFill vs the previous connected-components path
+        masks = []
+        for path in list_images(split_dir):
+            img = decode_image(path)
+            bg_color = detect_bg_color_cv(img).astype(np.int16)
+            masks.append(cv2.inRange(img[:, :, :3], np.clip(bg_color - 30, 0, 255).astype(np.uint8),
+                                     np.clip(bg_color + 30, 0, 255).astype(np.uint8)))
+        for m in masks:
+            if not np.array_equal(flood_mask(m), _flood_mask_components(m)):
+                raise AssertionError(f"flood engines differ on {key}")
+        results[f"flood_components/{key}"] = time_call(lambda: [_flood_mask_components(m) for m in masks], repeat)
+        results[f"flood_fill/{key}"] = time_call(lambda: [flood_mask(m) for m in masks], repeat)
+
+        # In-memory BG removal stage
+        cells = [(str(i), decode_image(path), {}) for i, path in enumerate(list_images(split_dir))]
+        results[f"bg_stage/{key}"] = time_call(lambda: list(remove_bg_stage(cells, "flood", 30, erosion=1)), repeat)
+
+        # Trim the flood results
+        flood_dir = os.path.join(work_dir, key.replace("/", "_"), "bg_flood")
+        trim_dir = os.path.join(work_dir, key.replace("/", "_"), "trim")
+        flood_files = list_images(flood_dir)
+
+        def trim_all():
+            out = fresh_dir(trim_dir)
+            for path in flood_files:
+                auto_trim(path, out, 10)
+        results[f"auto_trim/{key}"] = time_call(trim_all, repeat)
+
+        # Resize (in memory, no I/O)
+        trimmed = [decode_image(path) for path in list_images(trim_dir)]
+        results[f"resize_and_pad/{key}"] = time_call(
+            lambda: [resize_and_pad(img, 370, 320, margin=10) for img in trimmed], repeat)
+
+        # Full pipeline (split -> bg -> trim -> format)
+        final_dir = os.path.join(work_dir, key.replace("/", "_"), "final")
+        results[f"pipeline/{key}"] = time_call(
+            lambda: run_fused_pipeline(sheet_dir, fresh_dir(final_dir), grid=layout, remove_bg=True,
+                                       erosion=1, trim=True), repeat)
+    return results
+
+def machine_info():
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+    }
+
+def compare(results, baseline, threshold):
+    """
+    Prints current vs baseline median times. Returns the list of regressed case names.
+    """
+    regressions = []
+    print(f"{'case':<40}{'baseline ms':>13}{'current ms':>12}{'ratio':>8}")
+    for case, timing in results.items():
+        base = baseline.get(case)
+        current = timing["median_ms"]
+        if base is None:
+            print(f"{case:<40}{'-':>13}{current:>12.2f}{'':>8}  new")
+            continue
+        ratio = current / base["median_ms"] if base["median_ms"] else float("inf")
+        flag = ""
+        if ratio > threshold:
+            flag = "  SLOWER"
+            regressions.append(case)
+        elif ratio < 1 / threshold:
+            flag = "  faster"
+        print(f"{case:<40}{base['median_ms']:>13.2f}{current:>12.2f}{ratio:>8.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Stamp tools benchmark (synthetic sheets, offline)")
+    parser.add_argument("--full", action="store_true", help="Also run 1000px cell sheets")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case (median is compared)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save_baseline", action="store_true", help="Overwrite the baseline with this run")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Ratio above which a case counts as slower")
+    parser.add_argument("--output", default=None, help="Also write this run's results to a JSON file")
+
+    args = parser.parse_args()
+
+    matrix = FULL_MATRIX if args.full else DEFAULT_MATRIX
+    work_dir = tempfile.mkdtemp(prefix="stamp_bench_")
+    try:
+        results = run_benchmarks(matrix, args.repeat, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    run = {"machine": machine_info(), "repeat": args.repeat, "cases": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            json.dump(run, fp, indent=2)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as fp:
+            baseline = json.load(fp)
+        if baseline.get("machine") != run["machine"]:
+            print("Note: baseline was recorded on a different machine/environment.")
+        regressions = compare(results, baseline["cases"], args.threshold)
+    else:
+        for case, timing in results.items():
+            print(f"{case:<40}{timing['median_ms']:>12.2f} ms")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as fp:
+            json.dump(run, fp, indent=2)
+        print(f"Baseline saved: {args.baseline}")
+
+    if regressions:
+        print(f"\n{len(regressions)} case(s) slower than {args.threshold}x baseline.")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,337 @@
+import os
+import queue
+from collections import OrderedDict
+
+import customtkinter as ctk
+from PIL import Image, ImageTk
+
+from folder_index import FolderIndex
+from stamp_order import StampOrder
+from thumbnail_cache import ThumbnailCache, ThumbnailLoader, THUMB_SIZE, file_version
+
+CELL_PAD = 6
+CELL_WIDTH = THUMB_SIZE + 2 * CELL_PAD
+CELL_HEIGHT = THUMB_SIZE + 2 * CELL_PAD + 16   # サムネイル + 番号の行
+TICK_MS = 100            # サムネイル結果とフォルダ変更の反映間隔
+PREFETCH_ROWS = 2        # 表示範囲の前後に先読みする行数
+MEMORY_THUMBS = 2000     # メモリに保持するサムネイル数（古いものから破棄）
+DRAG_THRESHOLD = 6       # これ以上動かしたらクリックではなくドラッグ (px)
+LINE_SET_SIZES = (8, 16, 24, 32, 40)   # LINEスタンプの販売個数
+
+CANVAS_BG = "#242424"
+SELECT_COLOR = "#1F6AA5"
+DELETED_COLOR = "#B22222"
+
+class CurationView(ctk.CTkToplevel):
+    """
+    厳選ビュー: 出力フォルダのスタンプをサムネイル一覧で表示し、選択・削除マーク・並べ替えを行う。
+    - 表示範囲の行だけを描画する（数千枚でもスクロールが重くならない）
+    - サムネイルは別スレッドで読み込み、ThumbnailCache に保存（2回目以降はすぐ表示）
+    - 並び順・選択・削除マークは StampOrder（.stamp_order.json）に保存し、ファイルは「確定」まで変更しない
+    - フォルダの変更は FolderIndex で監視し、一覧と個数に反映する
+    """
+
+    def __init__(self, master, output_dir, folder_index=None, on_apply=None):
+        """
+        on_apply(output_dir): 「確定」で呼ばれる（None なら StampOrder.apply() だけ行う）
+        """
+        super().__init__(master)
+        self.output_dir = output_dir
+        self.on_apply = on_apply
+        self.title(f"厳選 - {os.path.basename(os.path.abspath(output_dir))}")
+        self.geometry("760x640")
+
+        # 監視中のインデックスがあれば共有し、なければ自前で監視する
+        self._own_index = folder_index is None or folder_index.folder != output_dir
+        self.index = FolderIndex(output_dir).start() if self._own_index else folder_index
+        self._index_version = self.index.version
+        self.order = StampOrder(output_dir, self.index.stamp_files())
+        self._numbers = {}
+        self._anchor = None
+
+        self._thumbs = OrderedDict()   # filename -> (file_version, PIL Image (RGBA))
+        self._photos = {}              # 表示中のセルの PhotoImage（参照を保持しないと消える）
+        self._results = queue.SimpleQueue()
+        self.loader = ThumbnailLoader(ThumbnailCache(), self.on_thumbnail)
+
+        self._press = None
+        self._dragging = False
+        self._closed = False
+
+        # --- 操作バー ---
+        self.bar = ctk.CTkFrame(self)
+        self.bar.pack(fill="x", padx=10, pady=(10, 5))
+
+        self.count_label = ctk.CTkLabel(self.bar, text="", font=("Arial", 13, "bold"), width=200, anchor="w")
+        self.count_label.pack(side="left", padx=(10, 8), pady=4)
+
+        ctk.CTkButton(self.bar, text="◀", width=32, command=lambda: self.move_selected(-1)).pack(side="left", padx=2, pady=4)
+        ctk.CTkButton(self.bar, text="▶", width=32, command=lambda: self.move_selected(1)).pack(side="left", padx=2, pady=4)
+        ctk.CTkButton(self.bar, text="🗑️ 削除マーク", width=110, command=self.delete_selected, fg_color="#8B0000", hover_color="#B22222").pack(side="left", padx=4, pady=4)
+        ctk.CTkButton(self.bar, text="選択解除", width=80, command=self.clear_selection, fg_color="gray40", hover_color="gray30").pack(side="left", padx=4, pady=4)
+        ctk.CTkButton(self.bar, text="✅ 確定（リネーム）", width=140, command=self.apply_order, fg_color="#2E7D32", hover_color="#388E3C").pack(side="right", padx=(4, 10), pady=4)
+
+        ctk.CTkLabel(self, text="クリック: 選択 / Shift+クリック: 範囲選択 / ドラッグ: 並べ替え / Delete: 削除マーク / 削除マークをクリック: 戻す",
+                     font=("Arial", 11), text_color="gray60", anchor="w").pack(fill="x", padx=14)
+
+        # --- サムネイル一覧（表示範囲だけ描画） ---
+        self.grid_frame = ctk.CTkFrame(self)
+        self.grid_frame.pack(fill="both", expand=True, padx=10, pady=(5, 10))
+        self.canvas = ctk.CTkCanvas(self.grid_frame, bg=CANVAS_BG, highlightthickness=0)
+        self.scrollbar = ctk.CTkScrollbar(self.grid_frame, command=self.yview)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set, yscrollincrement=1)
+
+        self.canvas.bind("<Configure>", lambda e: self.redraw())
+        self.canvas.bind("<ButtonPress-1>", self.on_press)
+        self.canvas.bind("<B1-Motion>", self.on_motion)
+        self.canvas.bind("<ButtonRelease-1>", self.on_release)
+        self.canvas.bind("<MouseWheel>", self.on_wheel)
+        self.canvas.bind("<Button-4>", lambda e: self.scroll_by(-CELL_HEIGHT // 2))
+        self.canvas.bind("<Button-5>", lambda e: self.scroll_by(CELL_HEIGHT // 2))
+        self.bind("<Delete>", lambda e: self.delete_selected())
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.refresh()
+        self.after(TICK_MS, self.tick)
+
+    # --- 状態 ---
+
+    def refresh(self):
+        """並び順が変わったら番号と表示を更新"""
+        self._numbers = {name: i for i, name in enumerate(self.order.active(), start=1)}
+        count = self.order.count
+        text = f"📁 {count}個"
+        if self.order.selected:
+            text += f"  選択 {len(self.order.selected)}"
+        if self.order.deleted:
+            text += f"  削除マーク {len(self.order.deleted)}"
+        self.count_label.configure(text=text, text_color="#4CAF50" if count in LINE_SET_SIZES else ("gray10", "gray90"))
+        self.redraw()
+
+    def commit(self):
+        """変更をマニフェストに保存（フォルダ内のファイルはそのまま）"""
+        self.order.save()
+        self.refresh()
+
+    def reload(self):
+        """フォルダが外部で変更されたとき: マニフェストとファイル一覧を読み直す"""
+        self.order = StampOrder(self.output_dir, self.index.stamp_files())
+        # 消えたファイルと、同じ名前で書き換えられたファイル（パイプラインの再実行など）のサムネイルは捨てる
+        names = set(self.order.order)
+        for name, (version, _) in list(self._thumbs.items()):
+            try:
+                current = file_version(os.path.join(self.output_dir, name)) if name in names else None
+            except OSError:
+                current = None
+            if current != version:
+                del self._thumbs[name]
+        self.refresh()
+
+    def tick(self):
+        """別スレッドのサムネイルとフォルダの変更をまとめて反映（Tkメインスレッド）"""
+        if self._closed:
+            return
+
+        arrived = False
+        while True:
+            try:
+                name, version, image = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._thumbs[name] = (version, image)
+            self._thumbs.move_to_end(name)
+            arrived = True
+        while len(self._thumbs) > MEMORY_THUMBS:
+            self._thumbs.popitem(last=False)
+
+        self.index.poll()
+        if self.index.version != self._index_version:
+            self._index_version = self.index.version
+            self.reload()
+        elif arrived:
+            self.redraw()
+
+        self.after(TICK_MS, self.tick)
+
+    def on_thumbnail(self, path, thumb, error, version):
+        """サムネイル読み込みスレッドから呼ばれる。Tkには触らずキューに渡す"""
+        if error is not None or thumb is None:
+            print(f"サムネイルを作成できません: {os.path.basename(path)} {error or ''}")
+            image = Image.new("RGBA", (THUMB_SIZE, THUMB_SIZE), (80, 0, 0, 255))
+        else:
+            image = Image.fromarray(thumb[:, :, [2, 1, 0, 3]])  # BGRA -> RGBA
+        self._results.put((os.path.basename(path), version, image))
+
+    # --- 描画 ---
+
+    def columns(self):
+        return max(1, self.canvas.winfo_width() // CELL_WIDTH)
+
+    def redraw(self):
+        """表示範囲の行（＋先読み）のセルだけを描き直す"""
+        names = self.order.order
+        cols = self.columns()
+        rows = (len(names) + cols - 1) // cols
+        height = self.canvas.winfo_height()
+        self.canvas.configure(scrollregion=(0, 0, cols * CELL_WIDTH, max(rows * CELL_HEIGHT, height)))
+
+        top = int(self.canvas.canvasy(0))
+        first_row = max(0, top // CELL_HEIGHT)
+        last_row = min(rows, (top + height) // CELL_HEIGHT + 1)
+
+        self.canvas.delete("cell")
+        self._photos = {}
+        for i in range(first_row * cols, min(len(names), last_row * cols)):
+            self.draw_cell(i, names[i], cols)
+
+        # 見えている分を先に、続けて前後の数行を読み込む
+        start = max(0, first_row - PREFETCH_ROWS) * cols
+        end = min(len(names), (last_row + PREFETCH_ROWS) * cols)
+        visible = names[first_row * cols:last_row * cols]
+        nearby = names[start:first_row * cols] + names[last_row * cols:end]
+        missing = [os.path.join(self.output_dir, n) for n in visible + nearby if n not in self._thumbs]
+        if missing:
+            self.loader.request(missing)
+
+    def draw_cell(self, i, name, cols):
+        x = (i % cols) * CELL_WIDTH
+        y = (i // cols) * CELL_HEIGHT
+        cx = x + CELL_WIDTH // 2
+        cy = y + CELL_PAD + THUMB_SIZE // 2
+        deleted = name in self.order.deleted
+        selected = name in self.order.selected
+
+        self.canvas.create_rectangle(x + 2, y + 2, x + CELL_WIDTH - 2, y + CELL_HEIGHT - 2,
+                                     fill="#333333", outline=SELECT_COLOR if selected else "#333333",
+                                     width=3 if selected else 1, tags="cell")
+        image = self._thumbs.get(name, (None, None))[1]
+        if image is not None:
+            if deleted:
+                image = image.copy()
+                image.putalpha(image.getchannel("A").point(lambda a: a // 4))
+            photo = ImageTk.PhotoImage(image)
+            self._photos[name] = photo
+            self.canvas.create_image(cx, cy, image=photo, tags="cell")
+        else:
+            self.canvas.create_text(cx, cy, text="…", fill="gray60", tags="cell")
+
+        if deleted:
+            self.canvas.create_line(x + 12, y + 12, x + CELL_WIDTH - 12, y + THUMB_SIZE, fill=DELETED_COLOR, width=3, tags="cell")
+            self.canvas.create_line(x + CELL_WIDTH - 12, y + 12, x + 12, y + THUMB_SIZE, fill=DELETED_COLOR, width=3, tags="cell")
+            label = "削除"
+        else:
+            label = f"{self._numbers[name]:02d}"
+        self.canvas.create_text(cx, y + CELL_HEIGHT - 12, text=label, fill=DELETED_COLOR if deleted else "gray85",
+                                font=("Arial", 10, "bold"), tags="cell")
+
+    # --- スクロール ---
+
+    def yview(self, *args):
+        self.canvas.yview(*args)
+        self.redraw()
+
+    def scroll_by(self, pixels):
+        self.canvas.yview_scroll(pixels, "units")
+        self.redraw()
+
+    def on_wheel(self, event):
+        # Windows は1ノッチ120、macOS は小さな値
+        if abs(event.delta) >= 120:
+            self.scroll_by(-event.delta * CELL_HEIGHT // 240)
+        else:
+            self.scroll_by(-event.delta * 8)
+
+    # --- 操作 ---
+
+    def hit(self, event):
+        """クリック位置のスタンプの番号（order内の位置）、なければNone"""
+        cols = self.columns()
+        col = int(event.x) // CELL_WIDTH
+        row = int(self.canvas.canvasy(event.y)) // CELL_HEIGHT
+        i = row * cols + col
+        if col >= cols or not 0 <= i < len(self.order.order):
+            return None
+        return i
+
+    def on_press(self, event):
+        self._press = (self.hit(event), event.x, event.y)
+        self._dragging = False
+
+    def on_motion(self, event):
+        if self._press is None or self._press[0] is None:
+            return
+        if abs(event.x - self._press[1]) + abs(event.y - self._press[2]) >= DRAG_THRESHOLD:
+            self._dragging = True
+            self.canvas.configure(cursor="fleur")
+
+    def on_release(self, event):
+        if self._press is None:
+            return
+        source = self._press[0]
+        self._press = None
+        self.canvas.configure(cursor="")
+        if source is None:
+            return
+        name = self.order.order[source]
+
+        if self._dragging:
+            target = self.hit(event)
+            if target is not None and target != source:
+                self.order.move(name, target)
+                self.commit()
+            return
+
+        if name in self.order.deleted:
+            self.order.restore([name])
+        elif event.state & 0x0001 and self._anchor in self.order.order:   # Shift
+            a = self.order.order.index(self._anchor)
+            lo, hi = min(a, source), max(a, source)
+            self.order.select(self.order.order[lo:hi + 1])
+        else:
+            self.order.select([name], name not in self.order.selected)
+            self._anchor = name
+        self.commit()
+
+    def move_selected(self, step):
+        """選択中のスタンプを前後に1つずつ移動（まとめて動かす）"""
+        order = self.order.order
+        positions = [i for i, name in enumerate(order) if name in self.order.selected]
+        if not positions:
+            return
+        if (step < 0 and positions[0] == 0) or (step > 0 and positions[-1] == len(order) - 1):
+            return
+        for i in (positions if step < 0 else reversed(positions)):
+            order[i], order[i + step] = order[i + step], order[i]
+        self.commit()
+
+    def delete_selected(self):
+        if self.order.selected:
+            self.order.delete(list(self.order.selected))
+            self.commit()
+
+    def clear_selection(self):
+        self.order.select(list(self.order.selected), False)
+        self.commit()
+
+    def apply_order(self):
+        """削除マークを削除し、並び順どおりに 01.png〜 にリネーム"""
+        # 出力フォルダ欄が変更されていても、このビューで開いたフォルダに適用する
+        if self.on_apply is not None:
+            self.on_apply(self.output_dir)
+        else:
+            self.order.apply()
+        # 同じ名前が別の画像になるため、メモリ上のサムネイルは読み直す
+        self._thumbs.clear()
+        self.index.rescan()
+        self._index_version = self.index.version
+        self.order = StampOrder(self.output_dir, self.index.stamp_files())
+        self.refresh()
+
+    def close(self):
+        self._closed = True
+        self.loader.close()
+        if self._own_index:
+            self.index.stop()
+        self.destroy()
@@ -0,0 +1,178 @@
+import argparse
+import os
+import threading
+import time
+
+from stamp_export import SPECIAL_FILES
+from stamp_order import ORDER_FILE
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:        # optional: without watchdog the folder is polled
+    FileSystemEventHandler = object
+    Observer = None
+
+def is_stamp_file(name):
+    """
+    Stamp PNGs as counted by list_stamp_files (main/tab excluded).
+    """
+    name = name.lower()
+    return name.endswith('.png') and name not in SPECIAL_FILES
+
+class _Handler(FileSystemEventHandler):
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.index._apply(added=event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.index._apply(removed=event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.index._apply(removed=event.src_path, added=event.dest_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.index._apply(touched=event.src_path)
+
+class FolderIndex(object):
+    """
+    Live set of the stamp files in one folder (not recursive).
+    Scanned once on start(); afterwards kept current by filesystem notifications
+    (watchdog) or, without them, by poll(), which only rescans when the folder's
+    mtime changed. Readers get the count in constant time and compare version to
+    notice changes (it also changes when the order manifest is rewritten, and, with
+    notifications, when a stamp is rewritten in place).
+    """
+
+    def __init__(self, folder, watch=True):
+        self.folder = folder
+        self.watch = watch and Observer is not None
+        self.version = 0
+        self._files = set()
+        self._lock = threading.Lock()
+        self._observer = None
+        self._dir_mtime = None
+
+    @property
+    def watching(self):
+        return self._observer is not None
+
+    @property
+    def count(self):
+        return len(self._files)
+
+    def stamp_files(self):
+        """
+        Sorted stamp filenames (same as list_stamp_files(folder)[0]).
+        """
+        with self._lock:
+            return sorted(self._files)
+
+    def start(self):
+        if self.watch:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_Handler(self), self.folder, recursive=False)
+                self._observer.start()
+            except OSError as e:
+                # e.g. inotify watch limit reached: fall back to polling
+                print(f"Folder watch unavailable ({e}); polling {self.folder}")
+                self._observer = None
+        self.rescan()
+        return self
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=1)
+            self._observer = None
+
+    def rescan(self):
+        """
+        Full scan of the folder (one scandir, no per-file stat on most platforms).
+        """
+        try:
+            mtime = os.stat(self.folder).st_mtime_ns
+            with os.scandir(self.folder) as it:
+                files = {e.name for e in it if is_stamp_file(e.name) and e.is_file()}
+        except OSError:
+            mtime, files = None, set()
+        with self._lock:
+            self._dir_mtime = mtime
+            self._files = files
+            self.version += 1
+
+    def poll(self):
+        """
+        Polling fallback: rescans only when the folder's mtime changed (entries were
+        added, removed or renamed). No-op while notifications are active.
+        """
+        if self.watching:
+            return
+        try:
+            mtime = os.stat(self.folder).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._dir_mtime:
+            self.rescan()
+
+    def _apply(self, added=None, removed=None, touched=None):
+        """
+        Applies one notification (called on the observer thread).
+        """
+        with self._lock:
+            changed = False
+            for path, present in ((removed, False), (added, True)):
+                if path is None or os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.folder):
+                    continue
+                name = os.path.basename(path)
+                if name == ORDER_FILE:
+                    changed = True
+                elif is_stamp_file(name):
+                    if present:
+                        self._files.add(name)
+                    else:
+                        self._files.discard(name)
+                    changed = True
+            if touched is not None and os.path.dirname(os.path.abspath(touched)) == os.path.abspath(self.folder):
+                name = os.path.basename(touched)
+                if name == ORDER_FILE or (is_stamp_file(name) and name in self._files):
+                    changed = True
+            if changed:
+                self.version += 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Live stamp count of an output folder")
+    parser.add_argument("--input", default="output_final", help="Stamp folder to watch")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between checks")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"Error: '{args.input}' directory not found.")
+        return
+
+    index = FolderIndex(args.input).start()
+    print(f"Watching {args.input} ({'notifications' if index.watching else 'polling'}), Ctrl+C to stop")
+    version = None
+    try:
+        while True:
+            index.poll()
+            if index.version != version:
+                version = index.version
+                print(f"{index.count} stamps")
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        index.stop()
+
+if __name__ == "__main__":
+    main()
@@ -4,30 +4,37 @@ import os
 import threading
 import sys
 import shutil
+import time
 from datetime import datetime
+from tkinter import messagebox
+from PIL import Image
 
 # Import tool functions
-from stamp_splitter_v2 import process_splitter
-from background_remover import process_remover
-from auto_trimmer import process_auto_trimmer
-from line_stamp_formatter import process_formatter
+from pipeline import run_fused_pipeline, TEMP_WRITE_DIR
+from parallel import Cancelled
+from result_cache import DEFAULT_CACHE_DIR
+from stamp_export import name_parts, create_backup, create_zip, delete_outputs
+from stamp_order import StampOrder
+from folder_index import FolderIndex
+from curation_view import CurationView
+from stamp_dedupe import find_near_duplicates
+from watermark_detector import find_watermark_files
+from log_sink import LogSink
+from image_io import list_images
+from preview import PreviewRenderer, PreviewWorker
+import instrumentation
 
 # Configuration
 ctk.set_appearance_mode("Dark")
 ctk.set_default_color_theme("blue")
 
-class RedirectText(object):
-    def __init__(self, text_widget):
-        self.text_widget = text_widget
-
-    def write(self, string):
-        self.text_widget.configure(state="normal")
-        self.text_widget.insert("end", string)
-        self.text_widget.see("end")
-        self.text_widget.configure(state="disabled")
-
-    def flush(self):
-        pass
+LOG_POLL_MS = 100      # ログ反映の間隔
+LOG_MAX_LINES = 5000   # ログ表示の最大行数（古い行から削除）
+PREVIEW_SIZE = 440     # プレビュー画像の長辺 (px)
+PREVIEW_DEBOUNCE_MS = 150  # 設定変更からプレビュー更新までの待ち時間
+WATERMARK_LIST_MAX = 20    # 削除確認ダイアログに並べるファイル数
+COUNT_POLL_MS = 500    # スタンプ個数表示の更新間隔（変更がなければ何もしない）
+SPLIT_TOLERANCE = 50   # 分割（グリッド検出）の背景許容値（UIには出さない）
 
 class StampMakerGUI(ctk.CTk, TkinterDnD.DnDWrapper):
     def __init__(self):
@@ -35,7 +42,7 @@ class StampMakerGUI(ctk.CTk, TkinterDnD.DnDWrapper):
         self.TkdndVersion = TkinterDnD._require(self)
         
         self.title("LINE Stamp Maker Banana")
-        self.geometry("700x850")
+        self.geometry("1180x850")
         
         # Grid configuration
         self.grid_columnconfigure(0, weight=1)
@@ -89,7 +96,7 @@ class StampMakerGUI(ctk.CTk, TkinterDnD.DnDWrapper):
         
         ctk.CTkLabel(self.split_opts, text="分割数:").pack(side="left", padx=5)
         self.grid_var = ctk.StringVar(value="auto")
-        self.grid_combo = ctk.CTkComboBox(self.split_opts, values=["auto", "4x2", "3x3", "4x4"], variable=self.grid_var, width=80)
+        self.grid_combo = ctk.CTkComboBox(self.split_opts, values=["auto", "detect", "4x2", "3x3", "4x4"], variable=self.grid_var, width=90)
         self.grid_combo.pack(side="left", padx=5)
 
         ctk.CTkLabel(self.split_opts, text="内側フチ除去:").pack(side="left", padx=(15, 5))
@@ -115,14 +122,14 @@ class StampMakerGUI(ctk.CTk, TkinterDnD.DnDWrapper):
         ctk.CTkLabel(self.bg_opts, text="許容値:").grid(row=1, column=0, padx=5, pady=2, sticky="w")
         self.tol_val_label = ctk.CTkLabel(self.bg_opts, text="30", width=30)
         self.tol_val_label.grid(row=1, column=2, padx=5, pady=2)
-        self.tol_slider = ctk.CTkSlider(self.bg_opts, from_=0, to=100, number_of_steps=100, width=120, command=lambda v: self.tol_val_label.configure(text=str(int(v))))
+        self.tol_slider = ctk.CTkSlider(self.bg_opts, from_=0, to=100, number_of_steps=100, width=120, command=lambda v: (self.tol_val_label.configure(text=str(int(v))), self.schedule_preview()))
         self.tol_slider.set(30)
         self.tol_slider.grid(row=1, column=1, padx=5, pady=2, sticky="w")
 
         ctk.CTkLabel(self.bg_opts, text="フチ除去:").grid(row=2, column=0, padx=5, pady=2, sticky="w")
         self.ero_val_label = ctk.CTkLabel(self.bg_opts, text="0", width=30)
         self.ero_val_label.grid(row=2, column=2, padx=5, pady=2)
-        self.bg_ero_slider = ctk.CTkSlider(self.bg_opts, from_=0, to=10, number_of_steps=10, width=120, command=lambda v: self.ero_val_label.configure(text=str(int(v))))
+        self.bg_ero_slider = ctk.CTkSlider(self.bg_opts, from_=0, to=10, number_of_steps=10, width=120, command=lambda v: (self.ero_val_label.configure(text=str(int(v))), self.schedule_preview()))
         self.bg_ero_slider.set(0)
         self.bg_ero_slider.grid(row=2, column=1, padx=5, pady=2, sticky="w")
 
@@ -161,9 +168,51 @@ class StampMakerGUI(ctk.CTk, TkinterDnD.DnDWrapper):
         self.date_check = ctk.CTkCheckBox(self.name_opts, text="日付を入れる", variable=self.date_var)
         self.date_check.pack(side="left", padx=10)
 
+        # Step 6: 並列処理（シート単位でプロセス並列）
+        ctk.CTkLabel(self.options_frame, text="6. 並列処理", font=("Arial", 12, "bold")).grid(row=5, column=0, padx=10, pady=10, sticky="w")
+        
+        self.workers_opts = ctk.CTkFrame(self.options_frame, fg_color="transparent")
+        self.workers_opts.grid(row=5, column=1, padx=10, pady=10, sticky="w")
+        
+        ctk.CTkLabel(self.workers_opts, text="ワーカー数:").pack(side="left", padx=5)
+        self.workers_var = ctk.StringVar(value=str(os.cpu_count() or 1))
+        self.workers_entry = ctk.CTkEntry(self.workers_opts, textvariable=self.workers_var, width=50)
+        self.workers_entry.pack(side="left", padx=5)
+        ctk.CTkLabel(self.workers_opts, text="(1 = 並列なし)").pack(side="left", padx=5)
+        
+        # 入力・設定が変わっていない工程はキャッシュから再利用する
+        self.cache_var = ctk.BooleanVar(value=True)
+        self.cache_check = ctk.CTkCheckBox(self.workers_opts, text="キャッシュを使う", variable=self.cache_var)
+        self.cache_check.pack(side="left", padx=10)
+        
+        # 工程ごとの処理時間・メモリを計測して出力フォルダにレポートを保存
+        self.profile_var = ctk.BooleanVar(value=False)
+        self.profile_check = ctk.CTkCheckBox(self.workers_opts, text="計測", variable=self.profile_var)
+        self.profile_check.pack(side="left", padx=10)
+
         # --- 3. Execution ---
         self.run_btn = ctk.CTkButton(self, text="処理開始 (RUN)", font=("Arial", 16, "bold"), height=50, command=self.start_process)
-        self.run_btn.grid(row=2, column=0, padx=20, pady=20, sticky="ew")
+        self.run_btn.grid(row=2, column=0, padx=20, pady=(20, 0), sticky="ew")
+
+        # 進捗表示（パイプラインの progress イベントで更新）
+        self.progress_frame = ctk.CTkFrame(self, fg_color="transparent")
+        self.progress_frame.grid(row=3, column=0, padx=20, pady=(4, 10), sticky="ew")
+        self.progress_frame.grid_columnconfigure(0, weight=1)
+        
+        self.progress_bar = ctk.CTkProgressBar(self.progress_frame)
+        self.progress_bar.set(0)
+        self.progress_bar.grid(row=0, column=0, padx=(5, 10), pady=2, sticky="ew")
+        
+        self.cancel_btn = ctk.CTkButton(self.progress_frame, text="中止", width=60, state="disabled", command=self.cancel_process, fg_color="#8B0000", hover_color="#B22222")
+        self.cancel_btn.grid(row=0, column=1, padx=(0, 5), pady=2)
+        
+        self.status_label = ctk.CTkLabel(self.progress_frame, text="", anchor="w")
+        self.status_label.grid(row=1, column=0, columnspan=2, padx=5, sticky="ew")
+        
+        self.cancel_event = threading.Event()
+        self._progress_stage = None
+        self._progress_start = 0
+        self._run_started = 0
 
         # --- main/tab 再生成セクション ---
         self.maintab_frame = ctk.CTkFrame(self)
@@ -203,6 +252,13 @@ class StampMakerGUI(ctk.CTk, TkinterDnD.DnDWrapper):
         self.rename_btn = ctk.CTkButton(self.finish_row1, text="🔢 リネーム", width=100, command=self.rename_files, fg_color="#2E7D32", hover_color="#388E3C")
         self.rename_btn.pack(side="left", padx=4, pady=4)
         
+        self.dedupe_btn = ctk.CTkButton(self.finish_row1, text="👯 類似チェック", width=110, command=self.find_duplicates)
+        self.dedupe_btn.pack(side="left", padx=4, pady=4)
+        
+        self.curate_btn = ctk.CTkButton(self.finish_row1, text="🖼️ 厳選", width=90, command=self.open_curation, fg_color="#6A1B9A", hover_color="#7B1FA2")
+        self.curate_btn.pack(side="left", padx=4, pady=4)
+        self.curation_view = None
+        
         # ファイル数カウント表示エリア
         self.count_area = ctk.CTkFrame(self.finish_row1, fg_color=("gray85", "gray20"), corner_radius=8)
         self.count_area.pack(side="left", padx=8, pady=4)
@@ -213,6 +269,11 @@ class StampMakerGUI(ctk.CTk, TkinterDnD.DnDWrapper):
         self.refresh_count_btn = ctk.CTkButton(self.count_area, text="🔄", width=32, height=28, command=self.update_file_count, fg_color="transparent", hover_color=("gray75", "gray30"), text_color=("gray20", "gray90"))
         self.refresh_count_btn.pack(side="left", padx=(0, 6), pady=4)
         
+        # 出力フォルダを監視して個数を自動更新（ファイルマネージャでの削除も反映）
+        self.folder_index = None
+        self._count_version = None
+        self.after(COUNT_POLL_MS, self.poll_file_count)
+        
         # --- 行2: 出力＆クリーンアップ ---
         self.finish_row2 = ctk.CTkFrame(self.finish_frame, fg_color="transparent")
         self.finish_row2.grid(row=2, column=0, padx=10, pady=(2, 8), sticky="ew")
@@ -233,8 +294,148 @@ class StampMakerGUI(ctk.CTk, TkinterDnD.DnDWrapper):
         self.log_text = ctk.CTkTextbox(self.log_frame, state="disabled", font=("Consolas", 10))
         self.log_text.pack(fill="both", expand=True, padx=5, pady=5)
 
-        # Redirect stdout
-        sys.stdout = RedirectText(self.log_text)
+        # Redirect stdout (worker threads only enqueue; the Tk loop drains in batches)
+        self.log_sink = LogSink()
+        sys.stdout = self.log_sink
+        self.after(LOG_POLL_MS, self.poll_log)
+
+        # --- 5. Preview (右側) ---
+        # 縮小したシートに分割線・フチ除去範囲・透過結果を重ねて表示（描画は別スレッド）
+        self.preview_frame = ctk.CTkFrame(self)
+        self.preview_frame.grid(row=0, column=1, rowspan=7, padx=(0, 20), pady=10, sticky="nsew")
+        
+        self.preview_head = ctk.CTkFrame(self.preview_frame, fg_color="transparent")
+        self.preview_head.pack(fill="x", padx=10, pady=(8, 4))
+        ctk.CTkLabel(self.preview_head, text="プレビュー", font=("Arial", 12, "bold")).pack(side="left", padx=(0, 10))
+        self.preview_file_var = ctk.StringVar(value="")
+        self.preview_combo = ctk.CTkComboBox(self.preview_head, values=[], variable=self.preview_file_var, width=260, command=lambda v: self.schedule_preview())
+        self.preview_combo.pack(side="left")
+        
+        self.preview_label = ctk.CTkLabel(self.preview_frame, text="入力フォルダを選択すると\nプレビューを表示します", width=PREVIEW_SIZE, height=PREVIEW_SIZE)
+        self.preview_label.pack(padx=10, pady=5)
+        
+        self.preview_info = ctk.CTkLabel(self.preview_frame, text="", anchor="w")
+        self.preview_info.pack(fill="x", padx=10, pady=(0, 8))
+        
+        self.preview_worker = PreviewWorker(PreviewRenderer(max_side=PREVIEW_SIZE), self.on_preview_result)
+        self._preview_seq = 0
+        self._preview_after = None
+        self._preview_image = None
+        
+        self.input_path_var.trace_add("write", lambda *args: self.refresh_preview_files())
+        for var in (self.grid_var, self.split_margin_var, self.check_split_var, self.check_bg_var, self.mode_var):
+            var.trace_add("write", lambda *args: self.schedule_preview())
+
+    def refresh_preview_files(self):
+        """入力フォルダの画像一覧をプレビュー用の選択肢に反映"""
+        input_dir = self.input_path_var.get()
+        names = []
+        if input_dir and os.path.isdir(input_dir):
+            names = [os.path.basename(p) for p in list_images(input_dir)]
+        self.preview_combo.configure(values=names)
+        if self.preview_file_var.get() not in names:
+            self.preview_file_var.set(names[0] if names else "")
+        self.schedule_preview()
+
+    def schedule_preview(self):
+        """設定変更のたびに呼ばれる。連続した変更はまとめて最後の1回だけ描画する"""
+        if self._preview_after is not None:
+            self.after_cancel(self._preview_after)
+        self._preview_after = self.after(PREVIEW_DEBOUNCE_MS, self.request_preview)
+
+    def request_preview(self):
+        """現在の設定を読み取り、プレビュー用スレッドに描画を依頼（Tkメインスレッド）"""
+        self._preview_after = None
+        path = os.path.join(self.input_path_var.get(), self.preview_file_var.get())
+        if not self.preview_file_var.get() or not os.path.isfile(path):
+            return
+        
+        try:
+            inner_margin = int(self.split_margin_var.get())
+        except ValueError:
+            inner_margin = 0
+        
+        self._preview_seq += 1
+        self.preview_worker.submit(
+            self._preview_seq, path,
+            split=self.check_split_var.get(),
+            grid=self.grid_var.get(),
+            inner_margin=inner_margin,
+            remove_bg=self.check_bg_var.get(),
+            mode=self.mode_var.get(),
+            tolerance=int(self.tol_slider.get()),
+            erosion=int(self.bg_ero_slider.get()),
+            split_tolerance=SPLIT_TOLERANCE
+        )
+
+    def on_preview_result(self, seq, image, info, error):
+        """プレビュー用スレッドから呼ばれる。Tkには触らずイベントとして渡す"""
+        if image is not None:
+            image = Image.fromarray(image[:, :, ::-1])  # BGR -> RGB
+        self.log_sink.event("preview", seq=seq, image=image, info=info, error=str(error) if error else None)
+
+    def show_preview(self, event):
+        # 古い依頼の結果は捨てる
+        if event["seq"] != self._preview_seq:
+            return
+        if event["error"]:
+            self.preview_info.configure(text=f"プレビューエラー: {event['error']}")
+            return
+        
+        image = event["image"]
+        self._preview_image = ctk.CTkImage(light_image=image, dark_image=image, size=image.size)
+        self.preview_label.configure(image=self._preview_image, text="")
+        
+        info = event["info"]
+        text = f"{info['cols']}x{info['rows']}  {image.size[0]}x{image.size[1]}px  {info['ms']}ms"
+        if info["margin_ignored"]:
+            text += "  (フチ除去がセルより大きいため無効)"
+        self.preview_info.configure(text=text)
+
+    def poll_log(self):
+        """キューに溜まったログとイベントをまとめてUIに反映する（Tkメインスレッド）"""
+        text, events = self.log_sink.drain()
+        
+        if text:
+            self.log_text.configure(state="normal")
+            self.log_text.insert("end", text)
+            # 行数が多くなりすぎたら古い行を削除
+            line_count = int(self.log_text.index("end-1c").split(".")[0])
+            if line_count > LOG_MAX_LINES:
+                self.log_text.delete("1.0", f"{line_count - LOG_MAX_LINES}.0")
+            self.log_text.see("end")
+            self.log_text.configure(state="disabled")
+        
+        for event in events:
+            self.handle_event(event)
+        
+        self.after(LOG_POLL_MS, self.poll_log)
+
+    def handle_event(self, event):
+        """パイプラインからの構造化イベントを処理"""
+        if event["type"] == "progress":
+            stage_names = {"process": "処理", "write": "保存"}
+            stage = stage_names.get(event["stage"], event["stage"])
+            index, total = event["index"], event["total"]
+            
+            # 工程が変わったら計測し直す（最初のイベントの時刻を起点に近似）
+            if event["stage"] != self._progress_stage:
+                self._progress_stage = event["stage"]
+                self._progress_start = self._run_started if event["stage"] == "process" else event["time"]
+            
+            self.progress_bar.set(index / total if total else 0)
+            elapsed = event["time"] - self._progress_start
+            text = f"{stage}: {index}/{total}"
+            if elapsed > 0:
+                rate = index / elapsed
+                eta = (total - index) / rate
+                text += f"  ({rate:.1f}枚/秒, 残り約{int(eta // 60)}:{int(eta % 60):02d})"
+            self.status_label.configure(text=text)
+        elif event["type"] == "preview":
+            self.show_preview(event)
+        elif event["type"] == "done":
+            self.run_btn.configure(state="normal", text="処理開始 (RUN)")
+            self.cancel_btn.configure(state="disabled", text="中止")
 
     def drop_input(self, event):
         path = event.data
@@ -275,10 +476,9 @@ class StampMakerGUI(ctk.CTk, TkinterDnD.DnDWrapper):
             print(f"選択: {file_path}")
     
     def generate_maintab(self):
-        """選択した画像からmain.pngとtab.pngを生成"""
-        import cv2
-        import numpy as np
-        from line_stamp_formatter import resize_and_pad, resize_exact
+        """選択した画像からmain.pngとtab.pngを生成（1回の読み込みから両方を描画）"""
+        from image_io import decode_image, to_bgra
+        from line_stamp_formatter import save_main_tab
         
         # 画像が選択されているか確認
         if not hasattr(self, '_selected_img_path') or not os.path.exists(self._selected_img_path):
@@ -293,86 +493,124 @@ class StampMakerGUI(ctk.CTk, TkinterDnD.DnDWrapper):
         
         try:
             # 画像読み込み
-            img = cv2.imdecode(np.fromfile(self._selected_img_path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+            img = decode_image(self._selected_img_path)
             if img is None:
                 print("エラー: 画像を読み込めませんでした。")
                 return
             
-            # 4チャンネル確認
-            if len(img.shape) == 2:
-                img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGRA)
-            elif img.shape[2] == 3:
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
-            
-            # main.png生成 (240x240)
-            main_img = resize_and_pad(img, 240, 240, margin=0)
-            main_path = os.path.join(output_dir, "main.png")
-            cv2.imencode(".png", main_img)[1].tofile(main_path)
-            print(f"生成: {main_path}")
-            
-            # tab.png生成 (96x74)
-            tab_img = resize_exact(img, 96, 74)
-            tab_path = os.path.join(output_dir, "tab.png")
-            cv2.imencode(".png", tab_img)[1].tofile(tab_path)
-            print(f"生成: {tab_path}")
+            # main.png (240x240) / tab.png (96x74)
+            save_main_tab(to_bgra(img), output_dir)
             
             print("main/tab 再生成完了！")
             
         except Exception as e:
             print(f"エラー: {e}")
 
+    def reveal_path(self, path, select=False):
+        """フォルダを開く（select=True ならファイルを選択した状態で親フォルダを開く）。Windows以外は既定のファイルマネージャ"""
+        import subprocess
+        path = os.path.abspath(path)
+        if sys.platform == "win32":
+            subprocess.Popen(['explorer', '/select,', path] if select else ['explorer', path])
+        else:
+            folder = os.path.dirname(path) if select else path
+            subprocess.Popen(['open' if sys.platform == "darwin" else 'xdg-open', folder])
+
     def open_output_folder(self):
         """出力フォルダをエクスプローラで開く"""
-        import subprocess
         output_dir = self.output_path_var.get()
         
         if not output_dir or not os.path.exists(output_dir):
             print("エラー: 出力フォルダが存在しません。")
             return
         
-        # Windowsでエクスプローラを開く
-        subprocess.Popen(['explorer', os.path.abspath(output_dir)])
+        self.reveal_path(output_dir)
         print(f"フォルダを開きました: {os.path.abspath(output_dir)}")
         self.update_file_count()
     
-    def rename_files(self):
-        """出力フォルダ内のスタンプ画像を連番リネームし、個数を表示"""
+    def open_curation(self):
+        """出力フォルダのスタンプをサムネイル一覧で厳選（選択・削除マーク・並べ替え）するウィンドウを開く"""
         output_dir = self.output_path_var.get()
         
         if not output_dir or not os.path.exists(output_dir):
             print("エラー: 出力フォルダが存在しません。")
             return
         
-        # スタンプ画像を取得（main.png, tab.png除く）
-        all_files = [f for f in os.listdir(output_dir) if os.path.isfile(os.path.join(output_dir, f))]
-        stamp_files = [f for f in all_files if f.lower() not in ['main.png', 'tab.png'] and f.lower().endswith('.png')]
-        stamp_files.sort()
+        view = self.curation_view
+        if view is not None and not view._closed:
+            if view.output_dir == output_dir:
+                view.focus()
+                return
+            view.close()
         
-        if not stamp_files:
+        self.curation_view = CurationView(self, output_dir, self.folder_index, on_apply=self.rename_files)
+    
+    def rename_files(self, output_dir=None):
+        """並び順マニフェストに従ってスタンプ画像を連番リネーム（削除マーク分は削除）し、個数を表示
+        ジャーナル付きなので途中で落ちても次回開いたときに続きから完了する
+        output_dir: 対象フォルダ（厳選ビューは開いたフォルダを渡す）。None なら出力フォルダ欄の値"""
+        if output_dir is None:
+            output_dir = self.output_path_var.get()
+        
+        if not output_dir or not os.path.exists(output_dir):
+            print("エラー: 出力フォルダが存在しません。")
+            return
+        
+        order = StampOrder(output_dir)
+        if not order.order:
             print("リネーム対象のスタンプ画像がありません。")
             self.update_file_count()
             return
         
-        # 一時名にリネーム（衝突回避）
-        temp_names = []
-        for i, file in enumerate(stamp_files):
-            src = os.path.join(output_dir, file)
-            temp_name = f"__temp_rename_{i:04d}.png"
-            dst = os.path.join(output_dir, temp_name)
-            os.rename(src, dst)
-            temp_names.append(temp_name)
-        
-        # 連番にリネーム
-        for i, temp_name in enumerate(temp_names, start=1):
-            src = os.path.join(output_dir, temp_name)
-            new_name = f"{i:02d}.png"
-            dst = os.path.join(output_dir, new_name)
-            os.rename(src, dst)
-        
-        count = len(temp_names)
+        deleted_count = len(order.deleted)
+        count = order.apply()
         print(f"リネーム完了: {count}個 (01.png〜{count:02d}.png)")
+        if deleted_count:
+            print(f"  削除マーク: {deleted_count}個を削除")
         self.update_file_count()
     
+    def find_duplicates(self):
+        """出力フォルダ内のよく似たスタンプ（同じポーズ等）をグループ表示（ハッシュはキャッシュして再スキャンを高速化）"""
+        output_dir = self.output_path_var.get()
+        
+        if not output_dir or not os.path.exists(output_dir):
+            print("エラー: 出力フォルダが存在しません。")
+            return
+        
+        try:
+            groups = find_near_duplicates(output_dir)
+        except Exception as e:
+            print(f"類似チェックエラー: {e}")
+            return
+        
+        if not groups:
+            print("よく似たスタンプは見つかりませんでした。")
+            return
+        
+        print(f"👯 よく似たスタンプ: {len(groups)}グループ")
+        for i, group in enumerate(groups, start=1):
+            print(f"  {i}: {', '.join(group)}")
+    
+    def poll_file_count(self):
+        """出力フォルダのインデックスを保ち、変化があったときだけ個数表示を更新（Tkメインスレッド）
+        通知（watchdog）が使えればフォルダは読み直さず、使えなければフォルダの更新日時が変わったときだけ読み直す"""
+        output_dir = self.output_path_var.get()
+        index = self.folder_index
+        
+        if index is not None and (index.folder != output_dir or not os.path.isdir(output_dir)):
+            index.stop()
+            index = self.folder_index = None
+            self.update_file_count()
+        if index is None and output_dir and os.path.isdir(output_dir):
+            index = self.folder_index = FolderIndex(output_dir).start()
+        
+        if index is not None:
+            index.poll()
+            if index.version != self._count_version:
+                self.update_file_count()
+        
+        self.after(COUNT_POLL_MS, self.poll_file_count)
+    
     def update_file_count(self):
         """出力フォルダ内のスタンプ用PNG個数をカウントしてラベルを更新"""
         output_dir = self.output_path_var.get()
@@ -381,132 +619,91 @@ class StampMakerGUI(ctk.CTk, TkinterDnD.DnDWrapper):
             self.file_count_label.configure(text="📁 --個")
             return
         
-        all_files = [f for f in os.listdir(output_dir) if os.path.isfile(os.path.join(output_dir, f))]
-        stamp_count = len([f for f in all_files if f.lower() not in ['main.png', 'tab.png'] and f.lower().endswith('.png')])
+        # 監視中のフォルダはインデックスから数える（削除マークを付けたスタンプは数えない）
+        index = self.folder_index
+        if index is not None and index.folder == output_dir:
+            index.poll()
+            self._count_version = index.version
+            stamp_count = StampOrder(output_dir, index.stamp_files()).count
+        else:
+            stamp_count = StampOrder(output_dir).count
         
         self.file_count_label.configure(text=f"📁 {stamp_count}個")
     
     def create_zip(self):
-        """出力フォルダをZIPファイルに圧縮（連番リネーム付き）+ フォルダも同時出力"""
-        import zipfile
-        from datetime import datetime
-        import re
-        
+        """出力フォルダをZIPファイルに圧縮（並び順マニフェストの順に連番）+ フォルダも同時出力"""
         output_dir = self.output_path_var.get()
         
         if not output_dir or not os.path.exists(output_dir):
             print("エラー: 出力フォルダが存在しません。")
             return
         
-        # 基本名を生成
-        prefix = self.prefix_var.get().strip()
-        if not prefix:
-            input_dir = self.input_path_var.get().strip()
-            if input_dir:
-                prefix = os.path.basename(os.path.normpath(input_dir))
-        include_date = self.date_var.get()
-        
-        # 基本パーツを組み立て
-        name_parts = []
-        if prefix:
-            name_parts.append(prefix)
-        if include_date:
-            name_parts.append(datetime.now().strftime("%Y%m%d"))
-        
-        base_name = "_".join(name_parts) if name_parts else ""
-        
-        # 連番を計算 (既存ZIPをチェック)
-        set_num = 1
-        
-        while True:
-            if base_name:
-                full_name = f"{base_name}_Set{set_num:02d}"
-            else:
-                full_name = f"Set{set_num:02d}"
-            
-            zip_path = os.path.join(output_dir, f"{full_name}.zip")
-            
-            if not os.path.exists(zip_path):
-                break
-            set_num += 1
+        # 基本名を生成（入力フォルダ名 or メモ + 日付）
+        parts = name_parts(self.prefix_var.get(), self.input_path_var.get(), self.date_var.get())
         
         try:
-            # ファイルを取得してソート（フォルダは除外）
-            all_files = [f for f in os.listdir(output_dir) if os.path.isfile(os.path.join(output_dir, f))]
-            
-            # main.pngとtab.pngを分離
-            special_files = [f for f in all_files if f.lower() in ['main.png', 'tab.png']]
-            stamp_files = [f for f in all_files if f.lower() not in ['main.png', 'tab.png'] and f.lower().endswith('.png')]
-            stamp_files.sort()  # ソート
+            # ファイル名はZIP内でだけ連番になる（フォルダ内のリネームは不要）
+            order = StampOrder(output_dir)
+            result = create_zip(output_dir, parts, cleanup=True, stamp_files=order.active())
             
-            if not stamp_files and not special_files:
+            if result is None:
                 print("エラー: 出力フォルダにPNG画像がありません。")
                 return
             
-            # ZIPファイル作成（直接連番リネームして追加）
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # スタンプ画像を連番リネームして追加
-                for i, file in enumerate(stamp_files, start=1):
-                    file_path = os.path.join(output_dir, file)
-                    new_name = f"{i:02d}.png"  # 01.png, 02.png...
-                    zipf.write(file_path, new_name)
-                
-                # main.pngとtab.pngはそのまま追加
-                for file in special_files:
-                    file_path = os.path.join(output_dir, file)
-                    zipf.write(file_path, file)
+            # 削除マークのスタンプも片付け、マニフェストを空にする
+            result["deleted_count"] += delete_outputs(output_dir, order.deleted)
+            order.load()
+            order.save()
             
-            total_count = len(stamp_files) + len(special_files)
-            print(f"\n出力完了!")
-            print(f"  ZIP: {os.path.basename(zip_path)}")
-            print(f"  スタンプ: {len(stamp_files)}個 (01.png〜{len(stamp_files):02d}.png にリネーム)")
+            stamp_count = result["stamp_count"]
+            total_count = stamp_count + result["special_count"]
+            print("\n出力完了!")
+            print(f"  ZIP: {os.path.basename(result['zip_path'])}")
+            print(f"  スタンプ: {stamp_count}個 (01.png〜{stamp_count:02d}.png にリネーム)")
             print(f"  合計: {total_count}個のファイル")
-            
-            # ルートのPNG画像を削除（バックアップフォルダは残す）
-            deleted_count = 0
-            for file in all_files:
-                if file.lower().endswith('.png'):
-                    file_path = os.path.join(output_dir, file)
-                    if os.path.isfile(file_path):
-                        os.remove(file_path)
-                        deleted_count += 1
-            
-            print(f"  クリーンアップ: {deleted_count}個のルート画像を削除")
+            print(f"  クリーンアップ: {result['deleted_count']}個のルート画像を削除")
             
             # ZIPファイルの場所を開く
-            import subprocess
-            subprocess.Popen(['explorer', '/select,', os.path.abspath(zip_path)])
+            self.reveal_path(result['zip_path'], select=True)
             
         except Exception as e:
             print(f"ZIP作成エラー: {e}")
 
     def delete_watermark_files(self):
-        """9の倍数のウォーターマーク画像を削除 (09.png, 18.png, 27.png, 36.png, 45.png...)"""
+        """ウォーターマーク画像を内容から検出し、確認してから削除マークを付ける（watermark_ref.png があればテンプレート照合、なければ不透明部分の少ない画像）
+        ファイルは「🔢 リネーム」で確定するまで残るので、厳選ビューで戻せる"""
         output_dir = self.output_path_var.get()
         
         if not output_dir or not os.path.exists(output_dir):
             print("エラー: 出力フォルダが存在しません。")
             return
         
-        deleted_files = []
-        
-        # 9の倍数のファイルを検索して削除
-        for i in range(9, 1000, 9):  # 9, 18, 27, 36, 45, ...
-            filename = f"{i:02d}.png"
-            file_path = os.path.join(output_dir, filename)
-            
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                    deleted_files.append(filename)
-                except Exception as e:
-                    print(f"削除エラー ({filename}): {e}")
+        try:
+            found = find_watermark_files(output_dir)
+        except Exception as e:
+            print(f"検出エラー: {e}")
+            return
         
-        if deleted_files:
-            print(f"🍌💣 削除完了: {', '.join(deleted_files)}")
-            print(f"合計 {len(deleted_files)} 個のウォーターマーク画像を削除しました。")
-        else:
+        if not found:
             print("削除対象のウォーターマーク画像が見つかりませんでした。")
+            return
+        
+        names = [filename for filename, _ in found]
+        print(f"🍌💣 ウォーターマーク候補: {', '.join(f'{n} ({v:.3f})' for n, v in found)}")
+        listed = "\n".join(names[:WATERMARK_LIST_MAX])
+        if len(names) > WATERMARK_LIST_MAX:
+            listed += f"\n...ほか {len(names) - WATERMARK_LIST_MAX} 個"
+        if not messagebox.askyesno("ウォーターマーク削除",
+                                   f"{len(names)} 個の画像に削除マークを付けます。\n\n{listed}\n\n"
+                                   "（「🔢 リネーム」で確定するまでファイルは残り、厳選ビューで戻せます）", parent=self):
+            print("キャンセルしました。")
+            return
+        
+        order = StampOrder(output_dir)
+        order.delete(names)
+        order.save()
+        print(f"合計 {len(names)} 個のウォーターマーク画像に削除マークを付けました（「🔢 リネーム」で削除）。")
+        self.update_file_count()
 
     def delete_input_images(self):
         """入力フォルダの画像ファイルのみを削除（サブフォルダやその他のファイルは残す）"""
@@ -551,134 +748,107 @@ class StampMakerGUI(ctk.CTk, TkinterDnD.DnDWrapper):
             return
 
         self.run_btn.configure(state="disabled", text="処理中...")
+        self.cancel_btn.configure(state="normal", text="中止")
+        self.cancel_event.clear()
+        self.progress_bar.set(0)
+        self.status_label.configure(text="")
+        self._progress_stage = None
+        self._run_started = time.monotonic()
         
         # Run in thread
         thread = threading.Thread(target=self.run_pipeline, args=(input_dir, output_dir))
         thread.start()
 
+    def cancel_process(self):
+        """実行中の処理に中止を要求（画像の切れ目で停止する）"""
+        self.cancel_event.set()
+        self.cancel_btn.configure(state="disabled", text="中止中...")
+        print("\n中止を要求しました。現在の画像の処理が終わり次第停止します...")
+
     def run_pipeline(self, input_dir, final_output_dir):
         try:
             print(f"--- 処理開始 {datetime.now().strftime('%H:%M:%S')} ---")
             
-            current_input = input_dir
+            try:
+                inner_margin = int(self.split_margin_var.get())
+            except ValueError:
+                inner_margin = 0
             
-            # 1. Split
-            if self.check_split_var.get():
-                output_split = os.path.join(final_output_dir, "temp_split")
-                if os.path.exists(output_split): shutil.rmtree(output_split)
-                
-                try:
-                    inner_margin = int(self.split_margin_var.get())
-                except ValueError:
-                    inner_margin = 0
-                
-                print("\n[Step 1] スタンプ画像を分割中...")
-                # Splitter defaults: tolerance=50, erosion=1 (hidden from UI)
-                # remove_bg=False because we have a separate BG removal step
-                process_splitter(
-                    current_input, 
-                    output_split, 
-                    tolerance=50, 
-                    erosion=1, 
-                    grid=self.grid_var.get(),
-                    remove_bg=False,
-                    inner_margin=inner_margin
-                )
-                current_input = output_split
-
-            # 2. BG Remove
-            if self.check_bg_var.get():
-                output_bg = os.path.join(final_output_dir, "temp_bg")
-                if os.path.exists(output_bg): shutil.rmtree(output_bg)
-                
-                print("\n[Step 2] 背景を透過中...")
-                process_remover(
-                    current_input, 
-                    output_bg, 
-                    mode=self.mode_var.get(), 
-                    tolerance=int(self.tol_slider.get()),
-                    erosion=int(self.bg_ero_slider.get())
-                )
-                current_input = output_bg
-
-            # 3. Trim
-            if self.check_trim_var.get():
-                output_trim = os.path.join(final_output_dir, "temp_trim")
-                if os.path.exists(output_trim): shutil.rmtree(output_trim)
-                
-                print("\n[Step 3] 透明部分をトリミング中...")
-                try:
-                    padding = int(self.pad_var.get())
-                except:
-                    padding = 10
-                
-                process_auto_trimmer(current_input, output_trim, padding=padding)
-                current_input = output_trim
-
-            # 4. Format
-            if self.check_fmt_var.get():
-                print("\n[Step 4] LINEスタンプ形式に整形中...")
-                process_formatter(current_input, final_output_dir)
-                print(f"\n完了！ 出力先: {os.path.abspath(final_output_dir)}")
-            else:
-                print(f"\n処理完了。 最終出力: {os.path.abspath(current_input)}")
-
-            # 一時フォルダを削除
-            temp_folders = ["temp_split", "temp_bg", "temp_trim"]
-            for folder in temp_folders:
-                temp_path = os.path.join(final_output_dir, folder)
-                if os.path.exists(temp_path):
-                    shutil.rmtree(temp_path)
-                    print(f"一時フォルダ削除: {folder}")
+            try:
+                padding = int(self.pad_var.get())
+            except:
+                padding = 10
             
-            # バックアップフォルダを作成（全画像をコピー）
-            prefix = self.prefix_var.get().strip()
-            if not prefix:
-                input_dir = self.input_path_var.get().strip()
-                if input_dir:
-                    prefix = os.path.basename(os.path.normpath(input_dir))
-            include_date = self.date_var.get()
+            try:
+                workers = int(self.workers_var.get())
+            except ValueError:
+                workers = 1
             
-            # バックアップフォルダ名を生成
-            backup_parts = []
-            if prefix:
-                backup_parts.append(prefix)
-            if include_date:
-                backup_parts.append(datetime.now().strftime("%Y%m%d"))
-            backup_parts.append("raw")
+            profile = self.profile_var.get()
+            if profile:
+                instrumentation.reset()
+                instrumentation.enable()
             
-            backup_name = "_".join(backup_parts)
-            backup_path = os.path.join(final_output_dir, backup_name)
+            # 分割→透過→トリミング→整形をメモリ上で連結して実行（一時フォルダを経由しない）
+            # Splitter defaults: tolerance=50, erosion=1 (hidden from UI)
+            # remove_bg=False because we have a separate BG removal step
+            print("\n[Step 1-4] 分割・透過・トリミング・整形を実行中...")
+            run_fused_pipeline(
+                input_dir,
+                final_output_dir,
+                split=self.check_split_var.get(),
+                grid=self.grid_var.get(),
+                inner_margin=inner_margin,
+                split_tolerance=SPLIT_TOLERANCE,
+                split_erosion=1,
+                split_remove_bg=False,
+                remove_bg=self.check_bg_var.get(),
+                mode=self.mode_var.get(),
+                tolerance=int(self.tol_slider.get()),
+                erosion=int(self.bg_ero_slider.get()),
+                trim=self.check_trim_var.get(),
+                padding=padding,
+                format_stamps=self.check_fmt_var.get(),
+                workers=workers,
+                cache_dir=DEFAULT_CACHE_DIR if self.cache_var.get() else None,
+                progress=self.log_sink.progress,
+                cancel=self.cancel_event
+            )
             
-            # 既存のバックアップフォルダがあれば連番を付ける
-            if os.path.exists(backup_path):
-                i = 2
-                while os.path.exists(f"{backup_path}_{i}"):
-                    i += 1
-                backup_path = f"{backup_path}_{i}"
-                backup_name = os.path.basename(backup_path)
+            if self.check_fmt_var.get():
+                print(f"\n完了！ 出力先: {os.path.abspath(final_output_dir)}")
+            else:
+                print(f"\n処理完了。 最終出力: {os.path.abspath(final_output_dir)}")
             
-            os.makedirs(backup_path, exist_ok=True)
+            if profile:
+                instrumentation.finish(os.path.join(final_output_dir, "profile_report.json"))
             
-            # 出力フォルダのPNG画像をバックアップにコピー
-            copied_count = 0
-            for file in os.listdir(final_output_dir):
-                if file.lower().endswith('.png'):
-                    src = os.path.join(final_output_dir, file)
-                    dst = os.path.join(backup_path, file)
-                    if os.path.isfile(src):
-                        shutil.copy2(src, dst)
-                        copied_count += 1
+            # バックアップフォルダを作成（全画像をコピー）
+            parts = name_parts(self.prefix_var.get(), self.input_path_var.get(), self.date_var.get())
+            backup_path, copied_count = create_backup(final_output_dir, parts)
             
-            print(f"\nバックアップ作成: {backup_name}/ ({copied_count}個の画像)")
+            print(f"\nバックアップ作成: {os.path.basename(backup_path)}/ ({copied_count}個の画像)")
 
+        except Cancelled:
+            print("\n処理を中止しました。出力フォルダは変更されていません。")
         except Exception as e:
             print(f"\nエラーが発生しました: {e}")
             import traceback
             traceback.print_exc()
         finally:
-            self.run_btn.configure(state="normal", text="処理開始 (RUN)")
+            instrumentation.disable()
+            
+            # 一時フォルダを削除（以前の実行の残りや中止時の書きかけ）
+            temp_folders = ["temp_split", "temp_bg", "temp_trim", TEMP_WRITE_DIR]
+            for folder in temp_folders:
+                temp_path = os.path.join(final_output_dir, folder)
+                if os.path.exists(temp_path):
+                    shutil.rmtree(temp_path, ignore_errors=True)
+                    print(f"一時フォルダ削除: {folder}")
+            
             print("\n--- 終了 ---")
+            # ボタンの再有効化はTkメインスレッドで行う
+            self.log_sink.event("done")
 
 if __name__ == "__main__":
     app = StampMakerGUI()
@@ -0,0 +1,242 @@
+import cv2
+import numpy as np
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import instrumentation
+
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg')
+
+PNG_STRATEGIES = {
+    "default": cv2.IMWRITE_PNG_STRATEGY_DEFAULT,
+    "filtered": cv2.IMWRITE_PNG_STRATEGY_FILTERED,
+    "huffman": cv2.IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY,
+    "rle": cv2.IMWRITE_PNG_STRATEGY_RLE,
+    "fixed": cv2.IMWRITE_PNG_STRATEGY_FIXED,
+}
+PNG_FILTERS = {
+    "none": cv2.IMWRITE_PNG_FILTER_NONE,
+    "sub": cv2.IMWRITE_PNG_FILTER_SUB,
+    "up": cv2.IMWRITE_PNG_FILTER_UP,
+    "avg": cv2.IMWRITE_PNG_FILTER_AVG,
+    "paeth": cv2.IMWRITE_PNG_FILTER_PAETH,
+    "fast": cv2.IMWRITE_PNG_FAST_FILTERS,
+    "all": cv2.IMWRITE_PNG_ALL_FILTERS,
+}
+# (level, strategy, filter); None leaves OpenCV's default (level 1, rle, sub)
+PNG_PRESETS = {
+    "default": (None, None, None),
+    "fast": (1, "default", "none"),   # 中間ファイル向け: 約15%速く、ファイルは約15%大きい
+    "max": (9, "filtered", "all"),    # 最終出力向け: 最小サイズ、エンコードは約10倍遅い
+}
+
+ENCODE_THREADS = 2    # EncodePool threads (cv2.imencode releases the GIL)
+ENCODE_PENDING = 8    # images queued in an EncodePool before submit() blocks
+
+def list_images(input_dir):
+    """
+    Returns the image paths in input_dir, sorted by filename.
+    """
+    files = [f for f in os.listdir(input_dir) if f.lower().endswith(IMAGE_EXTS)]
+    files.sort()
+    return [os.path.join(input_dir, f) for f in files]
+
+def decode_image(file_path):
+    """
+    Decodes an image file (Unicode paths supported). Returns None if unreadable.
+    """
+    with instrumentation.span("decode", image=os.path.basename(file_path)):
+        data = np.fromfile(file_path, dtype=np.uint8)
+        instrumentation.add_bytes(read=data.nbytes)
+        return cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+
+def to_bgra(img):
+    """
+    Ensures 4 channels (BGRA).
+    """
+    if len(img.shape) == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGRA)
+    if img.shape[2] == 3:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+    return img
+
+def parse_png(value):
+    """
+    PNG encoder settings from a preset name ("default", "fast", "max") or
+    "LEVEL[,STRATEGY[,FILTER]]", e.g. "9,filtered,all". Returns (level, strategy, filter).
+    """
+    if value in PNG_PRESETS:
+        return PNG_PRESETS[value]
+    parts = [v.strip() for v in value.split(',')]
+    if len(parts) > 3 or not parts[0].isdigit() or not 0 <= int(parts[0]) <= 9:
+        raise ValueError(f"PNG settings must be {'/'.join(PNG_PRESETS)} or LEVEL(0-9)[,STRATEGY[,FILTER]]")
+    strategy = parts[1] if len(parts) > 1 and parts[1] else None
+    png_filter = parts[2] if len(parts) > 2 and parts[2] else None
+    if strategy is not None and strategy not in PNG_STRATEGIES:
+        raise ValueError(f"PNG strategy must be one of {', '.join(PNG_STRATEGIES)}")
+    if png_filter is not None and png_filter not in PNG_FILTERS:
+        raise ValueError(f"PNG filter must be one of {', '.join(PNG_FILTERS)}")
+    return int(parts[0]), strategy, png_filter
+
+def png_params(png=None):
+    """
+    cv2.imencode parameters for png: None (OpenCV default), a preset name / settings
+    string (see parse_png) or a (level, strategy, filter) tuple.
+    """
+    if png is None:
+        return []
+    if isinstance(png, str):
+        png = parse_png(png)
+    level, strategy, png_filter = png
+    params = []
+    if level is not None:
+        params += [cv2.IMWRITE_PNG_COMPRESSION, level]
+    if strategy is not None:
+        params += [cv2.IMWRITE_PNG_STRATEGY, PNG_STRATEGIES[strategy]]
+    if png_filter is not None:
+        params += [cv2.IMWRITE_PNG_FILTER, PNG_FILTERS[png_filter]]
+    return params
+
+def encode_png(img, png=None):
+    """
+    Encodes img as PNG and returns the bytes (None on failure).
+    png: encoder settings (see png_params).
+    """
+    with instrumentation.span("encode"):
+        is_success, im_buf = cv2.imencode(".png", img, png_params(png))
+        return im_buf.tobytes() if is_success else None
+
+def save_png(img, output_path, png=None):
+    """
+    Encodes img as PNG and writes it. Returns True on success.
+    png: encoder settings (see png_params).
+    """
+    with instrumentation.span("encode"):
+        is_success, im_buf = cv2.imencode(".png", img, png_params(png))
+    if is_success:
+        write_bytes(output_path, im_buf)
+    return is_success
+
+def write_bytes(path, data):
+    with instrumentation.span("write"):
+        with open(path, "wb") as fp:
+            fp.write(data)
+        instrumentation.add_bytes(written=len(data))
+
+def read_images(paths, on_skip=None):
+    """
+    Streaming source: yields (name, img, metadata) for each readable file.
+    name is the filename without extension, img is the decoded ndarray as stored
+    (call to_bgra if needed) and metadata holds {"source": path}.
+    on_skip(name, reason) is called for files that cannot be decoded.
+    """
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            img = decode_image(path)
+        except Exception as e:
+            if on_skip:
+                on_skip(name, f"Error opening {path}: {e}")
+            continue
+        if img is None:
+            if on_skip:
+                on_skip(name, f"Could not read {path}")
+            continue
+        yield name, img, {"source": path}
+
+class EncodePool(object):
+    """
+    Runs PNG encodes and file writes on background threads so decoding and processing
+    of the next image is not serialized behind them. At most `pending` jobs are queued
+    (submit blocks beyond that) to bound the memory held by images waiting to be encoded.
+    threads=0 runs every job inline in submit().
+    """
+
+    def __init__(self, threads=ENCODE_THREADS, pending=ENCODE_PENDING):
+        self._executor = ThreadPoolExecutor(max_workers=threads) if threads > 0 else None
+        self._slots = threading.BoundedSemaphore(max(1, pending))
+        self._jobs = deque()
+
+    def _run(self, fn, args):
+        try:
+            return fn(*args)
+        finally:
+            self._slots.release()
+
+    def submit(self, fn, *args):
+        """
+        Queues fn(*args) and returns its Future (results are collected in order by drain()).
+        """
+        self._slots.acquire()
+        if self._executor is None:
+            future = Future()
+            try:
+                future.set_result(self._run(fn, args))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = self._executor.submit(self._run, fn, args)
+        self._jobs.append(future)
+        return future
+
+    def encode(self, img, png=None):
+        return self.submit(encode_png, img, png)
+
+    def save(self, img, output_path, png=None):
+        return self.submit(save_png, img, output_path, png)
+
+    def drain(self):
+        """
+        Waits for every queued job and returns their results in submission order
+        (re-raises the first exception).
+        """
+        results = []
+        while self._jobs:
+            results.append(self._jobs.popleft().result())
+        return results
+
+    def close(self):
+        try:
+            self.drain()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            # Do not mask the original error; just let queued jobs finish
+            self._jobs.clear()
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+        else:
+            self.close()
+        return False
+
+def write_images(items, output_dir, png=None, threads=ENCODE_THREADS):
+    """
+    Streaming sink: saves each (name, img, metadata) item as <output_dir>/<name>.png
+    and yields (output_path, metadata) in input order once the file is written.
+    Encodes run on an EncodePool, overlapping with producing the next items.
+    Items that fail to encode are not yielded.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    pending = deque()
+    with EncodePool(threads) as pool:
+        for name, img, meta in items:
+            output_path = os.path.join(output_dir, f"{name}.png")
+            pending.append((pool.save(img, output_path, png), output_path, meta))
+            # Hand back finished writes without waiting for the whole stream
+            while pending and pending[0][0].done():
+                future, path, done_meta = pending.popleft()
+                if future.result():
+                    yield path, done_meta
+        while pending:
+            future, path, done_meta = pending.popleft()
+            if future.result():
+                yield path, done_meta
@@ -0,0 +1,187 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+# Opt-in: everything below is a no-op until enable() is called
+_enabled = False
+_track_memory = False
+_lock = threading.Lock()
+_records = []
+_local = threading.local()
+_NULL = nullcontext()
+
+def enable(track_memory=True):
+    """
+    Starts recording spans. track_memory uses tracemalloc (NumPy / OpenCV arrays are
+    included) and adds noticeable overhead, so it can be turned off for pure timing.
+    """
+    global _enabled, _track_memory
+    _enabled = True
+    _track_memory = track_memory
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    global _enabled
+    _enabled = False
+    if _track_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    with _lock:
+        _records.clear()
+
+def records():
+    with _lock:
+        return list(_records)
+
+def merge(new_records):
+    """
+    Adds records collected in another process (see parallel.run_tasks).
+    """
+    with _lock:
+        _records.extend(new_records)
+
+class _Span(object):
+    def __init__(self, stage, image):
+        self.stage = stage
+        self.image = image
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        if self.image is None and stack:
+            self.image = stack[-1].image
+        if _track_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak_abs = max(stack[-1].peak_abs, peak)
+            tracemalloc.reset_peak()
+            self.start_mem = current
+            self.peak_abs = current
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        peak = 0
+        if _track_memory:
+            _, traced_peak = tracemalloc.get_traced_memory()
+            self.peak_abs = max(self.peak_abs, traced_peak)
+            peak = self.peak_abs - self.start_mem
+            if stack:
+                stack[-1].peak_abs = max(stack[-1].peak_abs, self.peak_abs)
+            tracemalloc.reset_peak()
+        if stack:
+            stack[-1].bytes_read += self.bytes_read
+            stack[-1].bytes_written += self.bytes_written
+        with _lock:
+            _records.append({
+                "stage": self.stage,
+                "image": self.image,
+                "wall_ms": round(wall * 1000, 3),
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+                "peak_mem": peak,
+            })
+        return False
+
+def span(stage, image=None):
+    """
+    Context manager recording one stage (or sub-operation) for one image.
+    Nested spans inherit the image name and roll their bytes / peak memory up into the parent.
+    """
+    if not _enabled:
+        return _NULL
+    return _Span(stage, image)
+
+def traced(stage):
+    """
+    Decorator for per-file functions: records a span named stage with the
+    basename of the first argument (the file path) as the image.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(file_path, *args, **kwargs):
+            if not _enabled:
+                return fn(file_path, *args, **kwargs)
+            with _Span(stage, os.path.basename(file_path)):
+                return fn(file_path, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def add_bytes(read=0, written=0):
+    """
+    Attributes I/O bytes to the innermost open span.
+    """
+    if not _enabled:
+        return
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1].bytes_read += read
+        stack[-1].bytes_written += written
+
+def summarize(recs=None):
+    """
+    Aggregates records per stage: count, total/mean/max wall time, bytes and max peak memory.
+    """
+    if recs is None:
+        recs = records()
+    stages = {}
+    for r in recs:
+        s = stages.setdefault(r["stage"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                           "bytes_read": 0, "bytes_written": 0, "peak_mem": 0})
+        s["count"] += 1
+        s["total_ms"] += r["wall_ms"]
+        s["max_ms"] = max(s["max_ms"], r["wall_ms"])
+        s["bytes_read"] += r["bytes_read"]
+        s["bytes_written"] += r["bytes_written"]
+        s["peak_mem"] = max(s["peak_mem"], r["peak_mem"])
+    for s in stages.values():
+        s["total_ms"] = round(s["total_ms"], 3)
+        s["mean_ms"] = round(s["total_ms"] / s["count"], 3)
+    return stages
+
+def report():
+    recs = records()
+    return {"memory_tracked": _track_memory, "stages": summarize(recs), "records": recs}
+
+def summary_table(stages=None):
+    """
+    Returns a short text table of the per-stage summary, slowest stage first.
+    """
+    if stages is None:
+        stages = summarize()
+    mb = 1024 * 1024
+    lines = [f"{'stage':<16}{'count':>7}{'total s':>10}{'mean ms':>10}{'max ms':>10}{'read MB':>9}{'write MB':>9}{'peak MB':>9}"]
+    for name, s in sorted(stages.items(), key=lambda kv: -kv[1]["total_ms"]):
+        lines.append(f"{name:<16}{s['count']:>7}{s['total_ms'] / 1000:>10.3f}{s['mean_ms']:>10.2f}{s['max_ms']:>10.2f}"
+                     f"{s['bytes_read'] / mb:>9.2f}{s['bytes_written'] / mb:>9.2f}{s['peak_mem'] / mb:>9.2f}")
+    return "\n".join(lines)
+
+def finish(report_path):
+    """
+    Writes the JSON report and prints the summary table.
+    """
+    data = report()
+    folder = os.path.dirname(report_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(report_path, "w", encoding="utf-8") as fp:
+        json.dump(data, fp, ensure_ascii=False, indent=2)
+    print(f"\nProfile report: {report_path}")
+    print(summary_table(data["stages"]))
+    return data
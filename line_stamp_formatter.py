@@ -4,11 +4,106 @@ import os
 import argparse
 import shutil
 
+import instrumentation
+from image_io import IMAGE_EXTS, decode_image, to_bgra, encode_png, write_bytes, parse_png
+from parallel import run_tasks
+from png_optimizer import process_optimizer
+from stamp_order import reset_order
+
+# Output profiles: name -> (width, height, margin, fit)
+# fit "pad": fit inside the canvas minus margin with even sizes (resize_and_pad),
+# "exact": fit inside the canvas without margin (resize_exact)
+PROFILES = {
+    "stamp": (370, 320, 10, "pad"),
+    "main": (240, 240, 0, "pad"),
+    "tab": (96, 74, 0, "exact"),
+    "emoji": (180, 180, 0, "pad"),
+}
+PYRAMID_OVERSAMPLE = 2   # a pyramid level is used only if it is at least this x the target size
+
+def parse_profile(value):
+    """
+    Returns (name, (width, height, margin, fit)) for a PROFILES name or a custom
+    "NAME=WxH[+MARGIN]" profile (fit "pad"), e.g. "large=740x640+20".
+    """
+    value = value.strip()
+    if value in PROFILES:
+        return value, PROFILES[value]
+    try:
+        name, size = value.split("=")
+        size, _, margin = size.partition("+")
+        width, height = (int(v) for v in size.lower().split("x"))
+        margin = int(margin or 0)
+    except ValueError:
+        raise ValueError(f"Profile must be one of {', '.join(PROFILES)} or NAME=WxH[+MARGIN]")
+    if not name or width <= 2 * margin or height <= 2 * margin:
+        raise ValueError(f"Invalid profile: {value}")
+    return name, (width, height, margin, "pad")
+
+def resize_pyramid(img, min_w, min_h):
+    """
+    Returns [img, img / 2, img / 4, ...] (INTER_AREA halvings), stopping before a level
+    smaller than PYRAMID_OVERSAMPLE x (min_w, min_h). Rendering several small targets
+    from the nearest level avoids downscaling a large source from full size for each.
+    """
+    levels = [img]
+    while True:
+        h, w = levels[-1].shape[:2]
+        if w // 2 < PYRAMID_OVERSAMPLE * min_w or h // 2 < PYRAMID_OVERSAMPLE * min_h:
+            return levels
+        levels.append(cv2.resize(levels[-1], (w // 2, h // 2), interpolation=cv2.INTER_AREA))
+
+def _pick_level(levels, new_w, new_h):
+    """
+    Smallest pyramid level that is at least PYRAMID_OVERSAMPLE x (new_w, new_h), else the source.
+    """
+    for level in reversed(levels[1:]):
+        h, w = level.shape[:2]
+        if w >= PYRAMID_OVERSAMPLE * new_w and h >= PYRAMID_OVERSAMPLE * new_h:
+            return level
+    return levels[0]
+
+def _fit_size(w, h, target_w, target_h, margin, fit):
+    """
+    Size of the resized content on a target canvas (same rules as resize_and_pad / resize_exact).
+    """
+    if fit == "exact":
+        scale = min(target_w / w, target_h / h)
+        return max(1, int(w * scale)), max(1, int(h * scale))
+    scale = min((target_w - margin * 2) / w, (target_h - margin * 2) / h)
+    return max(2, (int(w * scale) // 2) * 2), max(2, (int(h * scale) // 2) * 2)
+
+def render_profiles(img, profiles):
+    """
+    Renders every profile from one decoded BGRA image. profiles is a list of names /
+    custom specs (see parse_profile) or (name, spec) pairs. The other targets share
+    one resize pyramid; "stamp" is always resized from the full-size image, so it is
+    identical to resize_and_pad (and format_stage). Returns {name: canvas}.
+    """
+    with instrumentation.span("resize"):
+        specs = [p if isinstance(p, tuple) else parse_profile(p) for p in profiles]
+        h, w = img.shape[:2]
+        sizes = [_fit_size(w, h, tw, th, margin, fit) for name, (tw, th, margin, fit) in specs if name != "stamp"]
+        levels = resize_pyramid(img, min(s[0] for s in sizes), min(s[1] for s in sizes)) if sizes else [img]
+
+        outputs = {}
+        for name, (target_w, target_h, margin, fit) in specs:
+            source_levels = None if name == "stamp" else levels
+            if fit == "exact":
+                outputs[name] = _resize_exact(img, target_w, target_h, source_levels)
+            else:
+                outputs[name] = _resize_and_pad(img, target_w, target_h, margin, source_levels)
+        return outputs
+
 def resize_and_pad(img, target_w, target_h, margin=10):
     """
     Resizes image to FIT within target dimensions (minus margin),
     and centers it on an EXACT target_w x target_h transparent canvas.
     """
+    with instrumentation.span("resize"):
+        return _resize_and_pad(img, target_w, target_h, margin)
+
+def _resize_and_pad(img, target_w, target_h, margin, levels=None):
     h, w = img.shape[:2]
     
     # Effective target size after margin
@@ -24,8 +119,9 @@ def resize_and_pad(img, target_w, target_h, margin=10):
     new_w = max(2, (new_w // 2) * 2)
     new_h = max(2, (new_h // 2) * 2)
     
-    # Resize image
-    resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    # Resize image (from the nearest pyramid level when rendering several profiles)
+    source = _pick_level(levels, new_w, new_h) if levels else img
+    resized = cv2.resize(source, (new_w, new_h), interpolation=cv2.INTER_AREA)
     
     # Create transparent canvas with exact target dimensions
     canvas = np.zeros((target_h, target_w, 4), dtype=np.uint8)
@@ -43,6 +139,10 @@ def resize_exact(img, target_w, target_h):
     Resizes image and places it on a canvas with EXACT target dimensions.
     tab.png用：正確に96x74pxなど指定サイズを保証する。
     """
+    with instrumentation.span("resize"):
+        return _resize_exact(img, target_w, target_h)
+
+def _resize_exact(img, target_w, target_h, levels=None):
     h, w = img.shape[:2]
     
     # Ensure 4 channels (BGRA)
@@ -60,8 +160,9 @@ def resize_exact(img, target_w, target_h):
     new_w = max(1, new_w)
     new_h = max(1, new_h)
     
-    # Resize image
-    resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    # Resize image (levels are BGRA, so they are only used when the source already is)
+    source = _pick_level(levels, new_w, new_h) if levels and img.ndim == 3 and img.shape[2] == 4 else img
+    resized = cv2.resize(source, (new_w, new_h), interpolation=cv2.INTER_AREA)
     
     # Create transparent canvas with exact target dimensions
     canvas = np.zeros((target_h, target_w, 4), dtype=np.uint8)
@@ -74,12 +175,93 @@ def resize_exact(img, target_w, target_h):
     
     return canvas
 
-def process_formatter(input_dir, output_dir):
+def format_stage(items, target_w=370, target_h=320, margin=10, keep_source=False):
+    """
+    Streaming format stage: for each (name, img, metadata) item yields
+    (name, formatted canvas, metadata). Numbering (01.png, ...) is left to the sink,
+    which needs the sorted names.
+    keep_source: also store the unformatted BGRA image as metadata["source_image"]
+    (used to render main/tab from the first stamp).
+    """
+    for name, img, meta in items:
+        with instrumentation.span("format", image=name):
+            img = to_bgra(img)
+            meta = dict(meta, canvas=(target_w, target_h))
+            if keep_source:
+                meta["source_image"] = img
+            formatted = resize_and_pad(img, target_w, target_h, margin=margin)
+        yield name, formatted, meta
+
+def render_main_tab(img, png=None):
+    """
+    Renders main.png (240x240) and tab.png (96x74) from a decoded BGRA image.
+    png: PNG encoder settings (image_io.png_params)
+    Returns {"main.png": PNG bytes, "tab.png": PNG bytes} (without those that failed to encode).
+    """
+    specials = {}
+    for name, canvas in render_profiles(img, ["main", "tab"]).items():
+        data = encode_png(canvas, png)
+        if data is not None:
+            specials[f"{name}.png"] = data
+    return specials
+
+def write_main_tab(specials, output_dir):
+    """
+    Writes the {"main.png": PNG bytes, ...} of render_main_tab into output_dir.
+    """
+    for name, data in sorted(specials.items()):
+        path = os.path.join(output_dir, name)
+        write_bytes(path, data)
+        print(f"Generated: {path}")
+
+def save_main_tab(img, output_dir, png=None):
+    """
+    Generates main.png (240x240) and tab.png (96x74) from a decoded BGRA image.
+    png: PNG encoder settings (image_io.png_params)
+    Returns {"main.png": PNG bytes, "tab.png": PNG bytes} of the written files.
+    """
+    specials = render_main_tab(img, png)
+    write_main_tab(specials, output_dir)
+    return specials
+
+@instrumentation.traced("file")
+def format_file(file_path, with_main_tab=False, png=None, profiles=()):
+    """
+    Decodes one image and returns its formatted outputs as PNG bytes (encoded with
+    the png settings): {"stamp": ...} plus "main"/"tab" when with_main_tab is set
+    and one entry per extra profile (see parse_profile), all rendered from one decode.
+    Returns None if the file cannot be read, {} if formatting failed.
+    """
+    f = os.path.basename(file_path)
+    try:
+        img = decode_image(file_path)
+        if img is None: return None
+        
+        # Ensure 4 channels
+        img = to_bgra(img)
+        
+        # Format: 370x320, margin 10 (+ main/tab and extra profiles)
+        targets = ["stamp"] + (["main", "tab"] if with_main_tab else []) + list(profiles)
+        return {name: encode_png(canvas, png) for name, canvas in render_profiles(img, targets).items()}
+
+    except Exception as e:
+        print(f"Error processing {f}: {e}")
+        return {}
+
+def process_formatter(input_dir, output_dir, workers=1, png=None, profiles=(), optimize_kb=None):
+    """
+    profiles: extra output profiles (e.g. "emoji", "large=740x640+20"); each stamp is
+    also saved as <output_dir>/<profile name>/NN.png
+    optimize_kb: shrink the files written by this run (stamps, profiles and main/tab)
+    to this size budget afterwards (png_optimizer); other files in output_dir are left alone
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
+    profiles = [p if isinstance(p, tuple) else parse_profile(p) for p in profiles]
+    for name, _ in profiles:
+        os.makedirs(os.path.join(output_dir, name), exist_ok=True)
 
-    exts = ('.png', '.jpg', '.jpeg')
-    files = [f for f in os.listdir(input_dir) if f.lower().endswith(exts)]
+    files = [f for f in os.listdir(input_dir) if f.lower().endswith(IMAGE_EXTS)]
     files.sort() # Ensure consistent order
     
     if not files:
@@ -88,55 +270,63 @@ def process_formatter(input_dir, output_dir):
 
     print(f"Formatting {len(files)} images...")
     
+    # Decode/resize/encode in parallel; numbering is assigned here in sorted order
+    tasks = [(os.path.join(input_dir, f), i == 0, png, profiles) for i, f in enumerate(files)]
+    results = run_tasks(format_file, tasks, workers)
+    
     # Process all regular stamps (no limit)
     count = 1
-    for f in files:
-        file_path = os.path.join(input_dir, f)
-        try:
-            img = cv2.imdecode(np.fromfile(file_path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
-            if img is None: continue
-            
-            # Ensure 4 channels
-            if img.shape[2] == 3:
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
-            
-            # Format: 370x320, margin 10
-            formatted = resize_and_pad(img, 370, 320, margin=10)
-            
-            # Save as 01.png, 02.png...
-            output_filename = f"{count:02d}.png"
-            output_path = os.path.join(output_dir, output_filename)
-            
-            is_success, im_buf = cv2.imencode(".png", formatted)
-            if is_success:
-                im_buf.tofile(output_path)
-                print(f"Saved: {output_path}")
-            
-            # Generate Main and Tab images from the first image (01.png)
-            if count == 1:
-                # Main: 240x240
-                main_img = resize_and_pad(img, 240, 240, margin=0)
-                main_path = os.path.join(output_dir, "main.png")
-                cv2.imencode(".png", main_img)[1].tofile(main_path)
-                print(f"Generated: {main_path}")
-                
-                # Tab: 96x74
-                tab_img = resize_exact(img, 96, 74)
-                tab_path = os.path.join(output_dir, "tab.png")
-                cv2.imencode(".png", tab_img)[1].tofile(tab_path)
-                print(f"Generated: {tab_path}")
-
-        except Exception as e:
-            print(f"Error processing {f}: {e}")
+    written = []   # paths relative to output_dir
+    for (file_path, _, _, _), outputs in zip(tasks, results):
+        if outputs is None: continue
+        
+        # Save as 01.png, 02.png...
+        if outputs.get("stamp") is not None:
+            output_path = os.path.join(output_dir, f"{count:02d}.png")
+            write_bytes(output_path, outputs["stamp"])
+            written.append(f"{count:02d}.png")
+            print(f"Saved: {output_path}")
+            for name, _ in profiles:
+                if outputs.get(name) is None:
+                    print(f"Could not encode {name} for {os.path.basename(file_path)}")
+                    continue
+                write_bytes(os.path.join(output_dir, name, f"{count:02d}.png"), outputs[name])
+                written.append(os.path.join(name, f"{count:02d}.png"))
+        
+        # Generate Main and Tab images from the first image (01.png)
+        if count == 1 and outputs:
+            if "main" not in outputs:
+                # The first file was unreadable, so this one was not rendered with main/tab
+                outputs = format_file(file_path, with_main_tab=True, png=png, profiles=profiles) or {}
+            for special in ("main", "tab"):
+                if outputs.get(special) is None:
+                    print(f"Could not generate {special}.png from {os.path.basename(file_path)}")
+                    continue
+                special_path = os.path.join(output_dir, f"{special}.png")
+                write_bytes(special_path, outputs[special])
+                written.append(f"{special}.png")
+                print(f"Generated: {special_path}")
         
         count += 1
 
+    if count > 1:
+        # The curated order / delete marks belong to the stamps that were just replaced
+        reset_order(output_dir)
+
+    if optimize_kb and written:
+        process_optimizer(output_dir, optimize_kb, workers=workers, files=written)
+
     print("Done!")
 
 def main():
     parser = argparse.ArgumentParser(description="LINE Stamp Formatter")
     parser.add_argument("--input", default="input_format", help="Input directory")
     parser.add_argument("--output", default="output_format", help="Output directory")
+    parser.add_argument("--targets", default="", help="Extra output sizes saved to <output>/<name>/: emoji or NAME=WxH[+MARGIN], comma separated")
+    parser.add_argument("--optimize_kb", type=int, default=None, help="Shrink each output PNG to at most this many KB (palette / quantization)")
+    parser.add_argument("--png", default="default", help="PNG encoder: default, fast (intermediates), max (smallest) or LEVEL[,STRATEGY[,FILTER]]")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel workers (0 = all CPU cores)")
+    parser.add_argument("--profile", default=None, help="Write a timing/memory report (JSON) to this path")
     
     args = parser.parse_args()
 
@@ -144,7 +334,25 @@ def main():
         print(f"Error: '{args.input}' directory not found.")
         return
 
-    process_formatter(args.input, args.output)
+    try:
+        targets = [parse_profile(v) for v in args.targets.split(",") if v.strip()]
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+
+    try:
+        png = parse_png(args.png)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+
+    if args.profile:
+        instrumentation.enable()
+
+    process_formatter(args.input, args.output, args.workers, png, targets, args.optimize_kb)
+
+    if args.profile:
+        instrumentation.finish(args.profile)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,50 @@
+import queue
+import time
+
+class LogSink(object):
+    """
+    Thread-safe replacement for sys.stdout that also carries structured events.
+    Worker threads only enqueue; the UI thread calls drain() on a timer and applies
+    the batch (one text insert per tick instead of one widget update per print).
+    """
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+
+    def write(self, string):
+        if string:
+            self.queue.put(("text", string))
+
+    def flush(self):
+        pass
+
+    def event(self, kind, **fields):
+        """
+        Enqueues a structured event, e.g. event("done").
+        """
+        fields["type"] = kind
+        self.queue.put(("event", fields))
+
+    def progress(self, stage, index, total):
+        """
+        Progress callback for the pipeline: index of total items finished in stage.
+        time is taken here (worker side) so throughput is not skewed by the drain interval.
+        """
+        self.event("progress", stage=stage, index=index, total=total, time=time.monotonic())
+
+    def drain(self, max_items=5000):
+        """
+        Returns (text, events) queued since the last call (at most max_items entries).
+        """
+        texts = []
+        events = []
+        for _ in range(max_items):
+            try:
+                kind, payload = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "text":
+                texts.append(payload)
+            else:
+                events.append(payload)
+        return "".join(texts), events
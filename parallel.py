@@ -0,0 +1,100 @@
+import io
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from contextlib import redirect_stdout
+
+import instrumentation
+
+CANCEL_POLL_SEC = 0.1
+
+class Cancelled(Exception):
+    """
+    Raised when a run is stopped through its cancel event.
+    """
+
+def check_cancel(cancel):
+    """
+    cancel: None or a threading.Event (anything with is_set()). Raises Cancelled once it is set.
+    """
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+
+def cancellable(items, cancel):
+    """
+    Passes (name, img, metadata) items through, checking cancel before each one.
+    Put between streaming stages so a run stops between images.
+    """
+    if cancel is None:
+        yield from items
+        return
+    for item in items:
+        check_cancel(cancel)
+        yield item
+
+def resolve_workers(workers):
+    """
+    Normalizes a --workers value. 0 or None means "all CPU cores".
+    """
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+def _call_captured(fn, args, profile=None):
+    """
+    Runs fn(*args) in a worker process and returns (result, printed text, profile records).
+    profile: None, or the parent's track_memory flag to record instrumentation spans.
+    """
+    if profile is not None:
+        instrumentation.enable(track_memory=profile)
+        instrumentation.reset()
+    buf = io.StringIO()
+    with redirect_stdout(buf):
+        result = fn(*args)
+    recs = instrumentation.records() if profile is not None else None
+    return result, buf.getvalue(), recs
+
+def run_tasks(fn, tasks, workers=1, on_done=None, cancel=None):
+    """
+    Runs fn(*args) for every args tuple in tasks and returns the results in task order.
+    With workers > 1 the tasks run in a process pool; each worker's printed log is
+    replayed in task order so the output stays deterministic.
+    on_done(index, result) is called in task order as results become available.
+    cancel: threading.Event checked between tasks (and while waiting on the pool).
+    Raises Cancelled; pending tasks are dropped and running ones are not waited for.
+    """
+    workers = resolve_workers(workers)
+    results = []
+    if workers <= 1 or len(tasks) <= 1:
+        for i, args in enumerate(tasks):
+            check_cancel(cancel)
+            result = fn(*args)
+            results.append(result)
+            if on_done:
+                on_done(i, result)
+        return results
+
+    profile = instrumentation._track_memory if instrumentation.is_enabled() else None
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(tasks)))
+    try:
+        futures = [pool.submit(_call_captured, fn, args, profile) for args in tasks]
+        for i, future in enumerate(futures):
+            while True:
+                check_cancel(cancel)
+                try:
+                    result, text, recs = future.result(timeout=CANCEL_POLL_SEC if cancel is not None else None)
+                    break
+                except TimeoutError:
+                    pass
+            if text:
+                sys.stdout.write(text)
+            if recs:
+                instrumentation.merge(recs)
+            results.append(result)
+            if on_done:
+                on_done(i, result)
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+    return results
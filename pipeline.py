@@ -0,0 +1,461 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import instrumentation
+from image_io import list_images, read_images, write_bytes, parse_png, encode_png, EncodePool
+from stamp_splitter_v2 import split_stage
+from background_remover import remove_bg_stage, parse_color
+from auto_trimmer import trim_stage
+from line_stamp_formatter import format_stage, render_main_tab, write_main_tab
+from parallel import run_tasks, resolve_workers, Cancelled, check_cancel, cancellable
+from result_cache import ResultCache, file_digest, DEFAULT_CACHE_DIR, DEFAULT_CACHE_MB
+from stamp_export import name_parts, create_backup, export_zips, delete_outputs
+from png_optimizer import optimize_outputs, decode_image_bytes
+from stamp_order import reset_order
+
+# Exit codes of the headless CLI
+EXIT_OK = 0
+EXIT_FAILED = 1      # unexpected error during the run
+EXIT_USAGE = 2       # invalid arguments / missing input folder
+EXIT_NO_OUTPUT = 3   # no images found or every image was skipped
+
+# Outputs are written here first and moved into place once every file is written
+TEMP_WRITE_DIR = "temp_write"
+
+def stream_pipeline(items, split=True, grid="auto", inner_margin=0,
+                    split_tolerance=50, split_erosion=1, split_remove_bg=False, split_max_mb=None,
+                    remove_bg=False, mode="flood", tolerance=30, color="255,255,255", erosion=0,
+                    trim=False, padding=10, trim_alpha=0, format_stamps=True, on_skip=None, keep_source=False, cancel=None):
+    """
+    Chains the enabled streaming stages over (name, img, metadata) items
+    (e.g. from image_io.read_images) and returns the resulting generator.
+    Names get the same suffixes as the directory tools (_01, _processed, _trimmed).
+    Only one sheet's cells are held in memory at a time.
+    cancel: threading.Event checked between images in every stage (raises parallel.Cancelled).
+    split_max_mb: cut sheets one band of cells at a time (stamp_splitter_v2.split_bands).
+    """
+    opts = {
+        "split": split, "grid": grid, "inner_margin": inner_margin,
+        "split_tolerance": split_tolerance, "split_erosion": split_erosion, "split_remove_bg": split_remove_bg,
+        "split_max_mb": split_max_mb,
+        "remove_bg": remove_bg, "mode": mode, "tolerance": tolerance, "color": color, "erosion": erosion,
+        "trim": trim, "padding": padding, "trim_alpha": trim_alpha,
+    }
+    items = cancellable(items, cancel)
+    for _, _, fn in sheet_stages(opts, on_skip):
+        items = cancellable(fn(items), cancel)
+    if format_stamps:
+        items = cancellable(format_stage(items, keep_source=keep_source), cancel)
+    return items
+
+def sheet_stages(opts, on_skip=None):
+    """
+    Returns [(stage name, params, fn(items) -> items)] for the enabled pre-format stages.
+    params are exactly the options that affect the stage's output (used as cache keys);
+    split_max_mb only bounds memory, so it is not one of them.
+    """
+    stages = []
+    if opts["split"]:
+        params = {"tolerance": opts["split_tolerance"], "erosion": opts["split_erosion"], "grid": opts["grid"],
+                  "remove_bg": opts["split_remove_bg"], "inner_margin": opts["inner_margin"]}
+        stages.append(("split", params, lambda items, p=params, max_mb=opts.get("split_max_mb"): split_stage(
+            items, p["tolerance"], p["erosion"], p["grid"], p["remove_bg"], p["inner_margin"], max_mb)))
+    if opts["remove_bg"]:
+        params = {"mode": opts["mode"], "tolerance": opts["tolerance"], "erosion": opts["erosion"],
+                  "color": opts["color"] if opts["mode"] == "color" else None}
+        stages.append(("bg", params, lambda items, p=params: remove_bg_stage(
+            items, p["mode"], p["tolerance"], p["color"], p["erosion"])))
+    if opts["trim"]:
+        params = {"padding": opts["padding"]}
+        # Only keyed when set, so caches from before the threshold existed stay valid
+        if opts.get("trim_alpha"):
+            params["alpha_threshold"] = opts["trim_alpha"]
+        stages.append(("trim", params, lambda items, p=params: trim_stage(
+            items, p["padding"], on_skip, p.get("alpha_threshold", 0))))
+    return stages
+
+def collect_outputs(items, format_stamps, cancel=None, png=None):
+    """
+    Encodes the final items of one sheet. Encodes run on an EncodePool, so the
+    next stamp is processed while the previous one is compressed.
+    Returns (outputs, first): outputs maps output filename -> PNG bytes,
+    first is (filename, source image) of the sheet's first stamp for main/tab.
+    png: PNG encoder settings (image_io.png_params)
+    """
+    outputs = {}
+    first = None
+    if format_stamps:
+        items = cancellable(format_stage(items, keep_source=True), cancel)
+    out_names = []
+    with EncodePool() as pool:
+        for name, img, meta in items:
+            # Keyed by "<name>.png" so sorting matches the formatter's sorted os.listdir
+            out_name = f"{name}.png"
+
+            # Keep the source of the first stamp for main/tab (copy so the sheet can be freed)
+            if format_stamps and (first is None or out_name < first[0]):
+                first = (out_name, meta["source_image"].copy())
+
+            pool.encode(img, png)
+            out_names.append(out_name)
+        encoded = pool.drain()
+    for out_name, data in zip(out_names, encoded):
+        if data is not None:
+            outputs[out_name] = data
+    return outputs, first
+
+CACHE_PNG = "fast"   # main/tab source kept in the cache: lossless, cheap to encode
+
+@instrumentation.traced("sheet")
+def run_sheet(file_path, opts, cache_dir=None, cancel=None):
+    """
+    Runs every enabled stage on one input file (worker task).
+    Returns (outputs, first) as collect_outputs.
+    cache_dir: reuse / store the sheet's final encoded outputs in a ResultCache (limited
+    to opts["cache_max_mb"]). Intermediate stages are not cached: storing the split cells
+    costs more than splitting again, and the stages stream (split_max_mb bound) as without cache.
+    cancel: threading.Event checked between images (only when run in-process).
+    """
+    f = os.path.basename(file_path)
+
+    def on_skip(name, reason):
+        print(f"Skipping {name}: {reason}")
+
+    def source():
+        return read_images([file_path], on_skip=lambda name, reason: print(f"Error: {reason}"))
+
+    try:
+        stages = sheet_stages(opts, on_skip)
+
+        cache = None
+        if cache_dir:
+            cache = ResultCache(cache_dir, opts.get("cache_max_mb", DEFAULT_CACHE_MB) * 1024 * 1024)
+            key = file_digest(file_path)
+            for stage, params, _ in stages:
+                key = cache.make_key(stage, params, key)
+            key = cache.make_key("sheet", {"format_stamps": opts["format_stamps"], "png": opts.get("png")}, key)
+
+            result = cache.get(key)
+            if result is not None:
+                print(f"Cache hit: {f}")
+                outputs, first = result
+                if first is not None:
+                    first = (first[0], decode_image_bytes(first[1]))
+                return outputs, first
+
+        items = cancellable(source(), cancel)
+        for _, _, fn in stages:
+            items = cancellable(fn(items), cancel)
+        outputs, first = collect_outputs(items, opts["format_stamps"], cancel, opts.get("png"))
+
+        if cache is not None:
+            cache.put(key, (outputs, None if first is None else (first[0], encode_png(first[1], CACHE_PNG))))
+        return outputs, first
+
+    except Cancelled:
+        raise
+    except Exception as e:
+        print(f"Error processing {f}: {e}")
+
+    return {}, None
+
+def run_fused_pipeline(input_dir, output_dir, split=True, grid="auto", inner_margin=0,
+                       split_tolerance=50, split_erosion=1, split_remove_bg=False, split_max_mb=None,
+                       remove_bg=False, mode="flood", tolerance=30, color="255,255,255", erosion=0,
+                       trim=False, padding=10, trim_alpha=0, format_stamps=True, workers=1,
+                       cache_dir=None, cache_max_mb=1024, progress=None, cancel=None, png=None, optimize_kb=None,
+                       zip_parts=None, zip_set_size=None):
+    """
+    Runs split -> BG removal -> trim -> format without intermediate temp folders.
+    Decoded BGRA arrays are passed straight from stage to stage and only the
+    final outputs are PNG-encoded. Output names and numbering match the
+    directory-based tools chained through temp folders.
+    workers: sheets processed in parallel (0 = all CPU cores)
+    cache_dir: persistent result cache; re-runs only recompute sheets whose
+    input or parameters changed. Kept within cache_max_mb while the run writes to it.
+    progress(stage, index, total): called after each sheet ("process") and each written file ("write").
+    cancel: threading.Event; once set the run stops between images / files and raises
+    parallel.Cancelled. Outputs are staged in TEMP_WRITE_DIR and only moved into
+    output_dir after every file is written, so a cancelled run leaves output_dir untouched.
+    png: PNG encoder settings for the stamps and main/tab (image_io.png_params).
+    optimize_kb: shrink every stamp and main/tab to this size budget before writing (png_optimizer).
+    zip_parts: name parts (stamp_export.name_parts) to also export <parts>_SetNN.zip
+    straight from the in-memory PNGs, one ZIP per zip_set_size stamps (all in one when None).
+    split_max_mb: cut very large sheets one band of cells at a time within about this
+    many MB (stamp_splitter_v2.split_bands); None cuts whole sheets.
+    Returns a dict: "stamps" is a list of {"path", "source"} (source = pre-numbering name),
+    "main"/"tab" are the generated paths (None when not formatting) and "zips" lists
+    the export_zips results.
+    """
+    summary = {"stamps": [], "main": None, "tab": None, "zips": []}
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if remove_bg and mode == "color" and parse_color(color) is None:
+        print("Error: Invalid color format. Use R,G,B")
+        return summary
+
+    files = list_images(input_dir)
+
+    if not files:
+        print(f"No images found in '{input_dir}'.")
+        return summary
+
+    print(f"Processing {len(files)} images (in-memory pipeline)...")
+
+    opts = {
+        "split": split, "grid": grid, "inner_margin": inner_margin,
+        "split_tolerance": split_tolerance, "split_erosion": split_erosion, "split_remove_bg": split_remove_bg,
+        "split_max_mb": split_max_mb,
+        "remove_bg": remove_bg, "mode": mode, "tolerance": tolerance, "color": color, "erosion": erosion,
+        "trim": trim, "padding": padding, "trim_alpha": trim_alpha, "format_stamps": format_stamps, "png": png,
+        "cache_max_mb": cache_max_mb,
+    }
+    # Events cannot be sent to worker processes; pool runs are cancelled between sheets instead
+    in_process = resolve_workers(workers) <= 1 or len(files) <= 1
+    tasks = [(file_path, opts, cache_dir, cancel if in_process else None) for file_path in files]
+
+    # output filename -> PNG bytes of the formatted stamp (or final stage image when not formatting)
+    results = {}
+    first = None
+    def on_done(i, result):
+        if progress:
+            progress("process", i + 1, len(tasks))
+
+    for outputs, sheet_first in run_tasks(run_sheet, tasks, workers, on_done, cancel):
+        results.update(outputs)
+        if sheet_first is not None and (first is None or sheet_first[0] < first[0]):
+            first = sheet_first
+
+    if cache_dir:
+        ResultCache(cache_dir, cache_max_mb * 1024 * 1024).evict()
+
+    # Main and Tab from the first image (01.png), rendered now so they are optimized with the stamps
+    specials = {}
+    if format_stamps and first is not None:
+        specials = render_main_tab(first[1], png)
+
+    if optimize_kb:
+        check_cancel(cancel)
+        print(f"Optimizing {len(results) + len(specials)} images (budget {optimize_kb} KB per file)...")
+        results = optimize_outputs(results, optimize_kb * 1024, workers)
+        specials = optimize_outputs(specials, optimize_kb * 1024, workers)
+
+    names = sorted(results)
+    if format_stamps:
+        print(f"Formatting {len(names)} images...")
+        # Save as 01.png, 02.png...
+        out_names = [f"{count:02d}.png" for count in range(1, len(names) + 1)]
+    else:
+        out_names = names
+
+    temp_dir = os.path.join(output_dir, TEMP_WRITE_DIR)
+    if os.path.exists(temp_dir):
+        shutil.rmtree(temp_dir)
+    os.makedirs(temp_dir)
+    try:
+        for i, (name, out_name) in enumerate(zip(names, out_names), start=1):
+            check_cancel(cancel)
+            write_bytes(os.path.join(temp_dir, out_name), results[name])
+            if progress:
+                progress("write", i, len(names))
+
+        check_cancel(cancel)
+        for name, out_name in zip(names, out_names):
+            output_path = os.path.join(output_dir, out_name)
+            os.replace(os.path.join(temp_dir, out_name), output_path)
+            summary["stamps"].append({"path": output_path, "source": os.path.splitext(name)[0]})
+            print(f"Saved: {output_path}")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    if names:
+        # The curated order / delete marks belong to the stamps that were just replaced
+        reset_order(output_dir)
+
+    if format_stamps and first is not None:
+        write_main_tab(specials, output_dir)
+        summary["main"] = os.path.join(output_dir, "main.png")
+        summary["tab"] = os.path.join(output_dir, "tab.png")
+
+    # ZIPs are written from the PNG bytes already in memory (no re-read from disk)
+    if zip_parts is not None and names:
+        summary["zips"] = export_zips(output_dir, zip_parts, [results[name] for name in names],
+                                      sorted(specials.items()), zip_set_size)
+        for result in summary["zips"]:
+            print(f"ZIP: {result['zip_path']} ({result['stamp_count']} stamps)")
+
+    print("Done!")
+    return summary
+
+def parse_inner_margin(value):
+    """
+    "5" -> 5, "5,5,10,10" -> [top, bottom, left, right]
+    """
+    values = [int(v) for v in value.split(',')]
+    if len(values) == 1:
+        return values[0]
+    if len(values) == 4:
+        return values
+    raise ValueError("inner margin must be N or TOP,BOTTOM,LEFT,RIGHT")
+
+def write_manifest(path, manifest):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fp:
+        json.dump(manifest, fp, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def main():
+    parser = argparse.ArgumentParser(description="LINE Stamp Pipeline (headless split -> bg -> trim -> format)")
+    parser.add_argument("--input", default="input", help="Input directory")
+    parser.add_argument("--output", default="output_final", help="Output directory")
+    # 1. Split
+    parser.add_argument("--no_split", action="store_true", help="Skip splitting (inputs are single stamps)")
+    parser.add_argument("--grid", choices=["auto", "detect", "4x2", "3x3", "4x4"], default="auto", help="Grid layout (default: auto; detect = find gutters from the image)")
+    parser.add_argument("--inner_margin", default="0", help="Cell inner margin in px: N or TOP,BOTTOM,LEFT,RIGHT")
+    parser.add_argument("--split_tolerance", type=int, default=50, help="Splitter color tolerance (with --split_bg)")
+    parser.add_argument("--split_erosion", type=int, default=1, help="Splitter fringe removal (with --split_bg)")
+    parser.add_argument("--split_bg", action="store_true", help="Remove the background while splitting")
+    parser.add_argument("--split_max_mb", type=int, default=None, help="Split large sheets one band of cells at a time within about this many MB")
+    # 2. BG Remove
+    parser.add_argument("--bg", action="store_true", help="Run the background removal stage")
+    parser.add_argument("--mode", choices=["flood", "color", "auto_color"], default="flood", help="Background removal mode")
+    parser.add_argument("--tolerance", type=int, default=30, help="Background tolerance (0-255)")
+    parser.add_argument("--erosion", type=int, default=0, help="Erosion/Fringe Removal (0-10)")
+    parser.add_argument("--color", type=str, default="255,255,255", help="Target RGB for 'color' mode")
+    # 3. Trim
+    parser.add_argument("--trim", action="store_true", help="Run the auto trim stage")
+    parser.add_argument("--padding", type=int, default=10, help="Trim padding in pixels")
+    parser.add_argument("--trim_alpha", type=int, default=0, help="Trim: alpha values up to this count as transparent")
+    # 4. Format
+    parser.add_argument("--no_format", action="store_true", help="Skip LINE formatting (write the last stage's images)")
+    parser.add_argument("--png", default="default", help="PNG encoder: default, fast, max (smallest files) or LEVEL[,STRATEGY[,FILTER]]")
+    parser.add_argument("--optimize_kb", type=int, default=None, help="Shrink each stamp and main/tab to at most this many KB (palette / quantization)")
+    # 5. Naming / backup / zip
+    parser.add_argument("--prefix", default="", help="Name prefix for backup/ZIP (default: input folder name)")
+    parser.add_argument("--no_date", action="store_true", help="Do not add YYYYMMDD to backup/ZIP names")
+    parser.add_argument("--no_backup", action="store_true", help="Do not create the <name>_raw backup folder")
+    parser.add_argument("--zip", action="store_true", help="Create <name>_SetNN.zip")
+    parser.add_argument("--zip_set_size", type=int, default=None, help="Stamps per ZIP (several Set ZIPs from one run; default: all in one)")
+    parser.add_argument("--zip_cleanup", action="store_true", help="Delete the root PNGs after zipping (like the GUI)")
+    # Execution
+    parser.add_argument("--workers", type=int, default=1, help="Parallel workers (0 = all CPU cores)")
+    parser.add_argument("--cache", action="store_true", help="Reuse unchanged stages from the result cache")
+    parser.add_argument("--cache_dir", default=DEFAULT_CACHE_DIR, help="Result cache directory")
+    parser.add_argument("--cache_mb", type=int, default=1024, help="Result cache size limit (MB)")
+    parser.add_argument("--manifest", default=None, help="Manifest path (default: <output>/manifest.json)")
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+    parser.add_argument("--profile", default=None, help="Write a timing/memory report (JSON) to this path")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"Error: '{args.input}' directory not found.")
+        return EXIT_USAGE
+
+    try:
+        inner_margin = parse_inner_margin(args.inner_margin)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return EXIT_USAGE
+
+    try:
+        parse_png(args.png)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return EXIT_USAGE
+
+    if args.bg and args.mode == "color" and parse_color(args.color) is None:
+        print("Error: Invalid color format. Use R,G,B")
+        return EXIT_USAGE
+
+    options = {
+        "split": not args.no_split, "grid": args.grid, "inner_margin": inner_margin,
+        "split_tolerance": args.split_tolerance, "split_erosion": args.split_erosion, "split_remove_bg": args.split_bg,
+        "split_max_mb": args.split_max_mb,
+        "remove_bg": args.bg, "mode": args.mode, "tolerance": args.tolerance, "color": args.color, "erosion": args.erosion,
+        "trim": args.trim, "padding": args.padding, "trim_alpha": args.trim_alpha, "format_stamps": not args.no_format, "png": args.png,
+        "optimize_kb": args.optimize_kb,
+    }
+    manifest_path = args.manifest or os.path.join(args.output, "manifest.json")
+    started = time.time()
+    manifest = {
+        "version": 1,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "input_dir": os.path.abspath(args.input),
+        "output_dir": os.path.abspath(args.output),
+        "options": options,
+        "inputs": [os.path.basename(p) for p in list_images(args.input)],
+        "stamps": [],
+        "main": None,
+        "tab": None,
+        "backup_dir": None,
+        "zip": None,
+        "zips": [],
+    }
+
+    if args.profile:
+        instrumentation.enable()
+
+    exit_code = EXIT_OK
+    try:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull if args.quiet else sys.stdout):
+            parts = name_parts(args.prefix, args.input, not args.no_date)
+            summary = run_fused_pipeline(
+                args.input, args.output, workers=args.workers,
+                cache_dir=args.cache_dir if args.cache else None, cache_max_mb=args.cache_mb,
+                zip_parts=parts if args.zip else None, zip_set_size=args.zip_set_size,
+                **options
+            )
+
+            stamps = [
+                {"file": os.path.basename(s["path"]), "path": os.path.abspath(s["path"]),
+                 "source": s["source"], "bytes": os.path.getsize(s["path"])}
+                for s in summary["stamps"]
+            ]
+            manifest["stamps"] = stamps
+            manifest["main"] = summary["main"] and os.path.abspath(summary["main"])
+            manifest["tab"] = summary["tab"] and os.path.abspath(summary["tab"])
+            manifest["zips"] = [dict(z, zip_path=os.path.abspath(z["zip_path"])) for z in summary["zips"]]
+            manifest["zip"] = manifest["zips"][0] if manifest["zips"] else None
+
+            if not stamps:
+                exit_code = EXIT_NO_OUTPUT
+            else:
+                if not args.no_backup:
+                    backup_path, _ = create_backup(args.output, parts)
+                    manifest["backup_dir"] = os.path.abspath(backup_path)
+                if args.zip and args.zip_cleanup:
+                    # After the backup, so the cleaned-up images are still kept there
+                    written = [s["file"] for s in stamps] + [os.path.basename(p) for p in (summary["main"], summary["tab"]) if p]
+                    deleted_count = delete_outputs(args.output, written)
+                    for result in manifest["zips"]:
+                        result["deleted_count"] = deleted_count
+    except Exception as e:
+        exit_code = EXIT_FAILED
+        manifest["error"] = str(e)
+        print(f"Error: {e}")
+
+    manifest["finished_at"] = datetime.now().isoformat(timespec="seconds")
+    manifest["elapsed_sec"] = round(time.time() - started, 3)
+    manifest["exit_code"] = exit_code
+
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    if args.profile:
+        manifest["profile"] = os.path.abspath(args.profile)
+    write_manifest(manifest_path, manifest)
+
+    if args.profile:
+        instrumentation.finish(args.profile)
+
+    print(f"{len(manifest['stamps'])} stamps -> {os.path.abspath(args.output)} (manifest: {manifest_path}, exit {exit_code})")
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
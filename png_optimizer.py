@@ -0,0 +1,176 @@
+import argparse
+import io
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from image_io import encode_png, to_bgra, write_bytes
+from parallel import run_tasks
+from stamp_export import list_stamp_files
+
+DEFAULT_MAX_KB = 1024                  # LINE: each image must be 1 MB or less
+QUANT_COLORS = (256, 128, 64, 32, 16)  # palette sizes tried, best quality first
+ENCODER_SEARCH = ("max", "9,default,all", "9,rle,all")  # lossless truecolour encoder settings tried
+
+def decode_image_bytes(data):
+    """
+    Decodes PNG bytes as stored (None if unreadable).
+    """
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+def clear_hidden_colors(img):
+    """
+    Returns a copy of a BGRA image with the colour of fully transparent pixels set to 0.
+    Invisible, but removes noise that costs bytes and palette entries.
+    """
+    img = img.copy()
+    img[img[:, :, 3] == 0] = 0
+    return img
+
+def _pil_png(pil_img, **params):
+    buf = io.BytesIO()
+    pil_img.save(buf, format="PNG", optimize=True, **params)
+    return buf.getvalue()
+
+def palette_png(img):
+    """
+    Lossless palette PNG (PNG8 with per-entry alpha) of a BGRA image,
+    or None if it has more than 256 colours.
+    """
+    packed = img.reshape(-1, 4).view(np.uint32).ravel()
+    colors, indices = np.unique(packed, return_inverse=True)
+    if len(colors) > 256:
+        return None
+    bgra = colors.view(np.uint8).reshape(-1, 4)
+    pil_img = Image.fromarray(indices.astype(np.uint8).reshape(img.shape[:2]), mode="P")
+    pil_img.putpalette(bgra[:, [2, 1, 0]].ravel().tolist())
+    return _pil_png(pil_img, transparency=bgra[:, 3].tobytes())
+
+def quantized_png(img, colors):
+    """
+    Lossy palette PNG with at most colors entries. Quantizes RGBA together, so
+    semi-transparent edges get their own palette entries.
+    """
+    rgba = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA), mode="RGBA")
+    return _pil_png(rgba.quantize(colors=colors, method=Image.Quantize.FASTOCTREE))
+
+def optimize_png(data, max_bytes=DEFAULT_MAX_KB * 1024):
+    """
+    Shrinks PNG bytes to max_bytes, trying in order:
+    1. lossless: hidden-colour cleanup with each ENCODER_SEARCH setting, and a palette
+       PNG if the image has 256 colours or fewer (the smallest is kept);
+    2. alpha-aware quantization to QUANT_COLORS palettes, largest palette that fits.
+    Data already within the budget is returned as is (nothing is decoded or re-encoded).
+    Returns (data, method); method is "original", "lossless", "palette", "quant<N>",
+    or ends with "(over budget)" when even the smallest candidate does not fit.
+    """
+    if len(data) <= max_bytes:
+        return data, "original"
+    img = decode_image_bytes(data)
+    if img is None:
+        return data, "original"
+    img = clear_hidden_colors(to_bgra(img))
+
+    candidates = [(data, "original")] + [(encode_png(img, png), "lossless") for png in ENCODER_SEARCH]
+    palette = palette_png(img)
+    if palette is not None:
+        candidates.append((palette, "palette"))
+    candidates = [c for c in candidates if c[0] is not None]
+    best = min(candidates, key=lambda c: len(c[0]))
+    if len(best[0]) <= max_bytes:
+        return best
+
+    # Palettes no smaller than the exact one would only lose colours
+    exact_colors = len(np.unique(img.reshape(-1, 4).view(np.uint32))) if palette is not None else None
+    for colors in QUANT_COLORS:
+        if exact_colors is not None and colors >= exact_colors:
+            continue
+        quant = quantized_png(img, colors)
+        if len(quant) < len(best[0]):
+            best = (quant, f"quant{colors}")
+        if len(quant) <= max_bytes:
+            return quant, f"quant{colors}"
+    return best[0], best[1] + " (over budget)"
+
+def optimize_file(file_path, max_bytes=DEFAULT_MAX_KB * 1024):
+    """
+    Optimizes one PNG file in place (only rewritten when it gets smaller).
+    Returns (before, after, method) byte sizes.
+    """
+    with open(file_path, "rb") as fp:
+        data = fp.read()
+    optimized, method = optimize_png(data, max_bytes)
+    if len(optimized) < len(data):
+        tmp_path = f"{file_path}.tmp"
+        write_bytes(tmp_path, optimized)
+        os.replace(tmp_path, file_path)
+    return len(data), min(len(data), len(optimized)), method
+
+def optimize_outputs(outputs, max_bytes=DEFAULT_MAX_KB * 1024, workers=1):
+    """
+    In-memory variant for the pipeline: optimizes {filename: PNG bytes} in parallel
+    and prints the size saved per file. Returns the new dict.
+    """
+    names = sorted(outputs)
+    results = run_tasks(optimize_png, [(outputs[name], max_bytes) for name in names], workers)
+    optimized = {}
+    for name, (data, method) in zip(names, results):
+        report(name, len(outputs[name]), len(data), method)
+        optimized[name] = data
+    return optimized
+
+def report(name, before, after, method):
+    saved = before - after
+    print(f"Optimized {name}: {before // 1024} KB -> {after // 1024} KB (-{saved * 100 // max(1, before)}%, {method})")
+
+def process_optimizer(input_dir, max_kb=DEFAULT_MAX_KB, total_kb=None, workers=1, files=None):
+    """
+    Optimizes the stamps and main/tab of input_dir in place.
+    total_kb: package budget (e.g. the upload ZIP); when the files still exceed it,
+    the per-file budget is lowered to an even share of it and the files are retried.
+    files: paths relative to input_dir to optimize instead (e.g. the files a formatter run wrote)
+    """
+    if files is None:
+        stamp_files, special_files = list_stamp_files(input_dir)
+        files = stamp_files + special_files
+    if not files:
+        print(f"No images found in '{input_dir}'.")
+        return
+
+    print(f"Optimizing {len(files)} images (budget {max_kb} KB per file)...")
+    budget = max_kb * 1024
+    paths = [os.path.join(input_dir, f) for f in files]
+    results = run_tasks(optimize_file, [(path, budget) for path in paths], workers)
+    for f, (before, after, method) in zip(files, results):
+        report(f, before, after, method)
+    total = sum(after for _, after, _ in results)
+
+    if total_kb and total > total_kb * 1024:
+        share = min(budget, total_kb * 1024 // len(files))
+        retry = [path for path, (_, after, _) in zip(paths, results) if after > share]
+        print(f"Total {total // 1024} KB exceeds {total_kb} KB; retrying {len(retry)} files at {share // 1024} KB each...")
+        for path, (before, after, method) in zip(retry, run_tasks(optimize_file, [(path, share) for path in retry], workers)):
+            report(os.path.basename(path), before, after, method)
+        total = sum(os.path.getsize(path) for path in paths)
+
+    print(f"Done! Total: {total // 1024} KB")
+
+def main():
+    parser = argparse.ArgumentParser(description="PNG size optimizer (LINE file size limits)")
+    parser.add_argument("--input", default="output_final", help="Stamp folder (optimized in place)")
+    parser.add_argument("--max_kb", type=int, default=DEFAULT_MAX_KB, help="Size budget per file in KB")
+    parser.add_argument("--total_kb", type=int, default=None, help="Size budget for all files together in KB (e.g. the ZIP limit)")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel workers (0 = all CPU cores)")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"Error: '{args.input}' directory not found.")
+        return
+
+    process_optimizer(args.input, args.max_kb, args.total_kb, args.workers)
+
+if __name__ == "__main__":
+    main()
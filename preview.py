@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from image_io import decode_image, to_bgra
+from stamp_splitter_v2 import grid_rects, detect_grid, detect_image
+from background_remover import detect_bg_color_cv, parse_color, key_distance, remove_background_multi
+
+PROXY_MAX_SIDE = 480   # プレビュー用に縮小した画像の長辺
+CACHE_SIZE = 8         # 保持するシート数（縮小画像・距離マップ）
+
+GRID_COLOR = (60, 60, 255)      # セル境界 (BGR)
+MARGIN_COLOR = (255, 200, 0)    # 内側フチ除去後の切り抜き範囲
+
+def checkerboard(height, width, size=8):
+    """
+    Gray/white checkerboard (BGR) used behind transparent areas.
+    """
+    yy, xx = np.indices((height, width))
+    board = np.where((yy // size + xx // size) % 2 == 0, 200, 255).astype(np.uint8)
+    return cv2.merge([board, board, board])
+
+def composite(dst, img):
+    """
+    Alpha-blends a BGRA image onto a BGR image of the same size (in place).
+    """
+    alpha = img[:, :, 3:4].astype(np.float32) / 255
+    dst[:] = (img[:, :, :3] * alpha + dst * (1 - alpha)).astype(np.uint8)
+
+class PreviewRenderer(object):
+    """
+    Renders the split grid / inner margin overlay and the background removal result
+    on a downscaled proxy of a sheet. The proxy and the per-cell colour-distance maps
+    are cached, so moving the tolerance / erosion sliders only re-thresholds small masks.
+    Not tied to Tk: render() returns a BGR ndarray.
+    """
+
+    def __init__(self, max_side=PROXY_MAX_SIDE, cache_size=CACHE_SIZE):
+        self.max_side = max_side
+        self.cache_size = cache_size
+        self._proxies = OrderedDict()    # (path, mtime) -> (proxy BGRA, scale, (width, height), detect image)
+        self._distances = OrderedDict()  # (path, mtime, rect, key color) -> distance map
+        self._lock = threading.Lock()
+
+    def _remember(self, cache, key, value, limit):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > limit:
+                cache.popitem(last=False)
+
+    def proxy(self, path):
+        """
+        Returns (proxy, scale, (width, height), detect): the sheet decoded once and shrunk so
+        its longer side is at most max_side; scale maps full-size px to proxy px.
+        detect is the sheet's stamp_splitter_v2.detect_image, so the previewed grid is
+        detected exactly like the split.
+        """
+        key = (path, os.path.getmtime(path))
+        with self._lock:
+            cached = self._proxies.get(key)
+        if cached is not None:
+            return cached
+
+        img = decode_image(path)
+        if img is None:
+            raise ValueError(f"Could not read {path}")
+        img = to_bgra(img)
+        height, width = img.shape[:2]
+        detect = detect_image(img)
+        scale = min(1.0, self.max_side / max(width, height))
+        if scale < 1.0:
+            img = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                             interpolation=cv2.INTER_AREA)
+        result = (img, scale, (width, height), detect)
+        self._remember(self._proxies, key, result, self.cache_size)
+        return result
+
+    def _distance(self, key, cell, key_color):
+        with self._lock:
+            distance = self._distances.get(key)
+        if distance is None:
+            distance = key_distance(cell, key_color)
+            # up to 16 cells per sheet
+            self._remember(self._distances, key, distance, self.cache_size * 16)
+        return distance
+
+    def render(self, path, split=True, grid="auto", inner_margin=0, remove_bg=False,
+               mode="flood", tolerance=30, color="255,255,255", erosion=0, split_tolerance=50):
+        """
+        Returns (preview BGR image, info dict with "rows", "cols", "margin_ignored", "ms").
+        Erosion is scaled to the proxy (at least 1 px when enabled).
+        split_tolerance: background tolerance of the split, used by grid="detect".
+        """
+        start = time.perf_counter()
+        proxy, scale, (width, height), detect = self.proxy(path)
+        ph, pw = proxy.shape[:2]
+        canvas = checkerboard(ph, pw)
+
+        if split:
+            # Same detection as the split (split_tolerance, DETECT_MAX_SIDE copy), in sheet pixels
+            cuts = detect_grid(detect, split_tolerance, size=(width, height)) if grid == "detect" else None
+            rows, cols, rects, margin_ignored = grid_rects(width, height, grid, inner_margin, cuts)
+            cell_rects = grid_rects(width, height, grid, 0, cuts)[2]
+        else:
+            rows, cols, margin_ignored = 1, 1, False
+            rects = cell_rects = [(0, 0, width, height)]
+
+        def to_proxy(rect):
+            left, top, right, bottom = rect
+            return (min(pw, round(left * scale)), min(ph, round(top * scale)),
+                    min(pw, max(round(left * scale) + 1, round(right * scale))),
+                    min(ph, max(round(top * scale) + 1, round(bottom * scale))))
+
+        proxy_erosion = max(1, round(erosion * scale)) if erosion > 0 else 0
+        target_bgr = parse_color(color) if mode == "color" else None
+
+        for rect in rects:
+            x0, y0, x1, y1 = to_proxy(rect)
+            cell = proxy[y0:y1, x0:x1]
+            if remove_bg and cell.size:
+                key_color = target_bgr if mode == "color" else detect_bg_color_cv(cell)
+                if key_color is not None:
+                    key = (path, os.path.getmtime(path), (x0, y0, x1, y1), tuple(int(c) for c in key_color))
+                    distance = self._distance(key, cell, key_color)
+                    cell = remove_background_multi(cell, [tolerance], mode, target_bgr, proxy_erosion, distance)[tolerance]
+            composite(canvas[y0:y1, x0:x1], cell)
+
+        if split:
+            # Areas cut away by the inner margin are dimmed
+            keep = np.zeros((ph, pw), np.uint8)
+            for rect in rects:
+                x0, y0, x1, y1 = to_proxy(rect)
+                keep[y0:y1, x0:x1] = 1
+            canvas[keep == 0] = (canvas[keep == 0] * 0.35).astype(np.uint8)
+
+            for rect in cell_rects:
+                x0, y0, x1, y1 = to_proxy(rect)
+                cv2.rectangle(canvas, (x0, y0), (x1 - 1, y1 - 1), GRID_COLOR, 1)
+            if inner_margin and not margin_ignored:
+                for rect in rects:
+                    x0, y0, x1, y1 = to_proxy(rect)
+                    cv2.rectangle(canvas, (x0, y0), (x1 - 1, y1 - 1), MARGIN_COLOR, 1)
+
+        info = {"rows": rows, "cols": cols, "margin_ignored": margin_ignored,
+                "ms": round((time.perf_counter() - start) * 1000, 1)}
+        return canvas, info
+
+class PreviewWorker(object):
+    """
+    Background thread that renders the most recent request only.
+    submit() never blocks; requests arriving while a render runs replace each other,
+    so dragging a slider renders the final position instead of every step.
+    on_result(seq, image, info, error) is called from the worker thread.
+    """
+
+    def __init__(self, renderer, on_result):
+        self.renderer = renderer
+        self.on_result = on_result
+        self._cond = threading.Condition()
+        self._pending = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, seq, path, **params):
+        with self._cond:
+            self._pending = (seq, path, params)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                seq, path, params = self._pending
+                self._pending = None
+            try:
+                image, info = self.renderer.render(path, **params)
+                self.on_result(seq, image, info, None)
+            except Exception as e:
+                self.on_result(seq, None, None, e)
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+# Bump when a stage's output for the same parameters (or the stored format) changes
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".stamp_cache")
+DEFAULT_CACHE_MB = 1024
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    """
+    Returns the content hash (hex) of a file.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    with open(file_path, "rb") as fp:
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+class ResultCache:
+    """
+    Persistent on-disk cache of stage results.
+    Keys chain the upstream key (a file digest or the previous stage's key), the stage
+    name and its parameters, so a stage is reused only when everything before it is unchanged.
+    Entries are evicted oldest-used first whenever a put() takes the cache past max_bytes.
+    Values are pickled as given: store images encoded (PNG bytes), not as raw arrays.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._total = None   # bytes on disk, scanned on the first put()
+
+    def make_key(self, stage, params, upstream):
+        payload = json.dumps([CACHE_VERSION, stage, params, upstream], sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=20).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pkl")
+
+    def get(self, key):
+        """
+        Returns the cached value or None. A hit refreshes the entry's age for eviction.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fp:
+                value = pickle.load(fp)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Corrupt / truncated entry
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        """
+        Stores value atomically (temp file + rename), so parallel workers never see partial
+        entries, then evicts old entries if the cache is over max_bytes. The size is tracked
+        per instance (other processes' writes are seen at the next eviction scan).
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                pickle.dump(value, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if self._total is None:
+            self._total = self.size()
+        else:
+            self._total += os.path.getsize(path)
+        if self._total > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        if not os.path.exists(self.cache_dir):
+            return entries
+        for root, _, files in os.walk(self.cache_dir):
+            for f in files:
+                if f.endswith(".pkl"):
+                    path = os.path.join(root, f)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache fits max_bytes.
+        Returns the number of deleted entries.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        deleted = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                deleted += 1
+            except OSError:
+                pass
+        self._total = total
+        return deleted
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+from image_io import decode_image, to_bgra
+from parallel import run_tasks
+from result_cache import file_digest, DEFAULT_CACHE_DIR
+from stamp_export import list_stamp_files
+
+# Bump when the hash of the same image changes
+HASH_VERSION = 1
+
+DEFAULT_INDEX_PATH = os.path.join(DEFAULT_CACHE_DIR, "hash_index.json")
+DEFAULT_THRESHOLD = 6    # max differing bits (of 64) for two stamps to count as near-duplicates
+MAX_THRESHOLD = 15       # the band index needs threshold + 1 bands of at least 4 bits
+
+def thumbnail(img, size):
+    """
+    Composites a stamp onto white (so transparent areas do not depend on their hidden
+    colour) and returns a grayscale float32 thumbnail of size (width, height).
+    """
+    img = to_bgra(img)
+    alpha = img[:, :, 3:4].astype(np.float32) / 255
+    bgr = img[:, :, :3] * alpha + 255 * (1 - alpha)
+    gray = cv2.cvtColor(bgr.astype(np.float32), cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+def _to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+def dhash(img):
+    """
+    64-bit difference hash: brightness gradient between neighbouring pixels of a 9x8 thumbnail.
+    """
+    small = thumbnail(img, (9, 8))
+    return _to_int(small[:, 1:] > small[:, :-1])
+
+def phash(img):
+    """
+    64-bit perceptual hash: low 8x8 DCT frequencies of a 32x32 thumbnail against their median.
+    """
+    low = cv2.dct(thumbnail(img, (32, 32)))[:8, :8]
+    return _to_int(low > np.median(low.ravel()[1:]))
+
+HASH_METHODS = {"dhash": dhash, "phash": phash}
+
+def hash_file(file_path, method="phash"):
+    """
+    Returns the hash of an image file, or None if it cannot be read.
+    """
+    img = decode_image(file_path)
+    if img is None:
+        return None
+    return HASH_METHODS[method](img)
+
+class HashIndex(object):
+    """
+    Persistent hash index (JSON). Files are matched by path + size + mtime first and by
+    content digest otherwise, so re-scans only decode new or changed stamps (renamed
+    stamps keep their hash).
+    """
+
+    def __init__(self, index_path=DEFAULT_INDEX_PATH):
+        self.index_path = index_path
+        self.files = {}    # abs path -> [size, mtime_ns, digest]
+        self.hashes = {}   # "<method>:<digest>" -> hash (hex)
+        try:
+            with open(index_path, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if data.get("version") == HASH_VERSION:
+                self.files = data["files"]
+                self.hashes = data["hashes"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def lookup(self, paths, method="phash", workers=1):
+        """
+        Returns {path: hash} for the readable files in paths, hashing only those not in the index.
+        """
+        result = {}
+        todo = []
+        for path in paths:
+            key = os.path.abspath(path)
+            st = os.stat(path)
+            entry = self.files.get(key)
+            if entry is None or entry[:2] != [st.st_size, st.st_mtime_ns]:
+                entry = [st.st_size, st.st_mtime_ns, file_digest(path)]
+                self.files[key] = entry
+            cached = self.hashes.get(f"{method}:{entry[2]}")
+            if cached is not None:
+                result[path] = int(cached, 16)
+            else:
+                todo.append(path)
+
+        hashed = run_tasks(hash_file, [(path, method) for path in todo], workers)
+        for path, value in zip(todo, hashed):
+            if value is None:
+                print(f"Could not read {path}")
+                continue
+            self.hashes[f"{method}:{self.files[os.path.abspath(path)][2]}"] = format(value, "016x")
+            result[path] = value
+        return result
+
+    def save(self):
+        """
+        Drops entries of deleted files and writes the index atomically.
+        """
+        self.files = {path: entry for path, entry in self.files.items() if os.path.exists(path)}
+        digests = {entry[2] for entry in self.files.values()}
+        self.hashes = {key: value for key, value in self.hashes.items() if key.split(":", 1)[1] in digests}
+
+        directory = os.path.dirname(self.index_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fp:
+                json.dump({"version": HASH_VERSION, "files": self.files, "hashes": self.hashes}, fp)
+            os.replace(tmp_path, self.index_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+def group_near_duplicates(hashes, threshold=DEFAULT_THRESHOLD):
+    """
+    Groups keys whose 64-bit hashes differ in at most threshold bits.
+    Each hash is cut into threshold + 1 bands; two hashes within the threshold agree on
+    at least one band, so only keys sharing a band bucket are compared (roughly linear
+    for the sparse buckets of real stamp sets). Groups are transitive (a~b, b~c -> a, b, c).
+    Returns a list of sorted key lists (2+ keys each), ordered by their first key.
+    """
+    if not 0 <= threshold <= MAX_THRESHOLD:
+        raise ValueError(f"threshold must be between 0 and {MAX_THRESHOLD}")
+    keys = sorted(hashes)
+    parent = list(range(len(keys)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    bands = threshold + 1
+    edges = [64 * i // bands for i in range(bands + 1)]
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        mask = (1 << (hi - lo)) - 1
+        buckets = {}
+        for i, key in enumerate(keys):
+            buckets.setdefault((hashes[key] >> lo) & mask, []).append(i)
+        for members in buckets.values():
+            for a in range(len(members)):
+                for b in range(a + 1, len(members)):
+                    i, j = members[a], members[b]
+                    if find(i) != find(j) and bin(hashes[keys[i]] ^ hashes[keys[j]]).count("1") <= threshold:
+                        parent[find(j)] = find(i)
+
+    groups = {}
+    for i, key in enumerate(keys):
+        groups.setdefault(find(i), []).append(key)
+    return sorted((g for g in groups.values() if len(g) > 1), key=lambda g: g[0])
+
+def find_near_duplicates(output_dir, threshold=DEFAULT_THRESHOLD, method="phash", index_path=DEFAULT_INDEX_PATH, workers=1):
+    """
+    Hashes the stamps of output_dir (main/tab excluded; cached in index_path, None = no cache)
+    and returns the near-duplicate groups as lists of filenames.
+    """
+    stamp_files, _ = list_stamp_files(output_dir)
+    paths = [os.path.join(output_dir, f) for f in stamp_files]
+    if index_path:
+        index = HashIndex(index_path)
+        hashes = index.lookup(paths, method, workers)
+        index.save()
+    else:
+        values = run_tasks(hash_file, [(path, method) for path in paths], workers)
+        hashes = {path: value for path, value in zip(paths, values) if value is not None}
+    hashes = {os.path.basename(path): value for path, value in hashes.items()}
+    return group_near_duplicates(hashes, threshold)
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate stamp finder (perceptual hash)")
+    parser.add_argument("--input", default="output_final", help="Stamp folder to scan")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD, help=f"Max differing bits of 64 (0-{MAX_THRESHOLD})")
+    parser.add_argument("--method", choices=sorted(HASH_METHODS), default="phash", help="Hash type")
+    parser.add_argument("--no_cache", action="store_true", help="Do not read or update the hash index")
+    parser.add_argument("--json", default=None, help="Also write the groups to this JSON file")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel workers (0 = all CPU cores)")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"Error: '{args.input}' directory not found.")
+        return
+    if not 0 <= args.threshold <= MAX_THRESHOLD:
+        print(f"Error: --threshold must be between 0 and {MAX_THRESHOLD}")
+        return
+
+    groups = find_near_duplicates(args.input, args.threshold, args.method,
+                                  None if args.no_cache else DEFAULT_INDEX_PATH, args.workers)
+    for i, group in enumerate(groups, start=1):
+        print(f"Group {i}: {', '.join(group)}")
+    print(f"{len(groups)} near-duplicate groups ({sum(len(g) for g in groups)} stamps)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fp:
+            json.dump(groups, fp, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
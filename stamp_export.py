@@ -0,0 +1,172 @@
+import os
+import shutil
+import time
+import zipfile
+from datetime import datetime
+
+SPECIAL_FILES = ['main.png', 'tab.png']
+
+# Already-compressed formats: stored as is (deflating them costs CPU for almost no gain)
+STORED_EXTS = ('.png', '.jpg', '.jpeg', '.zip')
+
+def name_parts(prefix="", input_dir="", include_date=True):
+    """
+    Returns the parts of the output name: prefix (or the input folder name) and YYYYMMDD.
+    """
+    prefix = prefix.strip()
+    if not prefix:
+        input_dir = input_dir.strip()
+        if input_dir:
+            prefix = os.path.basename(os.path.normpath(input_dir))
+
+    parts = []
+    if prefix:
+        parts.append(prefix)
+    if include_date:
+        parts.append(datetime.now().strftime("%Y%m%d"))
+    return parts
+
+def list_stamp_files(output_dir):
+    """
+    Returns (stamp_files, special_files) in output_dir: sorted stamp PNGs and main/tab.
+    """
+    # scandir knows the entry type from the directory listing (no stat per file on most platforms)
+    with os.scandir(output_dir) as it:
+        all_files = [e.name for e in it if e.name.lower().endswith('.png') and e.is_file()]
+    special_files = [f for f in all_files if f.lower() in SPECIAL_FILES]
+    stamp_files = [f for f in all_files if f.lower() not in SPECIAL_FILES]
+    stamp_files.sort()
+    return stamp_files, special_files
+
+def create_backup(output_dir, parts):
+    """
+    Copies the PNG images of output_dir into <parts>_raw (numbered _2, _3... if it exists).
+    Returns (backup_path, copied_count).
+    """
+    backup_name = "_".join(list(parts) + ["raw"])
+    backup_path = os.path.join(output_dir, backup_name)
+
+    # 既存のバックアップフォルダがあれば連番を付ける
+    if os.path.exists(backup_path):
+        i = 2
+        while os.path.exists(f"{backup_path}_{i}"):
+            i += 1
+        backup_path = f"{backup_path}_{i}"
+
+    os.makedirs(backup_path, exist_ok=True)
+
+    # 出力フォルダのPNG画像をバックアップにコピー
+    copied_count = 0
+    for file in os.listdir(output_dir):
+        if file.lower().endswith('.png'):
+            src = os.path.join(output_dir, file)
+            dst = os.path.join(backup_path, file)
+            if os.path.isfile(src):
+                shutil.copy2(src, dst)
+                copied_count += 1
+
+    return backup_path, copied_count
+
+def next_zip_path(output_dir, parts):
+    """
+    Returns the first unused <parts>_SetNN.zip path in output_dir.
+    """
+    base_name = "_".join(parts)
+    set_num = 1
+    while True:
+        if base_name:
+            full_name = f"{base_name}_Set{set_num:02d}"
+        else:
+            full_name = f"Set{set_num:02d}"
+
+        zip_path = os.path.join(output_dir, f"{full_name}.zip")
+
+        if not os.path.exists(zip_path):
+            return zip_path
+        set_num += 1
+
+def compress_type(name):
+    """
+    ZIP compression for a member: ZIP_STORED for already-compressed formats, else ZIP_DEFLATED.
+    """
+    return zipfile.ZIP_STORED if name.lower().endswith(STORED_EXTS) else zipfile.ZIP_DEFLATED
+
+def write_zip(zip_path, members):
+    """
+    Writes a ZIP from (arcname, source) members one at a time; source is a file path
+    or the member's bytes (e.g. PNGs still in memory after the pipeline).
+    """
+    with zipfile.ZipFile(zip_path, 'w') as zipf:
+        for arcname, source in members:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+                info.compress_type = compress_type(arcname)
+                info.external_attr = 0o644 << 16
+                zipf.writestr(info, source)
+            else:
+                zipf.write(source, arcname, compress_type=compress_type(arcname))
+
+def stamp_members(stamps, specials=()):
+    """
+    ZIP members for one set: stamps renamed 01.png, 02.png... followed by the
+    (name, source) specials (main/tab) under their own names.
+    """
+    for i, source in enumerate(stamps, start=1):
+        yield f"{i:02d}.png", source
+    yield from specials
+
+def export_zips(output_dir, parts, stamps, specials=(), set_size=None):
+    """
+    Writes one <parts>_SetNN.zip per set_size stamps (all in one set when None), each
+    with the same specials. stamps are sources in order (paths or PNG bytes), specials
+    are (name, source) pairs. No files are deleted or opened in a file manager.
+    Returns a list of {"zip_path", "stamp_count", "special_count"}.
+    """
+    stamps = list(stamps)
+    specials = list(specials)
+    if not stamps and not specials:
+        return []
+    size = set_size or len(stamps) or 1
+    results = []
+    for start in range(0, max(1, len(stamps)), size):
+        chunk = stamps[start:start + size]
+        zip_path = next_zip_path(output_dir, parts)
+        write_zip(zip_path, stamp_members(chunk, specials))
+        results.append({"zip_path": zip_path, "stamp_count": len(chunk), "special_count": len(specials)})
+    return results
+
+def delete_outputs(output_dir, files):
+    """
+    Deletes files from output_dir (backup folders are kept). Returns the number deleted.
+    """
+    deleted_count = 0
+    for file in files:
+        file_path = os.path.join(output_dir, file)
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+            deleted_count += 1
+    return deleted_count
+
+def create_zip(output_dir, parts, cleanup=False, stamp_files=None):
+    """
+    Zips the stamps of output_dir as 01.png, 02.png... plus main/tab.
+    stamp_files: stamps in ZIP order (e.g. StampOrder.active()); None = all, sorted by name.
+    cleanup: delete the root PNG images afterwards (backup folders are kept).
+    Returns a dict with "zip_path", "stamp_count", "special_count", "deleted_count",
+    or None if there is nothing to zip.
+    """
+    all_stamps, special_files = list_stamp_files(output_dir)
+    if stamp_files is None:
+        stamp_files = all_stamps
+
+    # ZIPファイル作成（スタンプは連番リネーム、main.pngとtab.pngはそのまま）
+    results = export_zips(output_dir, parts,
+                          [os.path.join(output_dir, f) for f in stamp_files],
+                          [(f, os.path.join(output_dir, f)) for f in special_files])
+    if not results:
+        return None
+
+    # ルートのPNG画像を削除（バックアップフォルダは残す）
+    deleted_count = delete_outputs(output_dir, stamp_files + special_files) if cleanup else 0
+
+    return dict(results[0], deleted_count=deleted_count)
@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+from stamp_export import list_stamp_files
+
+ORDER_FILE = ".stamp_order.json"
+STAGING_DIR = ".stamp_order_staging"   # renamed stamps wait here while an order is applied
+ORDER_VERSION = 1
+
+class StampOrder(object):
+    """
+    Virtual order of the stamps in an output folder, kept in ORDER_FILE:
+    "order" lists the stamps in their intended order, "deleted" and "selected" are
+    the curation state. Reordering, selecting, deleting and counting only change the
+    manifest; files are renamed / deleted once, by apply().
+
+    apply() is journaled: the rename plan is written to the manifest before any file
+    is touched, and an interrupted apply() is rolled forward the next time the folder
+    is opened, so the folder never stays half renamed.
+    """
+
+    def __init__(self, output_dir, stamp_files=None):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, ORDER_FILE)
+        self.order = []
+        self.deleted = set()
+        self.selected = set()
+        self._journal = None
+        self.load(stamp_files)
+
+    # --- manifest ---
+
+    def load(self, stamp_files=None):
+        """
+        Reads the manifest, finishes an interrupted apply() and reconciles with the
+        folder: new stamps are appended in name order, vanished ones are dropped.
+        stamp_files: the folder's stamps if already known (e.g. FolderIndex), to skip the listing.
+        """
+        data = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            pass
+        if data.get("version") == ORDER_VERSION:
+            self.order = list(data.get("order", []))
+            self.deleted = set(data.get("deleted", []))
+            self.selected = set(data.get("selected", []))
+            self._journal = data.get("journal")
+        if self._journal:
+            self._run_journal()
+            stamp_files = None
+
+        if stamp_files is None:
+            stamp_files, _ = list_stamp_files(self.output_dir)
+        on_disk = set(stamp_files)
+        known = set(self.order)
+        self.order = [f for f in self.order if f in on_disk] + [f for f in stamp_files if f not in known]
+        self.deleted &= on_disk
+        self.selected &= on_disk
+
+    def save(self):
+        """
+        Writes the manifest atomically (temp file + rename).
+        """
+        data = {
+            "version": ORDER_VERSION,
+            "order": self.order,
+            "deleted": sorted(self.deleted),
+            "selected": sorted(self.selected),
+            "journal": self._journal,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.output_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fp:
+                json.dump(data, fp, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    # --- curation (manifest only) ---
+
+    def active(self):
+        """
+        Stamps that are not marked deleted, in order.
+        """
+        return [f for f in self.order if f not in self.deleted]
+
+    @property
+    def count(self):
+        return len(self.order) - len(self.deleted)
+
+    def move(self, name, index):
+        """
+        Moves a stamp to position index of the full order.
+        """
+        self.order.remove(name)
+        self.order.insert(max(0, min(index, len(self.order))), name)
+
+    def delete(self, names):
+        self.deleted.update(n for n in names if n in self.order)
+        self.selected -= self.deleted
+
+    def restore(self, names):
+        self.deleted.difference_update(names)
+
+    def select(self, names, selected=True):
+        if selected:
+            self.selected.update(n for n in names if n in self.order and n not in self.deleted)
+        else:
+            self.selected.difference_update(names)
+
+    # --- export ---
+
+    def plan(self):
+        """
+        Returns (renames, deletes): renames are (current name, NN.png) for the stamps
+        whose name changes, deletes the stamps marked deleted.
+        """
+        renames = [(f, f"{i:02d}.png") for i, f in enumerate(self.active(), start=1)]
+        return [(src, dst) for src, dst in renames if src != dst], sorted(self.deleted)
+
+    def apply(self):
+        """
+        Deletes the stamps marked deleted and renames the rest to 01.png, 02.png...
+        in manifest order. Returns the number of stamps.
+        """
+        renames, deletes = self.plan()
+        self._journal = {"phase": "stage", "renames": renames, "deletes": deletes,
+                         "order": [f"{i:02d}.png" for i in range(1, self.count + 1)]}
+        self.save()
+        self._run_journal()
+        return len(self.order)
+
+    def _run_journal(self):
+        """
+        Executes (or resumes) the journal. Every step can be repeated safely:
+        phase "stage" deletes files and moves renamed stamps into STAGING_DIR under
+        their final names (sources and staged names never collide); phase "place"
+        moves them into the folder once every source is out of the way.
+        """
+        journal = self._journal
+        staging = os.path.join(self.output_dir, STAGING_DIR)
+        if journal["phase"] == "stage":
+            if journal["renames"]:
+                os.makedirs(staging, exist_ok=True)
+            for name in journal["deletes"]:
+                path = os.path.join(self.output_dir, name)
+                if os.path.isfile(path):
+                    os.remove(path)
+            for src, dst in journal["renames"]:
+                src_path = os.path.join(self.output_dir, src)
+                if os.path.isfile(src_path):
+                    os.replace(src_path, os.path.join(staging, dst))
+            journal["phase"] = "place"
+            self.save()
+
+        for _, dst in journal["renames"]:
+            staged = os.path.join(staging, dst)
+            if os.path.isfile(staged):
+                os.replace(staged, os.path.join(self.output_dir, dst))
+        if os.path.isdir(staging) and not os.listdir(staging):
+            os.rmdir(staging)
+        self.order = journal["order"]
+        self.deleted = set()
+        self.selected = set()
+        self._journal = None
+        self.save()
+
+def reset_order(output_dir):
+    """
+    Forgets the folder's curation state (ORDER_FILE and stamps staged by an interrupted
+    apply()). Call after writing new outputs: the manifest describes the stamps that
+    were curated, and the new ones reuse their names (01.png, 02.png...).
+    """
+    path = os.path.join(output_dir, ORDER_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+    shutil.rmtree(os.path.join(output_dir, STAGING_DIR), ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Stamp order manifest (virtual reorder / delete, applied once)")
+    parser.add_argument("--input", default="output_final", help="Stamp folder")
+    parser.add_argument("--move", nargs=2, metavar=("NAME", "POSITION"), help="Move NAME to POSITION (1-based)")
+    parser.add_argument("--delete", nargs="+", default=[], help="Mark stamps as deleted")
+    parser.add_argument("--restore", nargs="+", default=[], help="Unmark deleted stamps")
+    parser.add_argument("--apply", action="store_true", help="Delete marked stamps and rename the rest to 01.png, 02.png...")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"Error: '{args.input}' directory not found.")
+        return
+
+    if args.move:
+        try:
+            position = int(args.move[1])
+        except ValueError:
+            print(f"Error: POSITION must be a number, got '{args.move[1]}'.")
+            return
+
+    order = StampOrder(args.input)
+    if args.move:
+        if args.move[0] not in order.order:
+            print(f"Error: '{args.move[0]}' is not a stamp in '{args.input}'.")
+            return
+        order.move(args.move[0], position - 1)
+    order.delete(args.delete)
+    order.restore(args.restore)
+
+    if args.apply:
+        print(f"Applied: {order.apply()} stamps")
+    else:
+        order.save()
+        for i, name in enumerate(order.active(), start=1):
+            print(f"{i:02d}: {name}")
+        print(f"{order.count} stamps ({len(order.deleted)} marked deleted)")
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,10 @@ import sys
 import argparse
 from collections import Counter
 
+import instrumentation
+from image_io import IMAGE_EXTS, decode_image, to_bgra, parse_png, EncodePool, ENCODE_THREADS
+from parallel import run_tasks, resolve_workers
+
 def detect_bg_color_cv(img):
     """
     Detects the background color by analyzing the top-left and top-right corners.
@@ -29,28 +33,10 @@ def detect_bg_color_cv(img):
     most_common = Counter(colors).most_common(1)[0][0]
     return np.array(most_common, dtype=np.uint8)
 
-def process_image_cv(file_path, output_dir, tolerance=30, erosion=1, grid="auto", remove_bg=True, inner_margin=0):
+def resolve_grid(grid, width, height):
     """
-    Splits a stamp sheet.
-    remove_bg: If True, applies high-quality transparency using OpenCV.
-    inner_margin: int (all sides) or list/tuple [top, bottom, left, right]
+    Returns (rows, cols) for the given grid option and sheet size.
     """
-    try:
-        img = cv2.imdecode(np.fromfile(file_path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
-        if img is None:
-            print(f"Error: Could not read {file_path}")
-            return
-    except Exception as e:
-        print(f"Error opening {file_path}: {e}")
-        return
-
-    # Ensure 4 channels (BGRA)
-    if img.shape[2] == 3:
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
-    
-    height, width = img.shape[:2]
-    
-    # Determine grid
     rows, cols = 2, 4
     if grid == "3x3":
         rows, cols = 3, 3
@@ -58,102 +44,398 @@ def process_image_cv(file_path, output_dir, tolerance=30, erosion=1, grid="auto"
         rows, cols = 4, 4
     elif grid == "4x2":
         rows, cols = 2, 4
-    elif grid == "auto":
-        # Simple aspect ratio check
+    elif grid in ("auto", "detect"):
+        # Simple aspect ratio check (also the fallback when detection finds no gutters)
         ratio = width / height
         if 0.8 <= ratio <= 1.2: # Square-ish
             # 正方形はデフォルトで3x3（4x4は明示的に--grid 4x4を指定した場合のみ）
             rows, cols = 3, 3
-            print(f"Auto-detected 3x3 grid (Square)")
         else:
             rows, cols = 2, 4
-            print(f"Auto-detected 4x2 grid (Aspect Ratio: {ratio:.2f})")
+    return rows, cols
 
-    cell_w = width // cols
-    cell_h = height // rows
+DETECT_MAX_SIDE = 512   # grid detection runs on a copy downscaled to this size
+DETECT_MAX_CELLS = 8    # max rows / cols tried by grid detection
+GUTTER_OCCUPANCY = 0.01 # a row / column with at most this foreground fraction counts as gutter
+GUTTER_MIN_RATIO = 0.3  # gutters narrower than this x the widest one are gaps inside a stamp
+
+# Band mode: estimated working bytes per BGRA byte of a band
+# (converted band, cut cells and the mask / split temporaries of bg removal)
+BAND_COST = 3
+
+def _gutter_runs(empty):
+    """
+    Returns (starts, ends) of the runs of empty rows / columns that lie between
+    content (runs touching the sheet border are not gutters). ends are exclusive.
+    """
+    edges = np.diff(np.concatenate(([0], empty.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    inner = (starts > 0) & (ends < len(empty))
+    return starts[inner], ends[inner]
+
+def _profile_cuts(occupancy, max_cells=DETECT_MAX_CELLS, threshold=GUTTER_OCCUPANCY):
+    """
+    Finds cell boundaries along one axis from a foreground occupancy profile.
+    Tries the largest cell count first: every expected boundary (size * i / n) needs
+    its own gutter within a quarter cell, at least GUTTER_MIN_RATIO as wide as the
+    widest gutter (so caption gaps inside a row of stamps are not taken as gutters).
+    The cut stays at the expected position when that lies in the gutter (uniform
+    sheets split exactly like the fixed grid), otherwise it goes through its middle.
+    Returns the inner cuts as fractions of the axis ([] when no count fits, i.e. a
+    single cell), so they map back to the full-size sheet without rounding drift.
+    """
+    size = len(occupancy)
+    starts, ends = _gutter_runs(occupancy <= threshold)
+    widths = ends - starts
+    if not len(widths):
+        return []
+    wide = widths >= widths.max() * GUTTER_MIN_RATIO
+    starts, ends = starts[wide], ends[wide]
+    centers = (starts + ends) / 2
+
+    for n in range(min(max_cells, len(starts) + 1), 1, -1):
+        window = size / n / 4
+        expected = size * np.arange(1, n) / n
+        # Distance from each expected boundary to each gutter (0 when inside it)
+        dist = np.maximum(starts[None, :] - expected[:, None], expected[:, None] - (ends[None, :] - 1)).clip(0)
+        nearest = dist.argmin(axis=1)
+        if (dist[np.arange(n - 1), nearest] > window).any() or len(set(nearest)) < n - 1:
+            continue
+        return [i / n if dist[i - 1, run] == 0 else centers[run] / size
+                for i, run in zip(range(1, n), nearest)]
+    return []
+
+def detect_image(img):
+    """
+    The BGRA copy of a sheet that grid detection works on (longer side at most DETECT_MAX_SIDE).
+    """
+    height, width = img.shape[:2]
+    scale = min(1.0, DETECT_MAX_SIDE / max(width, height))
+    small = img
+    if scale < 1.0:
+        small = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    # Converted after downscaling so a non-BGRA sheet is never converted at full size
+    return to_bgra(small)
+
+def detect_grid(img, tolerance=30, max_cells=DETECT_MAX_CELLS, size=None):
+    """
+    Finds the real gutters of a sheet from row / column background-occupancy
+    profiles computed on a downscaled copy (background = corner color +/- tolerance,
+    or transparent). Supports any rows x cols up to max_cells each.
+    size: (width, height) of the sheet when img already is its detect_image
+    (e.g. kept by the preview), so the full-size sheet is not needed.
+    Returns (xs, ys): cell boundaries in sheet pixels including 0 and width / height,
+    or None when no gutters were found.
+    """
+    if size is None:
+        height, width = img.shape[:2]
+        small = detect_image(img)
+    else:
+        width, height = size
+        small = img
+
+    bg = detect_bg_color_cv(small).astype(np.int16)
+    lower = np.append(np.clip(bg - tolerance, 0, 255), 0).astype(np.uint8)
+    upper = np.append(np.clip(bg + tolerance, 0, 255), 255).astype(np.uint8)
+    foreground = (cv2.inRange(small, lower, upper) == 0) & (small[:, :, 3] > 0)
+
+    col_cuts = _profile_cuts(foreground.mean(axis=0), max_cells)
+    row_cuts = _profile_cuts(foreground.mean(axis=1), max_cells)
+    if not col_cuts and not row_cuts:
+        return None
+
+    xs = [0] + [round(c * width) for c in col_cuts] + [width]
+    ys = [0] + [round(c * height) for c in row_cuts] + [height]
+    return xs, ys
+
+def grid_rects(width, height, grid="auto", inner_margin=0, cuts=None):
+    """
+    Returns (rows, cols, rects, margin_ignored) for a sheet of the given size:
+    rects are the (left, top, right, bottom) crops in row-major order, after the
+    inner margin (ignored, with margin_ignored=True, for cells it does not fit).
+    cuts: (xs, ys) boundaries from detect_grid instead of the fixed grid.
+    """
+    if cuts is None:
+        rows, cols = resolve_grid(grid, width, height)
+        cell_w = width // cols
+        cell_h = height // rows
+        xs = [col * cell_w for col in range(cols + 1)]
+        ys = [row * cell_h for row in range(rows + 1)]
+    else:
+        xs, ys = cuts
+        rows, cols = len(ys) - 1, len(xs) - 1
+
+    if isinstance(inner_margin, (list, tuple)):
+        m_top, m_bottom, m_left, m_right = inner_margin
+    else:
+        m_top = m_bottom = m_left = m_right = int(inner_margin or 0)
+
+    rects = []
+    margin_ignored = False
+    for row in range(rows):
+        for col in range(cols):
+            left, right = xs[col], xs[col + 1]
+            top, bottom = ys[row], ys[row + 1]
+            if inner_margin:
+                if (m_top + m_bottom) < bottom - top and (m_left + m_right) < right - left:
+                    left, top, right, bottom = left + m_left, top + m_top, right - m_right, bottom - m_bottom
+                else:
+                    margin_ignored = True
+            rects.append((left, top, right, bottom))
+    return rows, cols, rects, margin_ignored
+
+def split_sheet(img, tolerance=30, erosion=1, grid="auto", remove_bg=True, inner_margin=0):
+    """
+    Splits a decoded BGRA sheet in memory (no printing).
+    Returns (cells, info): cells are BGRA ndarrays in row-major order, info is a dict
+    with "rows", "cols", "bg_color" (BGR tuple or None), "rects" (left, top, right, bottom
+    of each cell on the sheet), "margin_ignored" (inner_margin too large for the cell),
+    "ignored_rects" (the cells it was ignored for) and "detected" (grid="detect" only: False when it fell back to the auto grid).
+    """
+    with instrumentation.span("split"):
+        return _split_sheet(img, tolerance, erosion, grid, remove_bg, inner_margin)
+
+def _split_plan(img, tolerance, grid, remove_bg, inner_margin):
+    """
+    Returns (info, bounds) for split_sheet without cutting any cell. img may be the
+    sheet as stored (gray / BGR / BGRA). bounds is the (lower, upper) chroma key range,
+    or None when remove_bg is off.
+    """
+    height, width = img.shape[:2]
+
+    # Determine grid and cell rectangles
+    cuts = None
+    if grid == "detect":
+        cuts = detect_grid(img, tolerance)
+    rows, cols, rects, margin_ignored = grid_rects(width, height, grid, inner_margin, cuts)
+    # Cells the margin did not fit keep their full rect
+    ignored_rects = []
+    if margin_ignored:
+        cell_rects = grid_rects(width, height, grid, 0, cuts)[2]
+        ignored_rects = [rect for rect, cell in zip(rects, cell_rects) if rect == cell]
 
-    filename = os.path.splitext(os.path.basename(file_path))[0]
-    
     # Auto-detect background color from the whole sheet's corners (only if needed)
     target_bgr = None
-    lower_bound = None
-    upper_bound = None
-    
+    bounds = None
+
     if remove_bg:
-        target_bgr = detect_bg_color_cv(img)
-        print(f"Processing {filename}: Detected background BGR {target_bgr}, Grid: {cols}x{rows}")
-        
+        # Both corners are on the top row, so only that row is converted
+        target_bgr = detect_bg_color_cv(to_bgra(img[:1]))
+
         # Define range for chroma key
         target_bgr_int = target_bgr.astype(np.int16)
         lower_bound = np.clip(target_bgr_int - tolerance, 0, 255).astype(np.uint8)
         upper_bound = np.clip(target_bgr_int + tolerance, 0, 255).astype(np.uint8)
+        bounds = (lower_bound, upper_bound)
+
+    info = {
+        "rows": rows,
+        "cols": cols,
+        "bg_color": tuple(int(c) for c in target_bgr) if target_bgr is not None else None,
+        "rects": rects,
+        "margin_ignored": margin_ignored,
+        "ignored_rects": ignored_rects,
+        "detected": cuts is not None if grid == "detect" else None,
+    }
+    return info, bounds
+
+def _cut_cell(crop, bounds, erosion):
+    """
+    Applies the chroma key transparency to one BGRA crop (returned as is when bounds is None).
+    """
+    if bounds is None:
+        return crop
+
+    # Create mask for background
+    crop_bgr = crop[:, :, :3]
+    bg_mask = cv2.inRange(crop_bgr, bounds[0], bounds[1])
+
+    # Fringe Removal: Dilate the background mask
+    if erosion > 0:
+        kernel = np.ones((3, 3), np.uint8)
+        bg_mask = cv2.dilate(bg_mask, kernel, iterations=erosion)
+
+    # Create Alpha channel
+    alpha = cv2.bitwise_not(bg_mask)
+
+    # Apply alpha
+    b, g, r, a = cv2.split(crop)
+    final_alpha = cv2.bitwise_and(a, alpha)
+    return cv2.merge([b, g, r, final_alpha])
+
+def _split_sheet(img, tolerance, erosion, grid, remove_bg, inner_margin):
+    info, bounds = _split_plan(img, tolerance, grid, remove_bg, inner_margin)
+    cells = [_cut_cell(img[top:bottom, left:right], bounds, erosion) for left, top, right, bottom in info["rects"]]
+    return cells, info
+
+def band_groups(info, max_mb):
+    """
+    Groups the cells of a split plan into bands whose estimated working memory
+    (BAND_COST x the band's BGRA size) fits in max_mb.
+    Whole rows of cells are combined while they fit; a row that does not fit on its
+    own is split into single-cell tiles.
+    Returns [((left, top, right, bottom), [cell indices])] in row-major order.
+    """
+    budget = max_mb * 1024 * 1024
+    rects = info["rects"]
+    cols = info["cols"]
+
+    def region(indices):
+        boxes = [rects[i] for i in indices]
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+    def cost(box):
+        return (box[2] - box[0]) * (box[3] - box[1]) * 4 * BAND_COST
+
+    groups = []
+    current = []
+    for row in range(info["rows"]):
+        indices = list(range(row * cols, (row + 1) * cols))
+        if cost(region(indices)) > budget:
+            if current:
+                groups.append((region(current), current))
+                current = []
+            groups.extend((rects[i], [i]) for i in indices)
+        elif current and cost(region(current + indices)) > budget:
+            groups.append((region(current), current))
+            current = indices
+        else:
+            current = current + indices
+    if current:
+        groups.append((region(current), current))
+    return groups
+
+def split_bands(img, tolerance=30, erosion=1, grid="auto", remove_bg=True, inner_margin=0, max_mb=256):
+    """
+    Bounded-memory split_sheet for very large sheets. img is the sheet as decoded
+    (gray / BGR / BGRA); only one band of cells at a time is converted to BGRA and cut,
+    so the working memory beyond the decoded sheet stays within about max_mb
+    (at least one cell). The cells are identical to split_sheet's.
+    Returns (info, bands): info as in split_sheet, bands yields [(index, cell)] per band
+    in row-major order (index is 0-based).
+    """
+    with instrumentation.span("split"):
+        info, bounds = _split_plan(img, tolerance, grid, remove_bg, inner_margin)
+    return info, _iter_bands(img, info, bounds, erosion, max_mb)
+
+def _iter_bands(img, info, bounds, erosion, max_mb):
+    rects = info["rects"]
+    for (left, top, right, bottom), indices in band_groups(info, max_mb):
+        with instrumentation.span("split"):
+            # A view when the sheet is already BGRA, otherwise a copy of this band only
+            band = to_bgra(img[top:bottom, left:right])
+            cells = []
+            for i in indices:
+                l, t, r, b = rects[i]
+                cells.append((i, _cut_cell(band[t - top:b - top, l - left:r - left], bounds, erosion)))
+        del band
+        yield cells
+
+def split_stage(items, tolerance=50, erosion=1, grid="auto", remove_bg=True, inner_margin=0, max_mb=None):
+    """
+    Streaming split stage: for each (name, sheet, metadata) item yields
+    (f"{name}_{NN}", cell, metadata) for every cell in row-major order.
+    Cell metadata adds "sheet", "index", "grid" (cols, rows), "rect", "bg_color"
+    and "margin_ignored".
+    max_mb: cut the sheet band by band (see split_bands) instead of all at once.
+    """
+    for name, img, meta in items:
+        if max_mb is None:
+            with instrumentation.span("split", image=name):
+                img = to_bgra(img)
+                cells, info = _split_sheet(img, tolerance, erosion, grid, remove_bg, inner_margin)
+            numbered = enumerate(cells)
+        else:
+            info, bands = split_bands(img, tolerance, erosion, grid, remove_bg, inner_margin, max_mb)
+            numbered = (cell for band in bands for cell in band)
+        for i, cell in numbered:
+            cell_meta = dict(meta, sheet=name, index=i + 1, grid=(info["cols"], info["rows"]),
+                             rect=info["rects"][i], bg_color=info["bg_color"], margin_ignored=info["margin_ignored"])
+            yield f"{name}_{i + 1:02d}", cell, cell_meta
+
+def describe_split(filename, img, grid, inner_margin, info):
+    """
+    Prints the per-sheet messages of the splitter CLI.
+    """
+    height, width = img.shape[:2]
+    cols, rows = info["cols"], info["rows"]
+    if grid == "detect":
+        if info["detected"]:
+            sizes = ", ".join(f"{r - l}x{b - t}" for l, t, r, b in info["rects"])
+            print(f"Detected {cols}x{rows} grid from gutters (cells: {sizes})")
+        else:
+            print("No gutters detected, falling back to auto grid")
+    if grid in ("auto", "detect") and not info["detected"]:
+        if (rows, cols) == (3, 3):
+            print("Auto-detected 3x3 grid (Square)")
+        else:
+            print(f"Auto-detected 4x2 grid (Aspect Ratio: {width / height:.2f})")
+    if info["bg_color"] is not None:
+        print(f"Processing {filename}: Detected background BGR {np.array(info['bg_color'], dtype=np.uint8)}, Grid: {cols}x{rows}")
     else:
         print(f"Processing {filename}: Grid: {cols}x{rows} (Background Removal Disabled)")
+    if info["margin_ignored"]:
+        # Detected grids can have cells of different sizes: report the ones the margin did not fit
+        sizes = sorted({(r - l, b - t) for l, t, r, b in info["ignored_rects"]})
+        print(f"Warning: Inner margin {inner_margin} is too large for cell size {', '.join(f'{w}x{h}' for w, h in sizes)}.")
 
-    count = 1
-    for row in range(rows):
-        for col in range(cols):
-            left = col * cell_w
-            top = row * cell_h
-            right = left + cell_w
-            bottom = top + cell_h
-            
-            # Crop
-            crop = img[top:bottom, left:right]
-            
-            # Apply cell margin trim if specified
-            if inner_margin:
-                ch, cw = crop.shape[:2]
-                if isinstance(inner_margin, (list, tuple)):
-                    m_top, m_bottom, m_left, m_right = inner_margin
-                else:
-                    m_top = m_bottom = m_left = m_right = int(inner_margin)
+@instrumentation.traced("file")
+def process_image_cv(file_path, output_dir, tolerance=30, erosion=1, grid="auto", remove_bg=True, inner_margin=0, workers=1,
+                     png=None, max_mb=None):
+    """
+    Splits a stamp sheet.
+    remove_bg: If True, applies high-quality transparency using OpenCV.
+    inner_margin: int (all sides) or list/tuple [top, bottom, left, right]
+    workers: number of threads used to encode the cells (at least ENCODE_THREADS)
+    png: PNG encoder settings (image_io.png_params)
+    max_mb: split and save one band of cells at a time within about this much
+    working memory (see split_bands); None processes the whole sheet at once
+    """
+    try:
+        img = decode_image(file_path)
+        if img is None:
+            print(f"Error: Could not read {file_path}")
+            return
+    except Exception as e:
+        print(f"Error opening {file_path}: {e}")
+        return
 
-                if (m_top + m_bottom) < ch and (m_left + m_right) < cw:
-                    # [startY:endY, startX:endX]
-                    crop = crop[m_top:ch-m_bottom, m_left:cw-m_right]
-                else:
-                    print(f"Warning: Inner margin {inner_margin} is too large for cell size {cw}x{ch}.")
-            
-            final_crop = crop
-            
-            if remove_bg:
-                # Create mask for background
-                crop_bgr = crop[:, :, :3]
-                bg_mask = cv2.inRange(crop_bgr, lower_bound, upper_bound)
-                
-                # Fringe Removal: Dilate the background mask
-                if erosion > 0:
-                    kernel = np.ones((3, 3), np.uint8)
-                    bg_mask = cv2.dilate(bg_mask, kernel, iterations=erosion)
-                
-                # Create Alpha channel
-                alpha = cv2.bitwise_not(bg_mask)
-                
-                # Apply alpha
-                b, g, r, a = cv2.split(crop)
-                final_alpha = cv2.bitwise_and(a, alpha)
-                final_crop = cv2.merge([b, g, r, final_alpha])
-            
-            # Save
-            output_filename = f"{filename}_{count:02d}.png"
-            output_path = os.path.join(output_dir, output_filename)
-            
-            is_success, im_buf = cv2.imencode(".png", final_crop)
-            if is_success:
-                im_buf.tofile(output_path)
-                print(f"Saved: {output_path}")
-            else:
-                print(f"Failed to save {output_path}")
-            
-            count += 1
-
-def process_splitter(input_dir, output_dir, tolerance=50, erosion=1, grid="auto", remove_bg=True, inner_margin=0):
+    filename = os.path.splitext(os.path.basename(file_path))[0]
+    if max_mb is None:
+        # Ensure 4 channels (BGRA)
+        img = to_bgra(img)
+        cells, info = split_sheet(img, tolerance, erosion, grid, remove_bg, inner_margin)
+        bands = [list(enumerate(cells))]
+    else:
+        # Bands are converted to BGRA one at a time
+        info, bands = split_bands(img, tolerance, erosion, grid, remove_bg, inner_margin, max_mb)
+    describe_split(filename, img, grid, inner_margin, info)
+
+    # Save (cells are encoded on background threads, logged in order)
+    output_paths = [os.path.join(output_dir, f"{filename}_{count:02d}.png") for count in range(1, len(info["rects"]) + 1)]
+    saved = []
+    with EncodePool(max(ENCODE_THREADS, resolve_workers(workers))) as pool:
+        for band in bands:
+            for i, cell in band:
+                pool.save(cell, output_paths[i], png)
+            # Each band is written before the next one is cut
+            saved += pool.drain()
+
+    for output_path, is_success in zip(output_paths, saved):
+        if is_success:
+            print(f"Saved: {output_path}")
+        else:
+            print(f"Failed to save {output_path}")
+
+def process_splitter(input_dir, output_dir, tolerance=50, erosion=1, grid="auto", remove_bg=True, inner_margin=0, workers=1,
+                     png=None, max_mb=None):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    exts = ('.png', '.jpg', '.jpeg')
-    files = [f for f in os.listdir(input_dir) if f.lower().endswith(exts)]
+    files = [f for f in os.listdir(input_dir) if f.lower().endswith(IMAGE_EXTS)]
     
     if not files:
         print(f"No images found in '{input_dir}'.")
@@ -162,9 +444,11 @@ def process_splitter(input_dir, output_dir, tolerance=50, erosion=1, grid="auto"
     print(f"Processing {len(files)} images with OpenCV...")
     print(f"Tolerance: {tolerance}, Fringe Removal (Erosion): {erosion}, Grid: {grid}, Remove BG: {remove_bg}")
     
-    for f in files:
-        file_path = os.path.join(input_dir, f)
-        process_image_cv(file_path, output_dir, tolerance, erosion, grid, remove_bg, inner_margin)
+    # Sheets run in a process pool; a single sheet encodes its cells on threads instead
+    cell_workers = workers if len(files) == 1 else 1
+    tasks = [(os.path.join(input_dir, f), output_dir, tolerance, erosion, grid, remove_bg, inner_margin, cell_workers, png, max_mb)
+             for f in files]
+    run_tasks(process_image_cv, tasks, workers)
         
     print("Done!")
 
@@ -174,8 +458,12 @@ def main():
     parser.add_argument("--output", default="output_v2", help="Output directory")
     parser.add_argument("--tolerance", type=int, default=50, help="Color tolerance (0-255)")
     parser.add_argument("--erosion", type=int, default=1, help="Fringe removal strength (iterations). 0 to disable.")
-    parser.add_argument("--grid", choices=["auto", "4x2", "3x3", "4x4"], default="auto", help="Grid layout (default: auto)")
+    parser.add_argument("--grid", choices=["auto", "detect", "4x2", "3x3", "4x4"], default="auto", help="Grid layout (default: auto; detect = find gutters from the image)")
     parser.add_argument("--no_bg", action="store_true", help="Disable background removal")
+    parser.add_argument("--png", default="default", help="PNG encoder: default, fast (intermediates), max (smallest) or LEVEL[,STRATEGY[,FILTER]]")
+    parser.add_argument("--max_mb", type=int, default=None, help="Split large sheets one band of cells at a time within about this many MB (default: whole sheet)")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel workers (0 = all CPU cores)")
+    parser.add_argument("--profile", default=None, help="Write a timing/memory report (JSON) to this path")
     
     args = parser.parse_args()
 
@@ -183,7 +471,20 @@ def main():
         print(f"Error: '{args.input}' directory not found.")
         return
 
-    process_splitter(args.input, args.output, args.tolerance, args.erosion, args.grid, remove_bg=not args.no_bg)
+    try:
+        png = parse_png(args.png)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+
+    if args.profile:
+        instrumentation.enable()
+
+    process_splitter(args.input, args.output, args.tolerance, args.erosion, args.grid, remove_bg=not args.no_bg, workers=args.workers,
+                     png=png, max_mb=args.max_mb)
+
+    if args.profile:
+        instrumentation.finish(args.profile)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,106 @@
+import cv2
+import numpy as np
+import os
+import argparse
+
+# Background colors (BGR) like the generator's chroma-key sheets
+BG_COLORS = {
+    "magenta": (255, 0, 255),
+    "green": (0, 255, 0),
+    "white": (255, 255, 255),
+}
+
+# Layout name -> (rows, cols), same naming as stamp_splitter_v2 --grid
+LAYOUTS = {
+    "4x2": (2, 4),
+    "3x3": (3, 3),
+    "4x4": (4, 4),
+}
+
+# Character colors far enough from every background (tolerance 50)
+BODY_COLORS = [(60, 120, 200), (200, 150, 60), (90, 170, 110), (150, 90, 180), (70, 200, 230)]
+OUTLINE_COLOR = (30, 30, 30)
+
+def draw_character(cell, rng):
+    """
+    Draws an anti-aliased "character" (outlined body, eyes, mouth and a caption)
+    inside the cell, away from the top corners so flood mode can reach the background.
+    """
+    h, w = cell.shape[:2]
+    cx = int(w * rng.uniform(0.4, 0.6))
+    cy = int(h * rng.uniform(0.5, 0.6))
+    ax = int(w * rng.uniform(0.22, 0.32))
+    ay = int(h * rng.uniform(0.22, 0.3))
+    body = BODY_COLORS[int(rng.integers(len(BODY_COLORS)))]
+    thickness = max(2, w // 100)
+
+    # Body + outline
+    cv2.ellipse(cell, (cx, cy), (ax, ay), 0, 0, 360, body, -1, cv2.LINE_AA)
+    cv2.ellipse(cell, (cx, cy), (ax, ay), 0, 0, 360, OUTLINE_COLOR, thickness, cv2.LINE_AA)
+
+    # Ears / arms
+    for side in (-1, 1):
+        ex = cx + side * int(ax * 0.7)
+        ey = cy - int(ay * 0.9)
+        cv2.circle(cell, (ex, ey), max(3, ax // 4), body, -1, cv2.LINE_AA)
+        cv2.circle(cell, (ex, ey), max(3, ax // 4), OUTLINE_COLOR, thickness, cv2.LINE_AA)
+
+    # Eyes and mouth
+    for side in (-1, 1):
+        cv2.circle(cell, (cx + side * ax // 3, cy - ay // 4), max(2, ax // 10), OUTLINE_COLOR, -1, cv2.LINE_AA)
+    cv2.ellipse(cell, (cx, cy + ay // 4), (ax // 4, ay // 8), 0, 0, 180, OUTLINE_COLOR, thickness, cv2.LINE_AA)
+
+    # Caption
+    text = ["OK!", "NO", "YES", "Hi", "??"][int(rng.integers(5))]
+    scale = w / 300
+    cv2.putText(cell, text, (int(w * 0.1), int(h * 0.95)), cv2.FONT_HERSHEY_SIMPLEX, scale,
+                OUTLINE_COLOR, max(1, thickness), cv2.LINE_AA)
+
+def make_sheet(layout="3x3", cell_size=300, bg="magenta", seed=0):
+    """
+    Returns a synthetic BGR stamp sheet (rows x cols cells of cell_size px).
+    The same arguments always produce the same image.
+    """
+    rows, cols = LAYOUTS[layout]
+    rng = np.random.default_rng(seed)
+    sheet = np.full((rows * cell_size, cols * cell_size, 3), BG_COLORS[bg], dtype=np.uint8)
+    for row in range(rows):
+        for col in range(cols):
+            top = row * cell_size
+            left = col * cell_size
+            draw_character(sheet[top:top + cell_size, left:left + cell_size], rng)
+    return sheet
+
+def write_sheets(output_dir, layouts=("4x2", "3x3", "4x4"), cell_sizes=(300,), colors=("magenta",), seed=0):
+    """
+    Writes sheet_<layout>_<cell>_<color>.png for every combination. Returns the paths.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    paths = []
+    for layout in layouts:
+        for cell_size in cell_sizes:
+            for color in colors:
+                sheet = make_sheet(layout, cell_size, color, seed)
+                path = os.path.join(output_dir, f"sheet_{layout}_{cell_size}_{color}.png")
+                cv2.imencode(".png", sheet)[1].tofile(path)
+                paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic stamp sheet generator")
+    parser.add_argument("--output", default="input_synthetic", help="Output directory")
+    parser.add_argument("--layouts", default="4x2,3x3,4x4", help="Comma separated layouts")
+    parser.add_argument("--cells", default="300", help="Comma separated cell sizes (px)")
+    parser.add_argument("--colors", default="magenta", help="Comma separated backgrounds: " + ",".join(BG_COLORS))
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    args = parser.parse_args()
+
+    paths = write_sheets(args.output, args.layouts.split(','), [int(c) for c in args.cells.split(',')],
+                         args.colors.split(','), args.seed)
+    for path in paths:
+        print(f"Saved: {path}")
+
+if __name__ == "__main__":
+    main()
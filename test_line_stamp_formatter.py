@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from line_stamp_formatter import (PROFILES, format_stage, render_profiles, resize_and_pad, resize_exact,
+                                  parse_profile)
+
+def noise(width, height, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 4), dtype=np.uint8)
+
+def smooth(width, height):
+    yy, xx = np.indices((height, width))
+    img = np.stack([xx * 255 // width, yy * 255 // height, (xx + yy) * 127 // (width + height), np.full_like(xx, 255)], axis=2)
+    return img.astype(np.uint8)
+
+def direct(img, name):
+    target_w, target_h, margin, fit = PROFILES[name] if name in PROFILES else parse_profile(name)[1]
+    if fit == "exact":
+        return resize_exact(img, target_w, target_h)
+    return resize_and_pad(img, target_w, target_h, margin)
+
+@pytest.mark.parametrize("size", [(1600, 1400), (400, 300), (5000, 900)])
+def test_stamp_profile_equals_direct_resize(size):
+    img = noise(*size)
+    outputs = render_profiles(img, ["stamp", "main", "tab", "emoji"])
+    assert np.array_equal(outputs["stamp"], resize_and_pad(img, 370, 320, 10))
+    assert np.array_equal(outputs["stamp"], next(format_stage([("a", img, {})]))[1])
+
+def test_profiles_without_pyramid_level_equal_direct_resize():
+    # Smaller than 2x every target: everything is resized from the source itself
+    img = noise(300, 260)
+    outputs = render_profiles(img, ["stamp", "main", "tab", "emoji", "large=740x640+20"])
+    for name in ("stamp", "main", "tab", "emoji"):
+        assert np.array_equal(outputs[name], direct(img, name))
+    assert np.array_equal(outputs["large"], direct(img, "large=740x640+20"))
+
+def test_pyramid_profiles_close_to_direct_resize():
+    img = smooth(1600, 1400)
+    outputs = render_profiles(img, ["stamp", "main", "tab", "emoji"])
+    for name in ("main", "tab", "emoji"):
+        expected = direct(img, name)
+        assert outputs[name].shape == expected.shape
+        assert np.abs(outputs[name].astype(int) - expected.astype(int)).max() <= 2
+
+def test_profile_canvas_sizes():
+    img = noise(800, 500)
+    outputs = render_profiles(img, ["stamp", "main", "tab", "emoji", "large=740x640+20"])
+    assert {name: canvas.shape[:2] for name, canvas in outputs.items()} == {
+        "stamp": (320, 370), "main": (240, 240), "tab": (74, 96), "emoji": (180, 180), "large": (640, 740)}
+
+def test_parse_profile():
+    assert parse_profile("emoji") == ("emoji", PROFILES["emoji"])
+    assert parse_profile("large=740x640+20") == ("large", (740, 640, 20, "pad"))
+    with pytest.raises(ValueError):
+        parse_profile("large=10x10+5")
+    with pytest.raises(ValueError):
+        parse_profile("nonsense")
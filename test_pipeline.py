@@ -0,0 +1,51 @@
+import os
+
+from auto_trimmer import process_auto_trimmer
+from background_remover import process_remover
+from line_stamp_formatter import process_formatter
+from pipeline import run_fused_pipeline
+from stamp_splitter_v2 import process_splitter
+from synthetic_sheets import write_sheets
+
+def read_outputs(folder):
+    outputs = {}
+    for f in sorted(os.listdir(folder)):
+        if f.endswith(".png"):
+            with open(os.path.join(folder, f), "rb") as fp:
+                outputs[f] = fp.read()
+    return outputs
+
+def test_fused_pipeline_matches_directory_tools(tmp_path):
+    input_dir = str(tmp_path / "input")
+    write_sheets(input_dir, layouts=("4x2", "3x3"), cell_sizes=(120,), colors=("magenta", "white"))
+
+    # The temp-folder chain the GUI used before the fused pipeline
+    split_dir, bg_dir, trim_dir, chained_dir = (str(tmp_path / d) for d in ("split", "bg", "trim", "chained"))
+    process_splitter(input_dir, split_dir, tolerance=50, erosion=1, remove_bg=False)
+    process_remover(split_dir, bg_dir, "flood", 30, erosion=1)
+    process_auto_trimmer(bg_dir, trim_dir, padding=10)
+    process_formatter(trim_dir, chained_dir)
+
+    fused_dir = str(tmp_path / "fused")
+    summary = run_fused_pipeline(input_dir, fused_dir, split_tolerance=50, split_erosion=1, split_remove_bg=False,
+                                 remove_bg=True, mode="flood", tolerance=30, erosion=1, trim=True, padding=10)
+
+    chained = read_outputs(chained_dir)
+    assert len(summary["stamps"]) == 34
+    assert set(chained) == {f"{i:02d}.png" for i in range(1, 35)} | {"main.png", "tab.png"}
+    assert read_outputs(fused_dir) == chained
+
+def test_fused_pipeline_cache_reuses_identical_outputs(tmp_path, capsys):
+    input_dir = str(tmp_path / "input")
+    cache_dir = str(tmp_path / "cache")
+    write_sheets(input_dir, layouts=("4x2",), cell_sizes=(120,))
+
+    plain_dir, cold_dir, warm_dir = (str(tmp_path / d) for d in ("plain", "cold", "warm"))
+    run_fused_pipeline(input_dir, plain_dir, remove_bg=True, trim=True)
+    run_fused_pipeline(input_dir, cold_dir, remove_bg=True, trim=True, cache_dir=cache_dir)
+    assert "Cache hit" not in capsys.readouterr().out
+    run_fused_pipeline(input_dir, warm_dir, remove_bg=True, trim=True, cache_dir=cache_dir)
+    assert "Cache hit" in capsys.readouterr().out
+
+    assert read_outputs(cold_dir) == read_outputs(plain_dir)
+    assert read_outputs(warm_dir) == read_outputs(plain_dir)
@@ -0,0 +1,50 @@
+import os
+
+from result_cache import ResultCache, file_digest
+
+def test_miss_then_hit(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = cache.make_key("split", {"tolerance": 50}, "digest")
+    assert cache.get(key) is None
+    cache.put(key, {"01.png": b"png"})
+    assert cache.get(key) == {"01.png": b"png"}
+    assert ResultCache(str(tmp_path)).get(key) == {"01.png": b"png"}
+
+def test_key_depends_on_stage_params_and_upstream(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = cache.make_key("bg", {"tolerance": 30}, "a")
+    assert key == cache.make_key("bg", {"tolerance": 30}, "a")
+    assert key != cache.make_key("bg", {"tolerance": 31}, "a")
+    assert key != cache.make_key("bg", {"tolerance": 30}, "b")
+    assert key != cache.make_key("trim", {"tolerance": 30}, "a")
+
+def test_file_digest_follows_content(tmp_path):
+    path = tmp_path / "sheet.png"
+    path.write_bytes(b"one")
+    first = file_digest(str(path))
+    path.write_bytes(b"two")
+    assert file_digest(str(path)) != first
+
+def test_put_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=2500)
+    keys = [cache.make_key("sheet", {}, str(i)) for i in range(3)]
+    cache.put(keys[0], b"x" * 1000)
+    cache.put(keys[1], b"x" * 1000)
+    # Make keys[0] the most recently used, so keys[1] is evicted first
+    os.utime(cache._path(keys[1]), (1, 1))
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], b"x" * 1000)
+
+    assert cache.size() <= 2500
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = cache.make_key("sheet", {}, "a")
+    cache.put(key, b"data")
+    with open(cache._path(key), "wb") as fp:
+        fp.write(b"not a pickle")
+    assert cache.get(key) is None
+    assert not os.path.exists(cache._path(key))
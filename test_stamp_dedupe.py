@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+from stamp_dedupe import group_near_duplicates, MAX_THRESHOLD
+
+def brute_force_groups(hashes, threshold):
+    """
+    Transitive groups from comparing every pair.
+    """
+    keys = sorted(hashes)
+    group = {key: {key} for key in keys}
+    for i, a in enumerate(keys):
+        for b in keys[i + 1:]:
+            if bin(hashes[a] ^ hashes[b]).count("1") <= threshold and group[a] is not group[b]:
+                merged = group[a] | group[b]
+                for key in merged:
+                    group[key] = merged
+    unique = {id(g): g for g in group.values()}.values()
+    return sorted((sorted(g) for g in unique if len(g) > 1), key=lambda g: g[0])
+
+def near_duplicate_hashes(seed, count=300, bases=60):
+    """
+    Random 64-bit hashes: copies of a few base hashes with some bits flipped, plus noise.
+    """
+    rng = random.Random(seed)
+    base = [rng.getrandbits(64) for _ in range(bases)]
+    hashes = {}
+    for i in range(count):
+        value = rng.choice(base) if i % 3 else rng.getrandbits(64)
+        for bit in rng.sample(range(64), rng.randint(0, MAX_THRESHOLD + 2)):
+            value ^= 1 << bit
+        hashes[f"{i:03d}.png"] = value
+    return hashes
+
+@pytest.mark.parametrize("threshold", [0, 1, 3, 6, 10, MAX_THRESHOLD])
+def test_band_index_matches_brute_force(threshold):
+    for seed in range(3):
+        hashes = near_duplicate_hashes(seed)
+        assert group_near_duplicates(hashes, threshold) == brute_force_groups(hashes, threshold)
+
+def test_threshold_out_of_range():
+    with pytest.raises(ValueError):
+        group_near_duplicates({"a.png": 0}, MAX_THRESHOLD + 1)
@@ -0,0 +1,105 @@
+import os
+
+import cv2
+import pytest
+
+from line_stamp_formatter import process_formatter
+from pipeline import run_fused_pipeline
+import stamp_order
+from stamp_order import StampOrder, ORDER_FILE, STAGING_DIR
+from synthetic_sheets import write_sheets
+
+def make_stamps(folder, count):
+    """
+    Stamps whose content is their original number, so renames can be followed.
+    """
+    os.makedirs(folder, exist_ok=True)
+    for i in range(1, count + 1):
+        with open(os.path.join(folder, f"{i:02d}.png"), "wb") as fp:
+            fp.write(f"stamp {i}".encode())
+
+def contents(folder):
+    return {f: open(os.path.join(folder, f), "rb").read().decode()
+            for f in sorted(os.listdir(folder)) if f.endswith(".png")}
+
+def test_apply_deletes_and_renames_in_order(tmp_path):
+    folder = str(tmp_path)
+    make_stamps(folder, 5)
+    order = StampOrder(folder)
+    order.move("04.png", 0)
+    order.delete(["02.png"])
+    order.save()
+    assert StampOrder(folder).active() == ["04.png", "01.png", "03.png", "05.png"]
+
+    assert order.apply() == 4
+
+    assert contents(folder) == {"01.png": "stamp 4", "02.png": "stamp 1", "03.png": "stamp 3", "04.png": "stamp 5"}
+    assert not os.path.exists(os.path.join(folder, STAGING_DIR))
+    assert StampOrder(folder).active() == ["01.png", "02.png", "03.png", "04.png"]
+
+@pytest.mark.parametrize("phase", ["stage", "place"])
+def test_interrupted_apply_rolls_forward(tmp_path, monkeypatch, phase):
+    folder = str(tmp_path)
+    make_stamps(folder, 5)
+    order = StampOrder(folder)
+    order.move("05.png", 0)
+    order.delete(["03.png"])
+
+    staging = os.path.join(folder, STAGING_DIR)
+    replace = os.replace
+    moves = []
+
+    def crashing_replace(src, dst):
+        # Crash on the second stamp move of the phase
+        if src.endswith(".png") and (os.path.dirname(src) == staging) == (phase == "place"):
+            moves.append(src)
+            if len(moves) == 2:
+                raise OSError("simulated crash")
+        replace(src, dst)
+
+    monkeypatch.setattr(stamp_order.os, "replace", crashing_replace)
+    with pytest.raises(OSError):
+        order.apply()
+    monkeypatch.setattr(stamp_order.os, "replace", replace)
+
+    # Opening the folder again finishes the interrupted apply
+    reopened = StampOrder(folder)
+    assert contents(folder) == {"01.png": "stamp 5", "02.png": "stamp 1", "03.png": "stamp 2", "04.png": "stamp 4"}
+    assert reopened.active() == ["01.png", "02.png", "03.png", "04.png"]
+    assert not os.path.exists(staging)
+
+def curate(output_dir):
+    order = StampOrder(output_dir)
+    order.delete(["05.png", "09.png"])
+    order.move("17.png", 0)
+    order.save()
+
+def test_pipeline_rerun_discards_stale_manifest(tmp_path):
+    input_dir = str(tmp_path / "input")
+    output_dir = str(tmp_path / "output")
+    write_sheets(input_dir, layouts=("4x2", "3x3"), cell_sizes=(120,))
+    run_fused_pipeline(input_dir, output_dir)
+    curate(output_dir)
+
+    run_fused_pipeline(input_dir, output_dir)
+
+    assert not os.path.exists(os.path.join(output_dir, ORDER_FILE))
+    order = StampOrder(output_dir)
+    assert order.active() == [f"{i:02d}.png" for i in range(1, 18)]
+    assert not order.deleted
+
+def test_formatter_rerun_discards_stale_manifest(tmp_path):
+    input_dir = tmp_path / "input"
+    output_dir = str(tmp_path / "output")
+    input_dir.mkdir()
+    for i, path in enumerate(write_sheets(str(tmp_path / "sheets"), layouts=("4x2", "3x3", "4x4"), cell_sizes=(60,))):
+        for j in range(6):
+            cv2.imwrite(str(input_dir / f"{i}_{j}.png"), cv2.imread(path)[: 60 + j, : 60 + j])
+    process_formatter(str(input_dir), output_dir)
+    curate(output_dir)
+
+    process_formatter(str(input_dir), output_dir)
+
+    order = StampOrder(output_dir)
+    assert order.active() == [f"{i:02d}.png" for i in range(1, 19)]
+    assert not order.deleted
@@ -0,0 +1,165 @@
+import json
+import os
+import tempfile
+import threading
+from collections import deque
+
+import cv2
+
+from image_io import decode_image, encode_png, to_bgra, write_bytes
+from result_cache import file_digest, DEFAULT_CACHE_DIR
+
+# Bump when thumbnails of the same image change
+THUMB_VERSION = 1
+
+THUMB_SIZE = 96        # longest side of a thumbnail (px)
+DEFAULT_THUMB_DIR = os.path.join(DEFAULT_CACHE_DIR, "thumbs")
+
+def file_version(path):
+    """
+    (size, mtime_ns) of a file: changes when the file is rewritten or replaced.
+    """
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+def make_thumbnail(img, size=THUMB_SIZE):
+    """
+    BGRA thumbnail whose longest side is size (never enlarged).
+    """
+    img = to_bgra(img)
+    h, w = img.shape[:2]
+    scale = min(1.0, size / max(h, w))
+    if scale < 1.0:
+        img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    return img
+
+class ThumbnailCache(object):
+    """
+    On-disk thumbnail cache. Files are matched by path + size + mtime first and by
+    content digest otherwise (index.json), and thumbnails are stored as
+    <digest>_<size>.png, so reopening a folder reads no source image and renamed
+    stamps keep their thumbnail. Not thread-safe: use from one thread (ThumbnailLoader).
+    """
+
+    def __init__(self, cache_dir=DEFAULT_THUMB_DIR, size=THUMB_SIZE):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.files = {}    # abs path -> [size, mtime_ns, digest]
+        self._dirty = False
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if data.get("version") == THUMB_VERSION:
+                self.files = data["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _thumb_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}_{self.size}.png")
+
+    def get(self, path):
+        """
+        Returns the BGRA thumbnail of an image file, or None if it cannot be read.
+        """
+        key = os.path.abspath(path)
+        st = os.stat(path)
+        entry = self.files.get(key)
+        if entry is None or entry[:2] != [st.st_size, st.st_mtime_ns]:
+            entry = [st.st_size, st.st_mtime_ns, file_digest(path)]
+            self.files[key] = entry
+            self._dirty = True
+
+        thumb_path = self._thumb_path(entry[2])
+        if os.path.exists(thumb_path):
+            thumb = decode_image(thumb_path)
+            if thumb is not None:
+                return thumb
+
+        img = decode_image(path)
+        if img is None:
+            return None
+        thumb = make_thumbnail(img, self.size)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{thumb_path}.tmp"
+        write_bytes(tmp_path, encode_png(thumb, "fast"))
+        os.replace(tmp_path, thumb_path)
+        return thumb
+
+    def save(self):
+        """
+        Drops entries of deleted files and their unused thumbnails, and writes the
+        index atomically (only if it changed).
+        """
+        if not self._dirty:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.files = {path: entry for path, entry in self.files.items() if os.path.exists(path)}
+        digests = {entry[2] for entry in self.files.values()}
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".png") and name.split("_", 1)[0] not in digests:
+                os.remove(os.path.join(self.cache_dir, name))
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fp:
+                json.dump({"version": THUMB_VERSION, "files": self.files}, fp)
+            os.replace(tmp_path, self.index_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._dirty = False
+
+class ThumbnailLoader(object):
+    """
+    Background thread that fills thumbnails on demand.
+    request(paths) never blocks and replaces the pending paths, so scrolling loads
+    what is visible now instead of every row scrolled past. The index is saved
+    whenever the queue runs empty.
+    on_result(path, thumb, error, version) is called from the worker thread; version is
+    the file_version taken before the thumbnail was made (None when the file is gone),
+    so a file replaced meanwhile never looks current.
+    """
+
+    def __init__(self, cache, on_result):
+        self.cache = cache
+        self.on_result = on_result
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, paths):
+        with self._cond:
+            self._pending = deque(paths)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._pending.clear()
+            self._closed = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    break
+                path = self._pending.popleft()
+                idle = not self._pending
+            version = None
+            try:
+                version = file_version(path)
+                self.on_result(path, self.cache.get(path), None, version)
+            except Exception as e:
+                self.on_result(path, None, e, version)
+            if idle:
+                try:
+                    self.cache.save()
+                except OSError as e:
+                    print(f"Thumbnail index not saved: {e}")
+        self.cache.save()
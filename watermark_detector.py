@@ -0,0 +1,140 @@
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+from image_io import decode_image, to_bgra
+from stamp_dedupe import thumbnail
+from stamp_export import list_stamp_files
+
+THUMB_SIZE = 64          # stamps are compared as THUMB_SIZE x THUMB_SIZE thumbnails
+DEFAULT_REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "watermark_ref.png")
+DEFAULT_MIN_SCORE = 0.8       # template match: normalized correlation with the reference
+DEFAULT_MAX_COVERAGE = 0.06   # heuristic: at most this fraction of the canvas is opaque
+
+def thumbnails(imgs, size=THUMB_SIZE):
+    """
+    Returns (gray, alpha) float32 stacks of shape (N, size, size): the stamps composited
+    onto white in grayscale, and their alpha (0-1). Areas are averaged when shrinking,
+    so alpha.mean() per stamp is its opaque coverage.
+    imgs may be any iterable; each image is only used while its thumbnail is made.
+    """
+    grays = []
+    alphas = []
+    for img in imgs:
+        img = to_bgra(img)
+        grays.append(thumbnail(img, (size, size)))
+        alphas.append((cv2.resize(img[:, :, 3], (size, size), interpolation=cv2.INTER_AREA) / 255.0).astype(np.float32))
+    if not grays:
+        empty = np.empty((0, size, size), dtype=np.float32)
+        return empty, empty.copy()
+    return np.stack(grays), np.stack(alphas)
+
+def _features(gray, alpha):
+    """
+    Flattened, zero-mean, unit-length (gray, alpha) vectors, so a dot product is the
+    normalized correlation.
+    """
+    feats = np.concatenate([gray.reshape(len(gray), -1) / 255.0, alpha.reshape(len(alpha), -1)], axis=1)
+    feats -= feats.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(feats, axis=1, keepdims=True)
+    return feats / np.maximum(norms, 1e-6)
+
+def match_scores(gray, alpha, reference):
+    """
+    Normalized correlation (-1..1) of every thumbnail in the stacks with a reference image.
+    """
+    ref_gray, ref_alpha = thumbnails([reference], gray.shape[1])
+    return _features(gray, alpha) @ _features(ref_gray, ref_alpha)[0]
+
+def detect_watermarks(imgs, reference=None, min_score=DEFAULT_MIN_SCORE, max_coverage=DEFAULT_MAX_COVERAGE):
+    """
+    Finds watermark stamps among decoded images in one vectorized pass over their
+    thumbnails. imgs may be a generator (see find_watermark_files), so only one
+    full-size image is held at a time. With a reference image, stamps that match it (score >= min_score) are watermarks;
+    without one, stamps whose opaque coverage is at most max_coverage are.
+    Returns [(index, value)] with value the match score or the coverage.
+    """
+    gray, alpha = thumbnails(imgs)
+    if not len(gray):
+        return []
+    if reference is not None:
+        scores = match_scores(gray, alpha, reference)
+        return [(int(i), float(scores[i])) for i in np.flatnonzero(scores >= min_score)]
+    coverage = alpha.mean(axis=(1, 2))
+    return [(int(i), float(coverage[i])) for i in np.flatnonzero(coverage <= max_coverage)]
+
+def find_watermark_files(output_dir, reference_path=None, min_score=DEFAULT_MIN_SCORE, max_coverage=DEFAULT_MAX_COVERAGE):
+    """
+    Runs detect_watermarks over the stamps of output_dir (main/tab excluded).
+    reference_path: template image; None uses DEFAULT_REFERENCE when it exists,
+    otherwise the coverage heuristic.
+    Returns [(filename, value)].
+    """
+    if reference_path is None and os.path.exists(DEFAULT_REFERENCE):
+        reference_path = DEFAULT_REFERENCE
+    reference = None
+    if reference_path:
+        reference = decode_image(reference_path)
+        if reference is None:
+            raise ValueError(f"Could not read reference {reference_path}")
+
+    stamp_files, _ = list_stamp_files(output_dir)
+    names = []
+
+    # Decoded one at a time: only the thumbnails of the whole folder are kept
+    def decoded():
+        for f in stamp_files:
+            img = decode_image(os.path.join(output_dir, f))
+            if img is None:
+                print(f"Could not read {f}")
+                continue
+            names.append(f)
+            yield img
+
+    return [(names[i], value) for i, value in detect_watermarks(decoded(), reference, min_score, max_coverage)]
+
+def delete_files(output_dir, filenames):
+    """
+    Deletes filenames from output_dir. Returns the deleted filenames.
+    """
+    deleted = []
+    for filename in filenames:
+        try:
+            os.remove(os.path.join(output_dir, filename))
+            deleted.append(filename)
+        except OSError as e:
+            print(f"Failed to delete {filename}: {e}")
+    return deleted
+
+def main():
+    parser = argparse.ArgumentParser(description="Watermark stamp detector")
+    parser.add_argument("--input", default="output_final", help="Stamp folder to scan")
+    parser.add_argument("--reference", default=None, help="Watermark template image (default: watermark_ref.png next to this script, if any)")
+    parser.add_argument("--min_score", type=float, default=DEFAULT_MIN_SCORE, help="Template match score (0-1) that counts as a watermark")
+    parser.add_argument("--max_coverage", type=float, default=DEFAULT_MAX_COVERAGE, help="Without a reference: max opaque fraction of a watermark stamp")
+    parser.add_argument("--delete", action="store_true", help="Delete the detected files (default: report only)")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"Error: '{args.input}' directory not found.")
+        return
+
+    try:
+        found = find_watermark_files(args.input, args.reference, args.min_score, args.max_coverage)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+
+    for filename, value in found:
+        print(f"Watermark: {filename} ({value:.3f})")
+    if args.delete:
+        deleted = delete_files(args.input, [f for f, _ in found])
+        print(f"Deleted {len(deleted)} files.")
+    else:
+        print(f"{len(found)} watermark files found.")
+
+if __name__ == "__main__":
+    main()